@@ -0,0 +1,377 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Сквозной замер производительности загрузчика без доступа к Яндекс Музыке.
+
+Поднимает локальный сервер (fake_server.py) и прогоняет через настоящий движок YandexMusicDownloader режимы
+загрузки, обновления метаданных, обновления любимых треков и добавления в базу данных. Для каждого режима выводит
+треки в секунду, МБ/с и перцентили p50/p95/p99 времени обработки одного трека.
+
+Пример запуска из корня репозитория:
+    python benchmarks/e2e.py --profile broadband --tracks 500
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib.util
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_FOLDER)
+
+from yandex_music import ClientAsync
+
+import config
+from custom_formatter import CustomFormatter
+from transport import HttpTransport, PooledRequest
+from limiter import RateLimiter
+from run_log import RunLog
+from journal import get_track_key
+from resilience import call_with_retries
+
+from fake_server import FakeYandexMusicServer, PROFILES, USER_ID, PLAYLIST_KIND
+
+DOWNLOAD = 'download'
+UPDATE = 'update'
+UPDATE_LIKED = 'update_liked'
+ADD_TO_DATABASE = 'add_to_database'
+
+# Обновление метаданных и любимых треков работает с тем, что оставила загрузка, поэтому порядок важен
+MODES = (DOWNLOAD, UPDATE, UPDATE_LIKED, ADD_TO_DATABASE)
+
+
+def _load_downloader_module():
+    """
+    Загружает ymd-r.py как модуль (имя файла не позволяет импортировать его обычным способом)
+    :return: модуль загрузчика
+    """
+    spec = importlib.util.spec_from_file_location('ymd', os.path.join(ROOT_FOLDER, 'ymd-r.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalRequest(PooledRequest):
+    """
+    Запрос через общий пул, который ходит на локальный сервер по http. Библиотека сама собирает ссылки
+    на аудиофайлы и обложки с https, а локальный сервер работает без TLS.
+    """
+
+    @staticmethod
+    def _to_http(url: str) -> str:
+        return 'http://' + url[len('https://'):] if url.startswith('https://') else url
+
+    async def _request_wrapper(self, method, url, *args, **kwargs):
+        return await super()._request_wrapper(method, self._to_http(url), *args, **kwargs)
+
+    async def download(self, url, filename, *args, **kwargs) -> None:
+        return await super().download(self._to_http(url), filename, *args, **kwargs)
+
+
+class Widget(dict):
+    """
+    Замена виджетов tkinter, которые обработчик плейлиста обновляет по ходу работы
+    """
+
+    def config(self, **kwargs):
+        self.update(kwargs)
+
+    def __getitem__(self, key):
+        return self.get(key, '')
+
+
+def _percentile(values: list, percent: float) -> float:
+    """
+    Возвращает перцентиль по ближайшему рангу
+    :param values: отсортированный список значений
+    :param percent: перцентиль (0 - 100)
+    :return: значение перцентиля или 0, если список пуст
+    """
+    if not values:
+        return 0.0
+    rank = max(int(len(values) * percent / 100 + 0.999999), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class EndToEndBenchmark:
+    """
+    Прогон режимов загрузчика против локального сервера
+    """
+
+    def __init__(self, server: FakeYandexMusicServer, work_folder: str, number_of_workers: int,
+                 requests_per_second: float):
+        """
+        :param server: запущенный локальный сервер
+        :param work_folder: папка для загрузок и базы данных
+        :param number_of_workers: количество обработчиков
+        :param requests_per_second: ограничение количества запросов в секунду (0 - без ограничения)
+        """
+        self.server = server
+        self.work_folder = work_folder
+        self.ymd = _load_downloader_module()
+
+        self.downloader = self.ymd.YandexMusicDownloader()
+        downloader = self.downloader
+        downloader.main_thread_state = True
+        downloader.number_of_workers = number_of_workers
+        downloader.tracks_window_size = config.TRACKS_WINDOW_SIZE
+        downloader.hydration_batch_size = config.HYDRATION_BATCH_SIZE
+        downloader.limiter = RateLimiter(requests_per_second=requests_per_second, bytes_per_second=0)
+        downloader.transport = HttpTransport(pool_size=number_of_workers,
+                                             pool_size_per_host=number_of_workers,
+                                             keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+                                             dns_cache_ttl=config.HTTP_DNS_CACHE_TTL,
+                                             limiter=downloader.limiter)
+        downloader.transport.start()
+        downloader.async_client = ClientAsync(token='benchmark', base_url=server.base_url,
+                                              request=LocalRequest(downloader.transport))
+        downloader.playlists = []
+
+    def close(self):
+        self.downloader.transport.close()
+
+    def _request(self, func, **kwargs):
+        """
+        Выполняет подготовительный запрос с повторами, чтобы ошибки сервера не обрывали замер до его начала
+        :param func: асинхронная функция запроса
+        :return: результат запроса
+        """
+        return self.downloader.transport.run(call_with_retries(func, attempts=config.RETRY_ATTEMPTS,
+                                                               base_delay=config.RETRY_BASE_DELAY,
+                                                               max_delay=config.RETRY_MAX_DELAY, **kwargs))
+
+    def _get_playlist(self):
+        """
+        Запрашивает плейлист у сервера (каждый режим получает свои объекты треков, как при настоящем запуске)
+        :return: плейлист
+        """
+        return self._request(self.downloader.async_client.users_playlists, kind=PLAYLIST_KIND, user_id=USER_ID)
+
+    def _get_liked_track_ids(self) -> frozenset:
+        likes = self._request(self.downloader.async_client.users_likes_tracks, user_id=USER_ID)
+        return frozenset(get_track_key(track) for track in likes)
+
+    def run_mode(self, mode: str) -> dict:
+        """
+        Прогоняет один режим и собирает результаты
+        :param mode: режим
+        :return: словарь с результатами
+        """
+        downloader = self.downloader
+        playlist = self._get_playlist()
+        playlist_title = self.ymd.strip_bad_symbols(playlist.title)
+        download_folder_path = os.path.join(self.work_folder, 'download', playlist_title)
+        os.makedirs(os.path.join(download_folder_path, 'covers'), exist_ok=True)
+        os.makedirs(os.path.join(download_folder_path, 'info'), exist_ok=True)
+
+        # Добавление в базу замеряется на чистой базе, иначе все треки уже будут в ней после загрузки
+        database_name = 'history-add.db' if mode == ADD_TO_DATABASE else 'history.db'
+        downloader.history_database_path = os.path.join(self.work_folder, database_name)
+        downloader._database_create_tables()
+
+        filenames, run_log = '', None
+        if mode in (DOWNLOAD, ADD_TO_DATABASE):
+            filenames = {
+                'e': os.path.join(download_folder_path, 'info', f'download_errors-{playlist_title}.txt'),
+                'd': os.path.join(download_folder_path, 'info', f'downloaded_tracks-{playlist_title}.txt'),
+                's': os.path.join(download_folder_path, 'info', f'skipped_tracks-{playlist_title}.txt'),
+                'jsonl': os.path.join(download_folder_path, 'info', f'tracks-{playlist_title}.jsonl')
+            }
+            # Файлы отчёта открывает движок
+            run_log = RunLog(filenames, flush_interval=config.RUN_LOG_FLUSH_INTERVAL)
+
+        # Любимые треки обновляются одной операцией: запрос списка любимых и обновление базы одной транзакцией.
+        # Список запрашивается внутри замера, поэтому здесь обработчик создаётся без него.
+        is_single_operation = mode == UPDATE_LIKED
+        liked_track_ids = frozenset() if is_single_operation else self._get_liked_track_ids()
+        helper = downloader.DownloaderHelper(
+            progress_bar=Widget(),
+            label_value=Widget(text='Прогресс: 0'),
+            download_folder_path=download_folder_path,
+            history_database_path=downloader.history_database_path,
+            is_rewritable=False,
+            download_only_new=False,
+            filenames=filenames,
+            run_log=run_log,
+            playlist_title=playlist_title,
+            playlist_kind=playlist.kind,
+            number_tracks_in_playlist=playlist.track_count,
+            liked_track_ids=liked_track_ids,
+            add_track_id_to_name=False,
+            main_thread_state=lambda: True,
+            child_thread_state=lambda: True,
+            update_mode=mode == UPDATE,
+            update_liked=mode == UPDATE_LIKED,
+            only_add_to_database=mode == ADD_TO_DATABASE
+        )
+        latencies = self._wrap_track_handlers(helper)
+
+        requests_before, errors_before = self.server.requests, self.server.errors
+        started = time.perf_counter()
+        try:
+            if is_single_operation:
+                helper.liked_track_ids = self._get_liked_track_ids()
+            is_completed = downloader.transport.run(downloader._process_tracks_async(
+                tracks=playlist.tracks,
+                helper=helper,
+                playlist_title=playlist_title,
+                playlist_kind=playlist.kind,
+                child_thread_state=lambda: True
+            ))
+        finally:
+            if run_log is not None:
+                run_log.close()
+        elapsed = time.perf_counter() - started
+
+        counters = helper.analyzed_and_downloaded_tracks
+        stages = helper.metrics.snapshot()['stages']
+        transferred = stages['transfer']['bytes'] + stages['cover']['bytes']
+        tracks = counters['a']
+        latencies.sort()
+        return {
+            'mode': mode,
+            'completed': is_completed,
+            'is_single_operation': is_single_operation,
+            'tracks': tracks,
+            'counters': counters,
+            'elapsed': elapsed,
+            'tracks_per_second': tracks / elapsed if elapsed else 0.0,
+            'megabytes_per_second': transferred / 1024 / 1024 / elapsed if elapsed else 0.0,
+            # Для одной операции процентили по трекам не имеют смысла, у неё есть только общая длительность
+            'latency_ms': {} if is_single_operation else {name: _percentile(latencies, percent) * 1000
+                                                          for name, percent in (('p50', 50), ('p95', 95), ('p99', 99))},
+            'requests': self.server.requests - requests_before,
+            'server_errors': self.server.errors - errors_before,
+            'stages': {stage: {'count': statistics['count'], 'errors': statistics['errors'],
+                               'duration_mean_ms': statistics['duration_mean'] * 1000}
+                       for stage, statistics in stages.items() if statistics['count'] or statistics['errors']}
+        }
+
+    @staticmethod
+    def _wrap_track_handlers(helper) -> list:
+        """
+        Оборачивает обработку одного трека в обработчике плейлиста замером времени
+        :param helper: обработчик плейлиста
+        :return: список, в который попадают длительности обработки треков в секундах
+        """
+        latencies = []
+
+        def _timed(func):
+            async def wrapper(track):
+                started = time.perf_counter()
+                try:
+                    return await func(track)
+                finally:
+                    latencies.append(time.perf_counter() - started)
+            return wrapper
+
+        helper.download_track = _timed(helper.download_track)
+        helper.update_track_metadata = _timed(helper.update_track_metadata)
+        helper.add_track_to_database = _timed(helper.add_track_to_database)
+        return latencies
+
+
+def _format_result(result: dict) -> str:
+    errors = f'ошибок {result["counters"]["e"]} (сервер {result["server_errors"]}), запросов {result["requests"]}'
+    if result['is_single_operation']:
+        return (f'{result["mode"]:<16} 1 операция ({result["tracks"]} треков) за {result["elapsed"] * 1000:.1f} мс | '
+                f'обновлено {result["counters"]["u"]} | {errors}')
+
+    latency = result['latency_ms']
+    return (f'{result["mode"]:<16} {result["tracks"]:>6} треков за {result["elapsed"]:7.2f} с | '
+            f'{result["tracks_per_second"]:8.1f} трек/с | {result["megabytes_per_second"]:7.2f} МБ/с | '
+            f'p50 {latency["p50"]:7.1f} мс, p95 {latency["p95"]:7.1f} мс, p99 {latency["p99"]:7.1f} мс | '
+            f'{errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сквозной замер загрузчика против локального сервера.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='local', help='профиль сети')
+    parser.add_argument('--tracks', type=int, default=200, help='количество треков в плейлисте')
+    parser.add_argument('--latency', type=float, help='задержка ответа в секундах (вместо значения профиля)')
+    parser.add_argument('--bandwidth', type=float, help='скорость отдачи файлов в КБ/с (вместо значения профиля)')
+    parser.add_argument('--error-rate', type=float, help='доля ответов с ошибкой 500 (вместо значения профиля)')
+    parser.add_argument('--audio-size', type=int, default=512, help='размер аудиофайла в КБ')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'режимы через запятую из {", ".join(MODES)}')
+    parser.add_argument('--workers', type=int, default=config.NUMBER_OF_WORKERS, help='количество обработчиков')
+    parser.add_argument('--requests-per-second', type=float, default=0,
+                        help='ограничение количества запросов в секунду (0 - без ограничения)')
+    parser.add_argument('--short-tracks', action='store_true',
+                        help='отдавать в плейлисте только идентификаторы треков (проверяет догрузку треков)')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора ошибок')
+    parser.add_argument('--json', help='файл для сохранения результатов в формате JSON')
+    parser.add_argument('--verbose', action='store_true', help='выводить журнал загрузчика')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f'неизвестный режим: {mode}')
+
+    profile = dict(PROFILES[args.profile])
+    if args.latency is not None:
+        profile['latency'] = args.latency
+    if args.bandwidth is not None:
+        profile['bandwidth'] = args.bandwidth * 1024 or None
+    if args.error_rate is not None:
+        profile['error_rate'] = args.error_rate
+
+    server = FakeYandexMusicServer(playlist_size=args.tracks, latency=profile['latency'],
+                                   bandwidth=profile['bandwidth'], error_rate=profile['error_rate'],
+                                   audio_size=args.audio_size * 1024, embed_tracks=not args.short_tracks,
+                                   seed=args.seed)
+    server.start()
+
+    work_folder = tempfile.mkdtemp(prefix='ymd-benchmark-')
+    benchmark = None
+    results = []
+    try:
+        benchmark = EndToEndBenchmark(server, work_folder, number_of_workers=args.workers,
+                                      requests_per_second=args.requests_per_second)
+        logger = benchmark.ymd.logger
+        if args.verbose:
+            handler = logging.StreamHandler()
+            handler.setFormatter(CustomFormatter())
+            logger.addHandler(handler)
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.CRITICAL)
+
+        print(f'Профиль [{args.profile}]: {profile}, треков: {args.tracks}, обработчиков: {args.workers}.')
+        for mode in modes:
+            result = benchmark.run_mode(mode)
+            results.append(result)
+            print(_format_result(result))
+    finally:
+        if benchmark is not None:
+            benchmark.close()
+        server.close()
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'profile': args.profile, 'settings': profile, 'tracks': args.tracks, 'workers': args.workers,
+                       'time': time.time(), 'results': results}, file, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Локальная замена API Яндекс Музыки для замеров производительности.
+
+Сервер отдаёт плейлист, треки, информацию о загрузке, обложки, дополнительную информацию (текст песни)
+и аудиофайлы. Задержка ответа, пропускная способность соединения и доля ошибок настраиваются.
+"""
+
+import zlib
+import random
+import asyncio
+import threading
+
+from aiohttp import web
+
+# Профили сети: задержка ответа в секундах, скорость отдачи файлов в байтах в секунду (None - без ограничения)
+# и доля запросов, завершающихся ошибкой 500
+PROFILES = {
+    'local': {'latency': 0.0, 'bandwidth': None, 'error_rate': 0.0},
+    'broadband': {'latency': 0.03, 'bandwidth': 5 * 1024 * 1024, 'error_rate': 0.0},
+    'mobile': {'latency': 0.12, 'bandwidth': 512 * 1024, 'error_rate': 0.01},
+    'flaky': {'latency': 0.05, 'bandwidth': 2 * 1024 * 1024, 'error_rate': 0.1},
+}
+
+USER_ID = 1000
+PLAYLIST_KIND = 3
+PLAYLIST_TITLE = 'Benchmark'
+
+CHUNK_SIZE = 64 * 1024
+COVER_SIZE = 16 * 1024
+
+# Заголовок кадра MPEG-1 Layer III: 128 кбит/с, 44100 Гц, joint stereo. Длина кадра - 417 байт.
+_MP3_FRAME = b'\xff\xfb\x90\x44' + bytes(413)
+# Пустой тег ID3v2.4, чтобы метаданные записывались так же, как в настоящие файлы
+_ID3_HEADER = b'ID3\x04\x00\x00\x00\x00\x00\x00'
+# Обложка: заголовок JPEG, дополненный нулями до размера настоящей обложки 300x300
+COVER = b'\xff\xd8\xff\xe0' + bytes(COVER_SIZE - 4)
+
+
+def make_audio(size: int) -> bytes:
+    """
+    Создаёт корректный MP3 файл из пустых кадров
+    :param size: примерный размер файла в байтах
+    :return: содержимое файла
+    """
+    return _ID3_HEADER + _MP3_FRAME * max(size // len(_MP3_FRAME), 1)
+
+
+def make_track_data(track_id: str, host: str) -> dict:
+    """
+    Создаёт описание трека в формате API
+    :param track_id: идентификатор трека
+    :param host: адрес сервера, с которого отдаются обложки
+    :return: словарь трека
+    """
+    number = int(track_id)
+    album_id = number // 10 + 1
+    artist = {'id': number % 50 + 1, 'name': f'Artist {number % 50 + 1}', 'various': False, 'composer': False,
+              'genres': []}
+    return {
+        'id': track_id,
+        'realId': track_id,
+        'title': f'Track {number}',
+        'available': True,
+        'durationMs': 180000,
+        'artists': [artist],
+        'albums': [{
+            'id': album_id,
+            'title': f'Album {album_id}',
+            'genre': 'pop',
+            'year': 2020,
+            'trackCount': 10,
+            'artists': [artist],
+            'labels': [],
+            'bests': [],
+            'available': True,
+            'trackPosition': {'volume': 1, 'index': number % 10 + 1}
+        }],
+        'coverUri': f'{host}/covers/{track_id}/%%',
+        'lyricsAvailable': True
+    }
+
+
+class FakeYandexMusicServer:
+    """
+    HTTP сервер, повторяющий используемую часть API Яндекс Музыки. Работает в отдельном потоке со своим циклом
+    событий, чтобы не делить процессорное время с движком загрузки внутри одного цикла.
+    """
+
+    def __init__(self, playlist_size: int, latency: float, bandwidth, error_rate: float, audio_size: int,
+                 embed_tracks: bool = True, liked_ratio: float = 0.1, seed: int = 0):
+        """
+        :param playlist_size: количество треков в плейлисте
+        :param latency: задержка каждого ответа в секундах
+        :param bandwidth: скорость отдачи файлов в байтах в секунду (None - без ограничения)
+        :param error_rate: доля запросов, завершающихся ошибкой 500
+        :param audio_size: размер аудиофайла в байтах
+        :param embed_tracks: отдавать ли полные треки в плейлисте (иначе клиент запрашивает их отдельно)
+        :param liked_ratio: доля любимых треков
+        :param seed: начальное значение генератора ошибок
+        """
+        self.playlist_size = playlist_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.embed_tracks = embed_tracks
+        self.liked_ratio = liked_ratio
+
+        self.audio = make_audio(audio_size)
+        self.host = None
+        self.base_url = None
+        self.requests = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='FakeYandexMusicServer', daemon=True)
+        self._runner = None
+
+    def start(self):
+        """
+        Запускает сервер на свободном порту локального адреса
+        :return:
+        """
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes([
+            web.get(f'/users/{USER_ID}/playlists/{PLAYLIST_KIND}', self._playlist),
+            web.get(f'/users/{USER_ID}/likes/tracks', self._likes),
+            web.post('/tracks', self._tracks),
+            web.get('/tracks/{track_id}/download-info', self._download_info),
+            web.get('/tracks/{track_id}/supplement', self._supplement),
+            web.get('/download-info/{track_id}/{codec}/{bitrate}', self._download_info_xml),
+            web.get('/get-mp3/{sign}/{ts}/audio/{track_id}', self._audio),
+            web.get('/covers/{track_id}/{size}', self._cover),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.host = f'127.0.0.1:{port}'
+        self.base_url = f'http://{self.host}'
+
+    def close(self):
+        """
+        Останавливает сервер
+        :return:
+        """
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'error': 'server-error', 'error_description': 'Fake error'}, status=500)
+        return await handler(request)
+
+    @staticmethod
+    def _result(result) -> web.Response:
+        return web.json_response({'invocationInfo': {'hostname': 'fake', 'req-id': 'fake'}, 'result': result})
+
+    def get_track_ids(self) -> list:
+        return [str(track_id) for track_id in range(1, self.playlist_size + 1)]
+
+    async def _playlist(self, request: web.Request) -> web.Response:
+        tracks = []
+        for track_id in self.get_track_ids():
+            track_short = {'id': track_id, 'timestamp': '2022-09-01T00:00:00+00:00'}
+            if self.embed_tracks:
+                track_short['track'] = make_track_data(track_id, self.host)
+            tracks.append(track_short)
+        return self._result({
+            'owner': {'uid': USER_ID, 'login': 'benchmark', 'name': 'benchmark', 'verified': False},
+            'uid': USER_ID,
+            'kind': PLAYLIST_KIND,
+            'title': PLAYLIST_TITLE,
+            'trackCount': len(tracks),
+            'revision': 1,
+            'snapshot': 1,
+            'visibility': 'private',
+            'available': True,
+            'tracks': tracks
+        })
+
+    async def _likes(self, request: web.Request) -> web.Response:
+        track_ids = self.get_track_ids()
+        liked_ids = track_ids[:int(len(track_ids) * self.liked_ratio)]
+        return self._result({'library': {
+            'uid': USER_ID,
+            'revision': 1,
+            'tracks': [{'id': track_id, 'albumId': str(int(track_id) // 10 + 1),
+                        'timestamp': '2022-09-01T00:00:00+00:00'} for track_id in liked_ids]
+        }})
+
+    async def _tracks(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        track_ids = [track_id.split(':')[0] for value in data.getall('track-ids', [])
+                     for track_id in value.split(',')]
+        return self._result([make_track_data(track_id, self.host) for track_id in track_ids])
+
+    async def _download_info(self, request: web.Request) -> web.Response:
+        track_id = request.match_info['track_id']
+        return self._result([{
+            'codec': 'mp3',
+            'bitrateInKbps': bitrate,
+            'gain': False,
+            'preview': False,
+            'downloadInfoUrl': f'{self.base_url}/download-info/{track_id}/mp3/{bitrate}',
+            'direct': False
+        } for bitrate in (320, 192)])
+
+    async def _download_info_xml(self, request: web.Request) -> web.Response:
+        track_id = request.match_info['track_id']
+        return web.Response(text=f'<?xml version="1.0" encoding="utf-8"?><download-info><host>{self.host}</host>'
+                                 f'<path>/audio/{track_id}</path><ts>0</ts><region>0</region>'
+                                 f'<s>fake</s></download-info>', content_type='text/xml')
+
+    async def _supplement(self, request: web.Request) -> web.Response:
+        track_id = request.match_info['track_id']
+        return self._result({
+            'id': track_id,
+            'lyrics': {'id': int(track_id), 'lyrics': 'La la la', 'fullLyrics': 'La la la\n' * 40,
+                       'hasRights': True, 'textLanguage': 'en', 'showTranslation': False},
+            'videos': [],
+            'radioIsAvailable': False
+        })
+
+    async def _send_file(self, request: web.Request, content: bytes, content_type: str) -> web.StreamResponse:
+        start = 0
+        status = 200
+        etag = f'"{zlib.crc32(content):08x}-{len(content)}"'
+        headers = {'Content-Type': content_type, 'ETag': etag}
+        content_range = request.headers.get('Range', '')
+        # Если файл изменился (If-Range не совпал), то он отдаётся целиком
+        if content_range.startswith('bytes=') and request.headers.get('If-Range', etag) == etag:
+            start = int(content_range[len('bytes='):].split('-')[0] or 0)
+            if start >= len(content):
+                return web.Response(status=416)
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{len(content) - 1}/{len(content)}'
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(content) - start
+        await response.prepare(request)
+        for offset in range(start, len(content), CHUNK_SIZE):
+            chunk = content[offset:offset + CHUNK_SIZE]
+            await response.write(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        await response.write_eof()
+        return response
+
+    async def _audio(self, request: web.Request) -> web.StreamResponse:
+        return await self._send_file(request, self.audio, 'audio/mpeg')
+
+    async def _cover(self, request: web.Request) -> web.StreamResponse:
+        return await self._send_file(request, COVER, 'image/jpeg')
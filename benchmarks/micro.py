@@ -0,0 +1,286 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Микрозамеры функций, которые вызываются несколько раз на каждый трек.
+
+Каждый замер повторяется несколько раз, в результат идут минимальное и медианное время одного вызова.
+Результаты сохраняются в benchmarks/results, и с ними можно сравнить следующий запуск: для каждого замера выводится
+ускорение относительно прошлого запуска (больше 1 - быстрее).
+
+Пример запуска из корня репозитория:
+    python benchmarks/micro.py
+    python benchmarks/micro.py --compare benchmarks/results/micro-20221001-120000.json
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import sqlite3
+import tempfile
+import timeit
+
+from yandex_music import Client, Track
+from yandex_music.utils.request import Request
+
+from e2e import ROOT_FOLDER, Widget, _load_downloader_module
+from fake_server import make_audio, make_track_data, COVER, PLAYLIST_KIND
+
+import library
+from library import KnownTracks
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Количество любимых треков для замера проверки лайка
+LIKED_TRACKS = 100_000
+# Размер истории, на которой замеряются проверка трека в базе данных и загрузка известных треков плейлиста
+HISTORY_SIZES = (10_000, 1_000_000)
+AUDIO_SIZE = 4 * 1024 * 1024
+
+
+class MicroBenchmarks:
+    """
+    Набор замеров. Данные для замера создаются только перед ним, поэтому отфильтрованные замеры
+    не тратят время на подготовку (например, на историю из миллиона треков).
+    """
+
+    def __init__(self, work_folder: str):
+        """
+        :param work_folder: временная папка для файлов замера
+        """
+        self.work_folder = work_folder
+        self.ymd = _load_downloader_module()
+        self.ymd.logger.setLevel(logging.CRITICAL)
+
+        # Клиент нужен только для разбора треков, к сети он не обращается
+        self.client = Client()
+        self.track = self._create_track('1234567')
+        self.track.title = 'Песня: "вторая" / часть #1?'
+        self.track.version = 'Live at <Arena>'
+        self.cases = {
+            'strip_bad_symbols[soft]': self._strip_bad_symbols(soft_mode=True),
+            'strip_bad_symbols[hard]': self._strip_bad_symbols(soft_mode=False),
+            '_get_track_name': self._get_track_name(add_track_id_to_name=False),
+            '_get_track_name[id]': self._get_track_name(add_track_id_to_name=True),
+            '_get_track_name[no strip]': self._get_track_name(add_track_id_to_name=False, need_strip=False),
+            '_is_track_liked[hit]': self._is_track_liked(is_liked=True),
+            '_is_track_liked[miss]': self._is_track_liked(is_liked=False),
+            '_write_track_metadata': self._write_track_metadata,
+        }
+        # Проверка трека идёт по известным трекам в памяти, а сама база читается один раз в начале запуска
+        for size in HISTORY_SIZES:
+            self.cases[f'_is_track_in_database[KnownTracks {size}, hit]'] = \
+                self._is_track_in_database(size, is_known=True)
+            self.cases[f'_is_track_in_database[KnownTracks {size}, miss]'] = \
+                self._is_track_in_database(size, is_known=False)
+        for size in HISTORY_SIZES:
+            self.cases[f'KnownTracks[history.db {size}]'] = self._load_known_tracks(size)
+
+    def _create_track(self, track_id: str) -> Track:
+        # Ключи ответа переводятся в snake_case так же, как при разборе ответа сервера
+        data = json.loads(json.dumps(make_track_data(track_id, '127.0.0.1')), object_hook=Request._object_hook)
+        return Track.de_json(data, client=self.client)
+
+    def _create_helper(self, liked_track_ids: frozenset = frozenset(), add_track_id_to_name: bool = False):
+        return self.ymd.YandexMusicDownloader.DownloaderHelper(
+            progress_bar=Widget(),
+            label_value=Widget(text='Прогресс: 0'),
+            download_folder_path=self.work_folder,
+            history_database_path=os.path.join(self.work_folder, 'history.db'),
+            is_rewritable=False,
+            download_only_new=False,
+            filenames='',
+            run_log=None,
+            playlist_title='Benchmark',
+            playlist_kind=3,
+            number_tracks_in_playlist=1,
+            liked_track_ids=liked_track_ids,
+            add_track_id_to_name=add_track_id_to_name,
+            main_thread_state=lambda: True,
+            child_thread_state=lambda: True,
+            update_mode=False,
+            update_liked=False,
+            only_add_to_database=False
+        )
+
+    def _strip_bad_symbols(self, soft_mode: bool):
+        def setup():
+            text = f'{self.track.artists[0].name} - {self.track.title} ({self.track.version}) [{self.track.id}]'
+            return lambda: self.ymd.strip_bad_symbols(text, soft_mode=soft_mode)
+        return setup
+
+    def _get_track_name(self, add_track_id_to_name: bool, need_strip: bool = True):
+        def setup():
+            helper = self._create_helper(add_track_id_to_name=add_track_id_to_name)
+            return lambda: helper._get_track_name(self.track, need_strip=need_strip, strip_soft_mode=True)
+        return setup
+
+    def _is_track_liked(self, is_liked: bool):
+        def setup():
+            liked_track_ids = frozenset(str(track_id) for track_id in range(1, LIKED_TRACKS + 1))
+            helper = self._create_helper(liked_track_ids=liked_track_ids)
+            # Идентификатор приходит с альбомом, как у TrackShort из плейлиста
+            track_id = f'{LIKED_TRACKS // 2}:100' if is_liked else f'{LIKED_TRACKS * 2}:100'
+            return lambda: helper._is_track_liked(track_id)
+        return setup
+
+    def _is_track_in_database(self, size: int, is_known: bool):
+        def setup():
+            helper = self._create_helper()
+            helper.known_tracks = KnownTracks((track_id, f'Track {track_id}', f'Artist {track_id % 5000}')
+                                              for track_id in range(1, size + 1))
+            track = self._create_track(str(size // 2 if is_known else size * 2))
+            return lambda: helper._is_track_in_database(track)
+        return setup
+
+    def _load_known_tracks(self, size: int):
+        def setup():
+            database_path = os.path.join(self.work_folder, f'history-{size}.db')
+            with sqlite3.connect(database_path) as db:
+                library.prepare_library(db, [(PLAYLIST_KIND, 'Benchmark')])
+                db.executemany(library.INSERT_TRACK, ((track_id, str(track_id // 10 + 1), f'Track {track_id}',
+                                                       f'Artist {track_id % 5000}', 1, 1, 0, 0, 0)
+                                                      for track_id in range(1, size + 1)))
+                db.executemany(library.INSERT_PLAYLIST_TRACK, ((PLAYLIST_KIND, track_id, 320, 'mp3')
+                                                               for track_id in range(1, size + 1)))
+            # Как и в начале запуска: один запрос к открытой базе и построение известных треков в памяти.
+            # Соединение закрывается после замера.
+            db = sqlite3.connect(database_path)
+            return lambda: KnownTracks(db.execute(library.SELECT_PLAYLIST_TRACKS, [PLAYLIST_KIND]).fetchall()), \
+                db.close
+        return setup
+
+    def _write_track_metadata(self):
+        helper = self._create_helper()
+        track_name, _, track_title = helper._get_track_name(self.track, need_strip=True, strip_soft_mode=True)
+        full_track_name = os.path.join(self.work_folder, f'{track_name}.mp3')
+        cover_filename = os.path.join(self.work_folder, f'{track_name}.jpg')
+        with open(full_track_name, 'wb') as file:
+            file.write(make_audio(AUDIO_SIZE))
+        with open(cover_filename, 'wb') as file:
+            file.write(COVER)
+
+        class Lyrics:
+            full_lyrics = 'La la la\n' * 40
+
+        album = self.track.albums[0]
+        return lambda: helper._write_track_metadata(full_track_name=full_track_name,
+                                                    track_title=track_title,
+                                                    artists=self.track.artists,
+                                                    albums=self.track.albums,
+                                                    genre=album.genre,
+                                                    album_artists=album.artists,
+                                                    year=album['year'],
+                                                    cover_filename=cover_filename,
+                                                    track_position=album.track_position.index,
+                                                    disk_number=album.track_position.volume,
+                                                    lyrics=Lyrics())
+
+    def run(self, name: str, repeat: int, min_time: float) -> dict:
+        """
+        Выполняет один замер
+        :param name: название замера
+        :param repeat: количество повторов
+        :param min_time: минимальная длительность одного повтора в секундах
+        :return: словарь с временем одного вызова в наносекундах
+        """
+        # Подготовка возвращает замеряемую функцию или пару (функция, освобождение ресурсов после замера)
+        func = self.cases[name]()
+        func, teardown = func if isinstance(func, tuple) else (func, None)
+        try:
+            timer = timeit.Timer(func)
+            # Число вызовов в повторе подбирается так, чтобы повтор длился не меньше min_time
+            number = 1
+            while True:
+                elapsed = timer.timeit(number)
+                if elapsed >= min_time:
+                    break
+                number = max(number * 2, int(number * min_time / elapsed * 1.1) if elapsed else number * 10)
+            timings = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat=repeat, number=number)]
+        finally:
+            if teardown is not None:
+                teardown()
+        return {'min_ns': min(timings), 'median_ns': statistics.median(timings), 'number': number, 'repeat': repeat}
+
+
+def _get_git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_FOLDER, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _format_time(nanoseconds: float) -> str:
+    for unit, scale in (('с', 1e9), ('мс', 1e6), ('мкс', 1e3)):
+        if nanoseconds >= scale:
+            return f'{nanoseconds / scale:8.2f} {unit}'
+    return f'{nanoseconds:8.1f} нс'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микрозамеры функций обработки трека.')
+    parser.add_argument('--filter', default='', help='выполнять только замеры, в названии которых есть эта строка')
+    parser.add_argument('--repeat', type=int, default=5, help='количество повторов замера')
+    parser.add_argument('--min-time', type=float, default=0.2, help='минимальная длительность повтора в секундах')
+    parser.add_argument('--output', help='файл результатов (по умолчанию benchmarks/results/micro-<время>.json)')
+    parser.add_argument('--compare', help='файл прошлых результатов для сравнения')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            previous = json.load(file)['results']
+
+    work_folder = tempfile.mkdtemp(prefix='ymd-micro-')
+    results = {}
+    try:
+        benchmarks = MicroBenchmarks(work_folder)
+        for name in benchmarks.cases:
+            if args.filter not in name:
+                continue
+            result = benchmarks.run(name, repeat=args.repeat, min_time=args.min_time)
+            results[name] = result
+
+            line = f'{name:<48} min {_format_time(result["min_ns"])} | median {_format_time(result["median_ns"])}'
+            if name in previous:
+                # Больше 1 - замер стал быстрее прошлого запуска, меньше 1 - медленнее
+                speedup = previous[name]['min_ns'] / result['min_ns']
+                line += f' | ускорение {speedup:5.2f}x'
+            print(line)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        output = os.path.join(RESULTS_FOLDER, f'micro-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump({'time': time.time(),
+                   'revision': _get_git_revision(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'results': results}, file, ensure_ascii=False, indent=4)
+    print(f'Результаты сохранены в [{output}].')
+
+
+if __name__ == '__main__':
+    main()
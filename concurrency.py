@@ -0,0 +1,150 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import asyncio
+import contextlib
+
+
+class ConcurrencyController:
+    """
+    Адаптивный регулятор количества одновременно обрабатываемых треков (AIMD, как в TCP).
+
+    Работа делится на эпохи примерно по limit завершённых треков. Пока пропускная способность растёт, лимит
+    сначала удваивается (медленный старт), а затем увеличивается на единицу. При сетевых ошибках лимит уменьшается
+    вдвое, при росте задержки - на четверть.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_factor: float = 2.0,
+                 throughput_tolerance: float = 0.05, on_change=None):
+        """
+        :param initial: начальный лимит
+        :param minimum: минимальный лимит
+        :param maximum: максимальный лимит (количество запущенных обработчиков)
+        :param latency_factor: во сколько раз средняя задержка эпохи должна превысить лучшую, чтобы считаться ростом
+        :param throughput_tolerance: допустимое падение пропускной способности, которое ещё считается шумом
+        :param on_change: функция on_change(old_limit, new_limit, reason), вызываемая при изменении лимита
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.latency_factor = latency_factor
+        self.throughput_tolerance = throughput_tolerance
+        self.on_change = on_change
+
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._is_slow_start = True
+        self._previous_throughput = None
+        self._best_latency = None
+
+        self._epoch_started = time.monotonic()
+        self._epoch_completed = 0
+        self._epoch_latency = 0.0
+        self._epoch_failures = 0
+
+        self.peak_limit = self.limit
+        self._limit_time = 0.0
+        self._limit_time_started = time.monotonic()
+        self._created = self._limit_time_started
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Занимает одно место на время обработки трека и учитывает её длительность
+        :return:
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            latency = time.monotonic() - started
+            async with self._condition:
+                self._in_flight -= 1
+                self._record_completion(latency)
+                self._condition.notify_all()
+
+    def record_failure(self):
+        """
+        Отмечает сетевую ошибку или таймаут в текущей эпохе
+        :return:
+        """
+        self._epoch_failures += 1
+
+    def _record_completion(self, latency: float):
+        self._epoch_completed += 1
+        self._epoch_latency += latency
+        if self._epoch_completed >= self.limit:
+            self._finish_epoch()
+
+    def _finish_epoch(self):
+        elapsed = max(time.monotonic() - self._epoch_started, 1e-6)
+        throughput = self._epoch_completed / elapsed
+        latency = self._epoch_latency / self._epoch_completed
+
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        if self._epoch_failures:
+            self._is_slow_start = False
+            self._set_limit(self.limit // 2, f'сетевых ошибок: {self._epoch_failures}')
+        elif latency > self._best_latency * self.latency_factor:
+            self._is_slow_start = False
+            self._set_limit(self.limit * 3 // 4, f'задержка выросла до {latency:.2f} с')
+        elif self._previous_throughput is None or \
+                throughput >= self._previous_throughput * (1 + self.throughput_tolerance):
+            if self._is_slow_start:
+                self._set_limit(self.limit * 2, f'медленный старт, {throughput:.2f} трек/с')
+            else:
+                self._set_limit(self.limit + 1, f'пропускная способность выросла до {throughput:.2f} трек/с')
+        elif throughput < self._previous_throughput * (1 - self.throughput_tolerance):
+            # Рост лимита перестал давать прирост, дальше растём только аддитивно
+            self._is_slow_start = False
+
+        self._previous_throughput = throughput
+        self._epoch_started = time.monotonic()
+        self._epoch_completed = 0
+        self._epoch_latency = 0.0
+        self._epoch_failures = 0
+
+    def _set_limit(self, limit: int, reason: str):
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit == self.limit:
+            return
+
+        now = time.monotonic()
+        self._limit_time += self.limit * (now - self._limit_time_started)
+        self._limit_time_started = now
+
+        old_limit = self.limit
+        self.limit = limit
+        self.peak_limit = max(self.peak_limit, limit)
+        if self.on_change is not None:
+            self.on_change(old_limit, limit, reason)
+
+    def get_report(self) -> dict:
+        """
+        Возвращает отчёт о выбранной параллельности
+        :return: {'limit': текущий лимит, 'peak': максимальный лимит, 'average': средний лимит по времени}
+        """
+        now = time.monotonic()
+        limit_time = self._limit_time + self.limit * (now - self._limit_time_started)
+        average = limit_time / max(now - self._created, 1e-6)
+        return {'limit': self.limit, 'peak': self.peak_limit, 'average': average}
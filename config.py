@@ -14,9 +14,37 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-NUMBER_OF_WORKERS = 5
-CHUNK_OF_TRACKS = 20
+NUMBER_OF_WORKERS = 100
+CONCURRENCY_INITIAL = 10
+CONCURRENCY_MIN = 2
+TRACKS_WINDOW_SIZE = 200
+HYDRATION_BATCH_SIZE = 250
+DOWNLOAD_INFO_TTL = 60
+DOWNLOAD_INFO_PREFETCH_LIMIT = 20
+HTTP_POOL_SIZE = NUMBER_OF_WORKERS
+HTTP_POOL_SIZE_PER_HOST = NUMBER_OF_WORKERS // 2
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_DNS_CACHE_TTL = 300
+RATE_LIMIT_REQUESTS_PER_SECOND = 50
+RATE_LIMIT_BYTES_PER_SECOND = 0
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10
+BREAKER_FAILURE_THRESHOLD = 10
+BREAKER_COOLDOWN = 5
+BREAKER_MAX_COOLDOWN = 60
+BREAKER_MAX_FAILED_PROBES = 5
+JOURNAL_FLUSH_SIZE = 50
+DATABASE_READ_POOL_SIZE = 4
+DATABASE_BATCH_SIZE = 200
+DATABASE_BATCH_INTERVAL = 0.5
+RUN_LOG_FLUSH_INTERVAL = 1
+METRICS_EXPORT_INTERVAL = 5
+TRACING_ENABLED = False
+PROFILING_ENABLED = False
 LOGGER_DEBUG_MODE = True
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
 
 paths = {'stuff': 'stuff'}
 paths = {
@@ -35,7 +35,13 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + logger_format + reset
     }
 
+    def __init__(self):
+        super().__init__(logger_format)
+        # Форматтеры создаются один раз, а не для каждой записи
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
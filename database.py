@@ -0,0 +1,221 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+
+class _Call:
+    """
+    Функция, которую поток-писатель выполняет в отдельной транзакции
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+
+
+class HistoryDatabase:
+    """
+    Доступ к базе данных истории на время одного запуска.
+
+    Все изменения уходят в очередь единственного потока-писателя, который объединяет их в транзакции по batch_size
+    запросов или раз в batch_interval секунд. Поиск идёт через пул постоянных соединений для чтения. База работает
+    в режиме WAL, поэтому чтение не блокируется записью.
+    """
+
+    _STOP = object()
+
+    def __init__(self, database_path: str, read_pool_size: int, batch_size: int, batch_interval: float,
+                 on_error=None, on_write=None):
+        """
+        :param database_path: путь к базе данных
+        :param read_pool_size: количество соединений для чтения
+        :param batch_size: максимальное количество запросов в одной транзакции
+        :param batch_interval: максимальное время ожидания новых запросов для транзакции в секундах
+        :param on_error: функция on_error(request, parameters, error), вызываемая при ошибке запроса на запись
+        :param on_write: функция on_write(duration), вызываемая после каждой транзакции писателя
+        """
+        self.database_path = database_path
+        self.read_pool_size = read_pool_size
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.on_error = on_error
+        self.on_write = on_write
+
+        self._writes = queue.Queue()
+        self._readers = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name='HistoryDatabaseWriter', daemon=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.database_path, check_same_thread=False)
+        con.execute('PRAGMA journal_mode=WAL;')
+        con.execute('PRAGMA synchronous=NORMAL;')
+        return con
+
+    def start(self):
+        """
+        Открывает соединения и запускает поток-писатель
+        :return:
+        """
+        for _ in range(self.read_pool_size):
+            self._readers.put(self._connect())
+        self._writer.start()
+
+    def fetchone(self, request: str, parameters: list = ()):
+        """
+        Выполняет запрос на чтение через свободное соединение из пула
+        :param request: SQL запрос
+        :param parameters: параметры запроса
+        :return: первая строка результата или None
+        """
+        con = self._readers.get()
+        try:
+            return con.execute(request, parameters).fetchone()
+        finally:
+            self._readers.put(con)
+
+    def fetchall(self, request: str, parameters: list = ()) -> list:
+        """
+        Выполняет запрос на чтение через свободное соединение из пула
+        :param request: SQL запрос
+        :param parameters: параметры запроса
+        :return: все строки результата
+        """
+        con = self._readers.get()
+        try:
+            return con.execute(request, parameters).fetchall()
+        finally:
+            self._readers.put(con)
+
+    def execute(self, request: str, parameters: list = ()):
+        """
+        Ставит запрос на запись в очередь писателя, не дожидаясь его выполнения
+        :param request: SQL запрос
+        :param parameters: параметры запроса
+        :return:
+        """
+        self._writes.put((request, parameters))
+
+    def call(self, func) -> Future:
+        """
+        Выполняет func(con) в отдельной транзакции потока-писателя после всех ранее поставленных запросов
+        :param func: функция, принимающая подключение к базе данных
+        :return: Future с результатом функции
+        """
+        call = _Call(func)
+        self._writes.put(call)
+        return call.future
+
+    def flush(self):
+        """
+        Ждёт, пока писатель выполнит все запросы из очереди
+        :return:
+        """
+        self._writes.join()
+
+    def close(self):
+        """
+        Записывает оставшиеся запросы и закрывает все соединения
+        :return:
+        """
+        if self._writer.is_alive():
+            self._writes.put(self._STOP)
+            self._writer.join()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    def _writer_loop(self):
+        con = self._connect()
+        try:
+            is_stopped = False
+            while not is_stopped:
+                item = self._writes.get()
+                if item is self._STOP:
+                    self._writes.task_done()
+                    break
+                if isinstance(item, _Call):
+                    self._timed(self._run_call, con, item)
+                    self._writes.task_done()
+                    continue
+
+                batch = [item]
+                call = None
+                deadline = time.monotonic() + self.batch_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._writes.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        self._writes.task_done()
+                        is_stopped = True
+                        break
+                    if isinstance(item, _Call):
+                        call = item
+                        break
+                    batch.append(item)
+
+                self._timed(self._write_batch, con, batch)
+                for _ in batch:
+                    self._writes.task_done()
+                if call is not None:
+                    self._timed(self._run_call, con, call)
+                    self._writes.task_done()
+        finally:
+            con.close()
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            func(*args)
+        finally:
+            if self.on_write is not None:
+                self.on_write(time.perf_counter() - started)
+
+    @staticmethod
+    def _run_call(con: sqlite3.Connection, call: _Call):
+        try:
+            with con:
+                result = call.func(con)
+        except Exception as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+
+    def _write_batch(self, con: sqlite3.Connection, batch: list):
+        try:
+            with con:
+                for request, parameters in batch:
+                    con.execute(request, parameters)
+            return
+        except sqlite3.Error:
+            pass
+
+        # Транзакция откатилась целиком, поэтому запросы выполняются по одному, чтобы потерять только ошибочные
+        for request, parameters in batch:
+            try:
+                with con:
+                    con.execute(request, parameters)
+            except sqlite3.Error as e:
+                if self.on_error is not None:
+                    self.on_error(request, parameters, e)
@@ -0,0 +1,111 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+
+# Идентификатор трека, который добавляется в конец названия файла: "Исполнитель - Название [12345].mp3"
+_TRACK_ID_PATTERN = re.compile(r'\[(\d+)(?::\d+)?]$')
+
+
+def _normalize(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class FolderIndex:
+    """
+    Индекс файлов папки плейлиста и её подпапки covers, построенный одним проходом os.scandir.
+
+    Заменяет os.path.exists для каждого кодека и каждой обложки (на сетевых дисках каждый такой вызов - отдельный
+    запрос к серверу). Файлы, записанные во время запуска, добавляются в индекс через add().
+    """
+
+    def __init__(self, folder: str):
+        self.folder = _normalize(folder)
+        self.covers_folder = _normalize(os.path.join(folder, 'covers'))
+        self._files = {self.folder: set(), self.covers_folder: set()}
+        self._track_ids = {}
+        self._names = set()
+
+    @staticmethod
+    def _scan(folder: str) -> list:
+        try:
+            with os.scandir(folder) as entries:
+                return [entry.name for entry in entries if entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def build(self):
+        """
+        Читает содержимое папок
+        :return:
+        """
+        for folder in self._files:
+            for name in self._scan(folder):
+                self._add(folder, name)
+
+    def _add(self, folder: str, name: str):
+        self._files[folder].add(os.path.normcase(name))
+        if folder == self.folder:
+            self._names.add(os.path.normcase(os.path.splitext(name)[0]))
+            match = _TRACK_ID_PATTERN.search(os.path.splitext(name)[0])
+            if match:
+                self._track_ids.setdefault(match.group(1), []).append(os.path.join(folder, name))
+
+    def add(self, path: str):
+        """
+        Добавляет в индекс записанный файл
+        :param path: путь к файлу
+        :return:
+        """
+        folder, name = os.path.split(_normalize(path))
+        if folder in self._files:
+            self._add(folder, name)
+
+    def exists(self, path: str) -> bool:
+        """
+        Проверяет наличие файла (файлы вне проиндексированных папок проверяются на диске)
+        :param path: путь к файлу
+        :return: True - если файл есть, False - если нет.
+        """
+        folder, name = os.path.split(_normalize(path))
+        if folder not in self._files:
+            return os.path.exists(path)
+        return name in self._files[folder]
+
+    def exists_with_any_extension(self, path: str) -> bool:
+        """
+        Проверяет наличие аудиофайла с таким названием независимо от кодека
+        :param path: путь к файлу без расширения
+        :return: True - если файл есть, False - если нет.
+        """
+        folder, name = os.path.split(_normalize(path))
+        return folder == self.folder and name in self._names
+
+    def find_by_track_id(self, track_id, extension: str):
+        """
+        Ищет аудиофайл по идентификатору трека в названии (например, если исполнитель или название трека изменились)
+        :param track_id: идентификатор трека
+        :param extension: расширение файла (кодек)
+        :return: путь к файлу или None
+        """
+        for path in self._track_ids.get(str(track_id), []):
+            if os.path.normcase(path).endswith(os.path.normcase(f'.{extension}')):
+                return path
+        return None
+
+    def __len__(self):
+        return sum(len(files) for files in self._files.values())
@@ -0,0 +1,203 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import asyncio
+import hashlib
+import sqlite3
+
+from database import HistoryDatabase
+
+
+def get_track_key(track) -> str:
+    """
+    Возвращает идентификатор трека без альбома (одинаковый для Track и TrackShort)
+    :param track: трек
+    :return: идентификатор трека
+    """
+    return str(track.id).split(':')[0]
+
+
+class JobJournal:
+    """
+    Журнал запусков загрузки, который хранится рядом с историей загрузок (в той же базе данных).
+
+    Для каждого запуска сохраняются режим, плейлист, папка загрузки, охват (весь плейлист или выбранные треки)
+    и статус каждого поставленного в очередь трека. Незавершённый запуск с теми же параметрами продолжается с места
+    остановки: уже обработанные треки пропускаются без повторных проверок в базе и на диске.
+    """
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Охват запуска по всему плейлисту. Запуск по выбранным трекам хранит вместо него хэш набора треков.
+    FULL = 'full'
+
+    @staticmethod
+    def get_scope(track_ids: list, is_partial: bool) -> str:
+        """
+        Возвращает охват запуска. Выборочный запуск продолжается, только если выбран тот же набор треков,
+        и никогда не смешивается с запуском по всему плейлисту.
+        :param track_ids: идентификаторы треков
+        :param is_partial: обрабатываются ли только выбранные треки
+        :return: охват запуска
+        """
+        if not is_partial:
+            return JobJournal.FULL
+        digest = hashlib.sha1(','.join(sorted(set(map(str, track_ids)))).encode('utf-8')).hexdigest()
+        return f'partial-{digest}'
+
+    def __init__(self, database: HistoryDatabase):
+        """
+        :param database: база данных истории запуска: журнал пишется через её единственный поток-писатель
+        """
+        self.database = database
+
+    async def _call(self, func):
+        return await asyncio.wrap_future(self.database.call(func))
+
+    def _create_tables(self, db: sqlite3.Connection):
+        db.execute("CREATE TABLE IF NOT EXISTS jobs("
+                   "job_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                   "playlist_kind INTEGER NOT NULL,"
+                   "mode TEXT NOT NULL,"
+                   "download_folder TEXT NOT NULL,"
+                   "created REAL NOT NULL,"
+                   "is_finished INTEGER NOT NULL DEFAULT 0,"
+                   f"scope TEXT NOT NULL DEFAULT '{self.FULL}'"
+                   ")")
+        # Журналы, созданные до появления охвата, считают все запуски запусками по всему плейлисту
+        columns = {column[1] for column in db.execute("PRAGMA table_info(jobs);")}
+        if 'scope' not in columns:
+            db.execute(f"ALTER TABLE jobs ADD COLUMN scope TEXT NOT NULL DEFAULT '{self.FULL}';")
+        db.execute("CREATE TABLE IF NOT EXISTS job_tracks("
+                   "job_id INTEGER NOT NULL,"
+                   "track_id TEXT NOT NULL,"
+                   "position INTEGER NOT NULL,"
+                   f"status TEXT NOT NULL DEFAULT '{self.PENDING}',"
+                   "PRIMARY KEY (job_id, track_id)"
+                   ")")
+
+    async def open_job(self, playlist_kind: int, mode: str, download_folder: str, track_ids: list, flush_size: int,
+                       scope: str = FULL):
+        """
+        Продолжает незавершённый запуск с теми же параметрами или начинает новый
+        :param playlist_kind: идентификатор плейлиста
+        :param mode: режим работы
+        :param download_folder: папка загрузки
+        :param track_ids: идентификаторы треков в порядке постановки в очередь
+        :param flush_size: сколько статусов копить в памяти перед записью в базу
+        :param scope: охват запуска (get_scope)
+        :return: запуск (Job)
+        """
+        def _open(db: sqlite3.Connection) -> tuple:
+            self._create_tables(db)
+            row = db.execute("SELECT job_id FROM jobs WHERE playlist_kind == ? AND mode == ? "
+                             "AND download_folder == ? AND scope == ? AND is_finished == 0 "
+                             "ORDER BY job_id DESC LIMIT 1;",
+                             [playlist_kind, mode, download_folder, scope]).fetchone()
+            if row is not None:
+                job_id = row[0]
+                done_ids = {track_id for track_id, in db.execute(
+                    "SELECT track_id FROM job_tracks WHERE job_id == ? AND status == ?;", [job_id, self.DONE])}
+            else:
+                job_id = db.execute("INSERT INTO jobs(playlist_kind, mode, download_folder, created, scope) "
+                                    "VALUES (?, ?, ?, ?, ?);",
+                                    [playlist_kind, mode, download_folder, time.time(), scope]).lastrowid
+                done_ids = set()
+
+            # Треки, появившиеся в плейлисте после прерванного запуска по всему плейлисту, дописываются к нему
+            db.executemany("INSERT OR IGNORE INTO job_tracks(job_id, track_id, position) VALUES (?, ?, ?);",
+                           [(job_id, track_id, position) for position, track_id in enumerate(track_ids)])
+            return job_id, done_ids, row is not None
+
+        job_id, done_ids, is_resumed = await self._call(_open)
+        return Job(self, job_id, done_ids, is_resumed=is_resumed, flush_size=flush_size)
+
+    async def set_statuses(self, job_id: int, statuses: list):
+        """
+        Записывает статусы треков
+        :param job_id: идентификатор запуска
+        :param statuses: список пар (track_id, status)
+        :return:
+        """
+        await self._call(lambda db: db.executemany(
+            "UPDATE job_tracks SET status = ? WHERE job_id == ? AND track_id == ?;",
+            [(status, job_id, track_id) for track_id, status in statuses]))
+
+    async def finish_job(self, job_id: int):
+        """
+        Помечает запуск завершённым и удаляет статусы его треков
+        :param job_id: идентификатор запуска
+        :return:
+        """
+        def _finish(db: sqlite3.Connection):
+            db.execute("UPDATE jobs SET is_finished = 1 WHERE job_id == ?;", [job_id])
+            db.execute("DELETE FROM job_tracks WHERE job_id == ?;", [job_id])
+
+        await self._call(_finish)
+
+
+class Job:
+    """
+    Один запуск из журнала. Статусы треков копятся в памяти и записываются в базу пачками.
+    """
+
+    def __init__(self, journal: JobJournal, job_id: int, done_ids: set, is_resumed: bool, flush_size: int):
+        self.journal = journal
+        self.job_id = job_id
+        self.done_ids = done_ids
+        self.is_resumed = is_resumed
+        self.flush_size = flush_size
+        self._pending = []
+
+    def is_done(self, track) -> bool:
+        """
+        Проверяет, был ли трек обработан в прерванном запуске
+        :param track: трек
+        :return: True - если был, False - если нет.
+        """
+        return get_track_key(track) in self.done_ids
+
+    async def set_status(self, track, status: str):
+        """
+        Запоминает статус трека
+        :param track: трек
+        :param status: JobJournal.DONE или JobJournal.FAILED
+        :return:
+        """
+        self._pending.append((get_track_key(track), status))
+        if len(self._pending) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Записывает накопленные статусы в базу
+        :return:
+        """
+        if not self._pending:
+            return
+        statuses, self._pending = self._pending, []
+        await self.journal.set_statuses(self.job_id, statuses)
+
+    async def finish(self):
+        """
+        Завершает запуск: следующий запуск с теми же параметрами начнётся с начала
+        :return:
+        """
+        self._pending = []
+        await self.journal.finish_job(self.job_id)
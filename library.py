@@ -0,0 +1,357 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Нормализованная схема базы данных истории.
+
+Метаданные каждого трека хранятся один раз (tracks, albums, artists, track_artists), а принадлежность к плейлистам -
+в playlist_tracks по идентификатору плейлиста (playlist.kind), поэтому переименование плейлиста ничего не ломает.
+Для каждого плейлиста создаётся представление table_<название> с колонками старых таблиц.
+"""
+
+import re
+import sqlite3
+from collections import defaultdict
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS playlists("
+    "playlist_kind INTEGER PRIMARY KEY,"
+    "title TEXT NOT NULL"
+    ")",
+    # Все названия, под которыми плейлист встречался, чтобы найти старые таблицы переименованных плейлистов
+    "CREATE TABLE IF NOT EXISTS playlist_titles("
+    "title TEXT NOT NULL,"
+    "playlist_kind INTEGER NOT NULL,"
+    "PRIMARY KEY (title, playlist_kind)"
+    ")",
+    "CREATE TABLE IF NOT EXISTS albums("
+    "album_id TEXT PRIMARY KEY,"
+    "album_name TEXT,"
+    "genre TEXT,"
+    "year INTEGER,"
+    "release_data TEXT"
+    ")",
+    "CREATE TABLE IF NOT EXISTS artists("
+    "artist_id TEXT PRIMARY KEY,"
+    "name TEXT"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tracks("
+    "track_id INTEGER PRIMARY KEY,"
+    "album_id TEXT REFERENCES albums(album_id),"
+    "track_name TEXT NOT NULL,"
+    "artist_name TEXT NOT NULL,"
+    "track_number INTEGER,"
+    "disk_number INTEGER,"
+    "is_favorite INTEGER NOT NULL DEFAULT 0,"
+    "is_explicit INTEGER NOT NULL DEFAULT 0,"
+    "is_popular INTEGER NOT NULL DEFAULT 0"
+    ")",
+    "CREATE INDEX IF NOT EXISTS idx_tracks_name ON tracks(track_name, artist_name)",
+    "CREATE TABLE IF NOT EXISTS track_artists("
+    "track_id INTEGER NOT NULL REFERENCES tracks(track_id),"
+    "artist_id TEXT NOT NULL REFERENCES artists(artist_id),"
+    "position INTEGER NOT NULL,"
+    "PRIMARY KEY (track_id, artist_id)"
+    ")",
+    "CREATE TABLE IF NOT EXISTS playlist_tracks("
+    "playlist_kind INTEGER NOT NULL REFERENCES playlists(playlist_kind),"
+    "track_id INTEGER NOT NULL REFERENCES tracks(track_id),"
+    "bit_rate INTEGER NOT NULL,"
+    "codec TEXT NOT NULL,"
+    "PRIMARY KEY (playlist_kind, track_id)"
+    ")",
+    "CREATE INDEX IF NOT EXISTS idx_playlist_tracks_track_id ON playlist_tracks(track_id)",
+    "CREATE TABLE IF NOT EXISTS playlist_sync("
+    "playlist_kind INTEGER NOT NULL,"
+    "mode TEXT NOT NULL,"
+    "download_folder TEXT NOT NULL,"
+    "revision INTEGER NOT NULL,"
+    "synced REAL NOT NULL,"
+    "PRIMARY KEY (playlist_kind, mode, download_folder)"
+    ")",
+]
+
+INSERT_ALBUM = "INSERT OR IGNORE INTO albums(album_id, album_name, genre, year, release_data) VALUES (?,?,?,?,?);"
+INSERT_ARTIST = "INSERT OR IGNORE INTO artists(artist_id, name) VALUES (?,?);"
+INSERT_TRACK = "INSERT OR IGNORE INTO tracks(track_id, album_id, track_name, artist_name, track_number, " \
+               "disk_number, is_favorite, is_explicit, is_popular) VALUES (?,?,?,?,?,?,?,?,?);"
+INSERT_TRACK_ARTIST = "INSERT OR IGNORE INTO track_artists(track_id, artist_id, position) VALUES (?,?,?);"
+INSERT_PLAYLIST_TRACK = "INSERT OR IGNORE INTO playlist_tracks(playlist_kind, track_id, bit_rate, codec) " \
+                        "VALUES (?,?,?,?);"
+UPDATE_FAVORITE = "UPDATE tracks SET is_favorite = ? WHERE track_id == ?;"
+
+SELECT_SYNCED_REVISION = "SELECT revision FROM playlist_sync WHERE playlist_kind == ? AND mode == ? " \
+                         "AND download_folder == ?;"
+UPSERT_SYNCED_REVISION = "INSERT INTO playlist_sync(playlist_kind, mode, download_folder, revision, synced) " \
+                         "VALUES (?,?,?,?,?) ON CONFLICT(playlist_kind, mode, download_folder) " \
+                         "DO UPDATE SET revision = excluded.revision, synced = excluded.synced;"
+SELECT_PLAYLIST_TRACKS = "SELECT t.track_id, t.track_name, t.artist_name FROM playlist_tracks p " \
+                         "JOIN tracks t ON t.track_id == p.track_id WHERE p.playlist_kind == ?;"
+
+
+def update_favorites(db: sqlite3.Connection, playlist_kind: int, liked_track_ids) -> tuple:
+    """
+    Приводит отметки любимых треков плейлиста в соответствие со списком любимых: отмечает новые любимые треки
+    и снимает отметку с тех, что перестали быть любимыми. Всё делается запросами над множествами, а не по треку.
+    :param db: подключение к базе данных (внутри транзакции)
+    :param playlist_kind: идентификатор плейлиста
+    :param liked_track_ids: идентификаторы любимых треков
+    :return: (количество любимых треков плейлиста в базе, отмечено, снято отметок)
+    """
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS liked_tracks(track_id INTEGER PRIMARY KEY);")
+    db.execute("DELETE FROM temp.liked_tracks;")
+    db.executemany("INSERT OR IGNORE INTO temp.liked_tracks(track_id) VALUES (?);",
+                   [(int(track_id),) for track_id in liked_track_ids if str(track_id).isdigit()])
+
+    playlist_tracks = "SELECT track_id FROM playlist_tracks WHERE playlist_kind == ?"
+    marked = db.execute(f"UPDATE tracks SET is_favorite = 1 WHERE is_favorite == 0 "
+                        f"AND track_id IN (SELECT track_id FROM temp.liked_tracks) "
+                        f"AND track_id IN ({playlist_tracks});", [playlist_kind]).rowcount
+    cleared = db.execute(f"UPDATE tracks SET is_favorite = 0 WHERE is_favorite != 0 "
+                         f"AND track_id NOT IN (SELECT track_id FROM temp.liked_tracks) "
+                         f"AND track_id IN ({playlist_tracks});", [playlist_kind]).rowcount
+    liked = db.execute("SELECT COUNT(*) FROM playlist_tracks p JOIN temp.liked_tracks l ON l.track_id == p.track_id "
+                       "WHERE p.playlist_kind == ?;", [playlist_kind]).fetchone()[0]
+    return liked, marked, cleared
+
+
+class KnownTracks:
+    """
+    Треки плейлиста, которые уже есть в базе данных. Загружаются одним запросом в начале запуска и пополняются
+    по мере добавления треков, поэтому проверка трека не обращается к базе.
+    """
+
+    def __init__(self, rows: list = ()):
+        """
+        :param rows: строки (track_id, track_name, artist_name)
+        """
+        self.track_ids = set()
+        self.names = set()
+        for track_id, track_name, artist_name in rows:
+            self.add(track_id, track_name, artist_name)
+
+    def add(self, track_id, track_name: str, artist_name: str):
+        self.track_ids.add(int(track_id))
+        self.names.add((track_name, artist_name))
+
+    def has_id(self, track_id) -> bool:
+        return int(track_id) in self.track_ids
+
+    def contains(self, track_id, track_name: str, artist_name: str) -> bool:
+        """
+        Проверяет трек так же, как раньше это делал запрос к базе: по идентификатору или по названию и исполнителям
+        :param track_id: идентификатор трека
+        :param track_name: название трека
+        :param artist_name: исполнители трека
+        :return: True - если трек известен, False - если нет.
+        """
+        return int(track_id) in self.track_ids or (track_name, artist_name) in self.names
+
+    def __len__(self):
+        return len(self.track_ids)
+
+
+def get_legacy_table_name(playlist_title: str) -> str:
+    """
+    Возвращает имя таблицы (или представления) плейлиста в старой схеме
+    :param playlist_title: название плейлиста без неразрешенных символов
+    :return: имя таблицы
+    """
+    return f"table_{playlist_title.replace(' ', '_')}"
+
+
+def _quote(name: str) -> str:
+    """
+    Экранирует имя таблицы или представления для подстановки в запрос (в названиях плейлистов остаются пробелы,
+    дефисы и скобки)
+    :param name: имя
+    :return: имя в двойных кавычках
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _split(value, count: int) -> list:
+    """
+    Разбивает склеенное через запятую значение старой схемы на count частей
+    :param value: значение
+    :param count: ожидаемое количество частей
+    :return: список частей или список из None, если разбить не удалось
+    """
+    parts = str(value).split(', ') if value is not None else []
+    return parts if len(parts) == count else [None] * count
+
+
+def _migrate_legacy_table(db: sqlite3.Connection, table_name: str, playlist_kind: int) -> tuple:
+    """
+    Переносит строки старой таблицы плейлиста в нормализованную схему и удаляет таблицу. Дубликаты трека
+    схлопываются по первичным ключам: остаётся самая ранняя строка, а отметка любимого трека не теряется,
+    даже если она стоит только у дубликата.
+    :param db: подключение к базе данных
+    :param table_name: имя старой таблицы
+    :param playlist_kind: идентификатор плейлиста
+    :return: (количество перенесённых треков, количество отброшенных дубликатов)
+    """
+    rows = db.execute(f"SELECT track_id, artist_id, album_id, track_name, artist_name, album_name, genre, "
+                      f"track_number, disk_number, year, release_data, bit_rate, codec, is_favorite, "
+                      f"is_explicit, is_popular FROM {_quote(table_name)} ORDER BY rowid;").fetchall()
+
+    albums, artists, tracks, track_artists, playlist_tracks, favorites = [], [], [], [], [], []
+    for (track_id, artist_ids, album_ids, track_name, artist_name, album_name, genre, track_number, disk_number,
+         year, release_data, bit_rate, codec, is_favorite, is_explicit, is_popular) in rows:
+        album_ids = str(album_ids).split(', ') if album_ids else []
+        album_id = album_ids[0] if album_ids else None
+        if album_id is not None:
+            albums.append((album_id, _split(album_name, len(album_ids))[0] or album_name, genre, year, release_data))
+
+        artist_ids = str(artist_ids).split(', ') if artist_ids else []
+        for position, (artist_id, name) in enumerate(zip(artist_ids, _split(artist_name, len(artist_ids)))):
+            artists.append((artist_id, name))
+            track_artists.append((track_id, artist_id, position))
+
+        tracks.append((track_id, album_id, track_name, artist_name, track_number, disk_number, 0,
+                       is_explicit, is_popular))
+        playlist_tracks.append((playlist_kind, track_id, bit_rate, codec))
+        if is_favorite:
+            favorites.append((1, track_id))
+
+    db.executemany(INSERT_ALBUM, albums)
+    db.executemany(INSERT_ARTIST, artists)
+    db.executemany(INSERT_TRACK, tracks)
+    db.executemany(INSERT_TRACK_ARTIST, track_artists)
+    db.executemany(INSERT_PLAYLIST_TRACK, playlist_tracks)
+    db.executemany(UPDATE_FAVORITE, favorites)
+    db.execute(f"DROP TABLE {_quote(table_name)};")
+    migrated = len({track_id for track_id, *_ in rows})
+    return migrated, len(rows) - migrated
+
+
+def _create_compatibility_view(db: sqlite3.Connection, view_name: str, playlist_kind: int):
+    db.execute(f"CREATE VIEW IF NOT EXISTS {_quote(view_name)}(track_id, artist_id, album_id, track_name, artist_name, "
+               f"album_name, genre, track_number, disk_number, year, release_data, bit_rate, codec, is_favorite, "
+               f"is_explicit, is_popular) AS "
+               f"SELECT t.track_id, "
+               f"(SELECT group_concat(artist_id, ', ') FROM "
+               f"(SELECT artist_id FROM track_artists WHERE track_id == t.track_id ORDER BY position)), "
+               f"t.album_id, t.track_name, t.artist_name, a.album_name, a.genre, t.track_number, t.disk_number, "
+               f"a.year, a.release_data, p.bit_rate, p.codec, t.is_favorite, t.is_explicit, t.is_popular "
+               f"FROM playlist_tracks p "
+               f"JOIN tracks t ON t.track_id == p.track_id "
+               f"LEFT JOIN albums a ON a.album_id == t.album_id "
+               f"WHERE p.playlist_kind == {int(playlist_kind)};")
+
+
+def _get_view_kind(sql: str):
+    """
+    Возвращает идентификатор плейлиста, по которому построено представление совместимости
+    :param sql: текст запроса представления из sqlite_master
+    :return: идентификатор плейлиста или None
+    """
+    match = re.search(r'playlist_kind == (\d+);?\s*$', sql or '')
+    return int(match.group(1)) if match else None
+
+
+def _match_by_tracks(db: sqlite3.Connection, table_name: str, playlist_kinds=None):
+    """
+    Сопоставляет старую таблицу с плейлистом по трекам, уже перенесённым в библиотеку: подходит плейлист,
+    в котором есть хотя бы половина треков таблицы и больше, чем в любом другом
+    :param db: подключение к базе данных
+    :param table_name: имя старой таблицы
+    :param playlist_kinds: плейлисты, среди которых идёт поиск (None - все)
+    :return: идентификатор плейлиста или None, если однозначно сопоставить не удалось
+    """
+    total = db.execute(f"SELECT COUNT(DISTINCT track_id) FROM {_quote(table_name)};").fetchone()[0]
+    counts = db.execute(f"SELECT playlist_kind, COUNT(*) FROM playlist_tracks "
+                        f"WHERE track_id IN (SELECT track_id FROM {_quote(table_name)}) "
+                        f"GROUP BY playlist_kind ORDER BY COUNT(*) DESC;").fetchall()
+    if playlist_kinds is not None:
+        counts = [(playlist_kind, count) for playlist_kind, count in counts if playlist_kind in playlist_kinds]
+    if not counts or counts[0][1] * 2 < total or (len(counts) > 1 and counts[0][1] == counts[1][1]):
+        return None
+    return counts[0][0]
+
+
+def prepare_library(db: sqlite3.Connection, playlists: list) -> dict:
+    """
+    Создаёт нормализованную схему, переносит в неё старые таблицы плейлистов и создаёт представления.
+
+    Переносятся все старые таблицы table_*, а не только таблицы текущих названий: таблица сопоставляется
+    с плейлистом по любому из его названий (текущему или сохранённому раньше), а если название не подходит
+    ни одному плейлисту или подходит нескольким - по уже перенесённым трекам. Таблицы, которые не удалось
+    однозначно сопоставить, остаются без изменений.
+    :param db: подключение к базе данных
+    :param playlists: список пар (playlist_kind, название плейлиста без неразрешенных символов)
+    :return: словарь {'migrated': {имя старой таблицы: (количество перенесённых треков, количество отброшенных
+        дубликатов)}, 'collisions': {имя таблицы или представления: [идентификаторы плейлистов]},
+        'unmatched': [имена старых таблиц без плейлиста]}
+    """
+    migrated, collisions, unmatched = {}, {}, []
+    with db:
+        for request in _SCHEMA:
+            db.execute(request)
+
+        # Прежние названия сохраняются до того, как в playlists запишутся текущие
+        db.execute("INSERT OR IGNORE INTO playlist_titles(title, playlist_kind) "
+                   "SELECT title, playlist_kind FROM playlists;")
+        for playlist_kind, playlist_title in playlists:
+            db.execute("INSERT INTO playlists(playlist_kind, title) VALUES (?, ?) "
+                       "ON CONFLICT(playlist_kind) DO UPDATE SET title = excluded.title;",
+                       [playlist_kind, playlist_title])
+            db.execute("INSERT OR IGNORE INTO playlist_titles(title, playlist_kind) VALUES (?, ?);",
+                       [playlist_title, playlist_kind])
+
+        known_names = defaultdict(set)
+        for playlist_title, playlist_kind in db.execute("SELECT title, playlist_kind FROM playlist_titles;"):
+            known_names[get_legacy_table_name(playlist_title)].add(playlist_kind)
+
+        legacy_tables = [name for name, in db.execute(
+            "SELECT name FROM sqlite_master WHERE type == 'table' AND name LIKE 'table\\_%' ESCAPE '\\' "
+            "ORDER BY name;")]
+
+        # Сначала таблицы с однозначным названием, чтобы остальные можно было сопоставить по их трекам
+        ambiguous_tables = []
+        for table_name in legacy_tables:
+            playlist_kinds = known_names.get(table_name, set())
+            if len(playlist_kinds) == 1:
+                migrated[table_name] = _migrate_legacy_table(db, table_name, next(iter(playlist_kinds)))
+            else:
+                ambiguous_tables.append((table_name, playlist_kinds))
+
+        for table_name, playlist_kinds in ambiguous_tables:
+            playlist_kind = _match_by_tracks(db, table_name, playlist_kinds or None)
+            if playlist_kind is not None:
+                migrated[table_name] = _migrate_legacy_table(db, table_name, playlist_kind)
+            elif playlist_kinds:
+                collisions[table_name] = sorted(playlist_kinds)
+            else:
+                unmatched.append(table_name)
+
+        # Представление с названием текущего плейлиста; если два названия совпали после замены символов,
+        # то представление не создаётся ни для одного из них
+        current_names = defaultdict(list)
+        for playlist_kind, playlist_title in playlists:
+            current_names[get_legacy_table_name(playlist_title)].append(playlist_kind)
+        for view_name, playlist_kinds in current_names.items():
+            if len(playlist_kinds) > 1:
+                collisions[view_name] = sorted(set(playlist_kinds) | set(collisions.get(view_name, [])))
+                continue
+            row = db.execute("SELECT type, sql FROM sqlite_master WHERE name == ?;", [view_name]).fetchone()
+            if row is not None and row[0] == 'view' and _get_view_kind(row[1]) != playlist_kinds[0]:
+                # Название раньше принадлежало другому плейлисту (например, до переименования)
+                db.execute(f"DROP VIEW {_quote(view_name)};")
+                row = None
+            if row is None:
+                _create_compatibility_view(db, view_name, playlist_kinds[0])
+    return {'migrated': migrated, 'collisions': collisions, 'unmatched': unmatched}
@@ -0,0 +1,108 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    Потокобезопасное ведро токенов. Нулевая скорость означает отсутствие ограничения.
+
+    Запрос может уйти в долг: reserve() сразу списывает токены и возвращает время, которое нужно подождать,
+    поэтому порции больше ёмкости ведра тоже обрабатываются корректно.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self._lock = threading.Lock()
+        self.rate = 0.0
+        self.capacity = 0.0
+        self._tokens = None
+        self._updated = time.monotonic()
+        self.set_rate(rate, capacity)
+
+    def set_rate(self, rate: float, capacity: float = None):
+        """
+        Меняет скорость ведра на лету
+        :param rate: токенов в секунду (0 - без ограничения)
+        :param capacity: ёмкость ведра (по умолчанию - секунда работы на полной скорости)
+        :return:
+        """
+        with self._lock:
+            self.rate = max(float(rate or 0), 0.0)
+            self.capacity = float(capacity) if capacity else self.rate
+            self._tokens = self.capacity if self._tokens is None else min(self._tokens, self.capacity)
+            self._updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Списывает токены
+        :param amount: количество токенов
+        :return: сколько секунд нужно подождать, прежде чем их использовать
+        """
+        with self._lock:
+            if self.rate == 0:
+                return 0.0
+
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Общий ограничитель частоты запросов и скорости загрузки для всех плейлистов, обложек и текстов песен
+    """
+
+    def __init__(self, requests_per_second: float, bytes_per_second: float):
+        self.requests = TokenBucket(requests_per_second)
+        self.bytes = TokenBucket(bytes_per_second)
+
+    def set_limits(self, requests_per_second: float, bytes_per_second: float):
+        """
+        Меняет ограничения на лету
+        :param requests_per_second: запросов в секунду (0 - без ограничения)
+        :param bytes_per_second: байт в секунду (0 - без ограничения)
+        :return:
+        """
+        self.requests.set_rate(requests_per_second)
+        self.bytes.set_rate(bytes_per_second)
+
+    async def acquire_request(self):
+        delay = self.requests.reserve(1)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire_bytes(self, amount: int):
+        delay = self.bytes.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait_request(self):
+        delay = self.requests.reserve(1)
+        if delay > 0:
+            time.sleep(delay)
+
+    def wait_bytes(self, amount: int):
+        delay = self.bytes.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,277 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Верхние границы корзин гистограммы длительности этапа в секундах
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _StageStatistics:
+    """
+    Статистика одного этапа: гистограмма длительностей, количество ошибок и переданные байты
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.max_duration = 0.0
+        self.bytes = 0
+
+    def observe(self, duration: float, size: int, is_error: bool):
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+        self.count += 1
+        self.duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.bytes += size
+        if is_error:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(DURATION_BUCKETS + ('+Inf',), self.buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'duration_sum': self.duration,
+            'duration_mean': self.duration / self.count if self.count else 0.0,
+            'duration_max': self.max_duration,
+            'bytes': self.bytes,
+            'bytes_per_second': self.bytes / self.duration if self.duration else 0.0,
+            'buckets': buckets
+        }
+
+
+class _Measurement:
+    """
+    Замер одного вызова этапа. Размер переданных данных можно указать внутри блока with.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+
+class RunMetrics:
+    """
+    Метрики одного запуска: счётчики треков и статистика по этапам обработки трека.
+
+    Все методы потокобезопасны: данные пишут цикл событий и поток записи в базу, а читают окно загрузки
+    и поток выгрузки метрик.
+    """
+
+    METADATA = 'metadata'
+    DOWNLOAD_INFO = 'download_info'
+    TRANSFER = 'transfer'
+    COVER = 'cover'
+    LYRICS = 'lyrics'
+    TAGGING = 'tagging'
+    DATABASE = 'database'
+
+    STAGES = (METADATA, DOWNLOAD_INFO, TRANSFER, COVER, LYRICS, TAGGING, DATABASE)
+
+    def __init__(self, counters: tuple, labels: dict = None):
+        """
+        :param counters: названия счётчиков треков
+        :param labels: метки, добавляемые ко всем метрикам (например, название плейлиста)
+        """
+        self.labels = labels or {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {name: 0 for name in counters}
+        self._stages = {stage: _StageStatistics() for stage in self.STAGES}
+
+    def increment(self, counter: str, value: int = 1):
+        """
+        Увеличивает счётчик треков
+        :param counter: название счётчика
+        :param value: величина увеличения
+        :return:
+        """
+        with self._lock:
+            self._counters[counter] += value
+
+    def get_counters(self) -> dict:
+        """
+        Возвращает копию счётчиков треков
+        :return: словарь {название: значение}
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def observe(self, stage: str, duration: float, size: int = 0, is_error: bool = False):
+        """
+        Записывает один вызов этапа
+        :param stage: этап
+        :param duration: длительность в секундах
+        :param size: количество переданных байт
+        :param is_error: завершился ли вызов ошибкой
+        :return:
+        """
+        with self._lock:
+            self._stages[stage].observe(duration, size, is_error)
+
+    def record_error(self, stage: str):
+        """
+        Записывает ошибку этапа, не связанную с замером длительности
+        :param stage: этап
+        :return:
+        """
+        with self._lock:
+            self._stages[stage].errors += 1
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Замеряет длительность блока with. Исключение внутри блока считается ошибкой этапа.
+        :param stage: этап
+        :return: замер, в котором можно указать размер переданных данных
+        """
+        measurement = _Measurement()
+        started = time.perf_counter()
+        is_error = False
+        try:
+            yield measurement
+        except Exception:
+            is_error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, measurement.size, is_error)
+
+    def snapshot(self) -> dict:
+        """
+        Возвращает все метрики в виде словаря
+        :return: словарь для выгрузки в JSON
+        """
+        with self._lock:
+            return {
+                'labels': dict(self.labels),
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'tracks': dict(self._counters),
+                'stages': {stage: statistics.to_dict() for stage, statistics in self._stages.items()}
+            }
+
+    @staticmethod
+    def _format_labels(labels: dict) -> str:
+        pairs = []
+        for name, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def to_prometheus(self) -> str:
+        """
+        Возвращает метрики в текстовом формате Prometheus
+        :return: текст метрик
+        """
+        snapshot = self.snapshot()
+        labels = snapshot['labels']
+        lines = ['# HELP ymd_tracks_total Количество треков по результату обработки.',
+                 '# TYPE ymd_tracks_total counter']
+        for counter, value in snapshot['tracks'].items():
+            lines.append(f'ymd_tracks_total{self._format_labels({**labels, "counter": counter})} {value}')
+
+        lines += ['# HELP ymd_stage_duration_seconds Длительность этапа обработки трека.',
+                  '# TYPE ymd_stage_duration_seconds histogram']
+        for stage, statistics in snapshot['stages'].items():
+            stage_labels = {**labels, 'stage': stage}
+            for bound, count in statistics['buckets'].items():
+                lines.append(f'ymd_stage_duration_seconds_bucket{self._format_labels({**stage_labels, "le": bound})}'
+                             f' {count}')
+            lines.append(f'ymd_stage_duration_seconds_sum{self._format_labels(stage_labels)} '
+                         f'{statistics["duration_sum"]}')
+            lines.append(f'ymd_stage_duration_seconds_count{self._format_labels(stage_labels)} {statistics["count"]}')
+
+        for name, key, description in (('ymd_stage_errors_total', 'errors', 'Количество ошибок этапа.'),
+                                       ('ymd_stage_bytes_total', 'bytes', 'Количество переданных байт.')):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for stage, statistics in snapshot['stages'].items():
+                lines.append(f'{name}{self._format_labels({**labels, "stage": stage})} {statistics[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    """
+    Периодически выгружает метрики запуска в файл JSON и в текстовый файл Prometheus
+    (например, для textfile collector из node_exporter). Файлы заменяются целиком, поэтому читатель
+    никогда не увидит их наполовину записанными.
+    """
+
+    def __init__(self, metrics: RunMetrics, json_path: str, prometheus_path: str, interval: float, on_error=None):
+        """
+        :param metrics: метрики запуска
+        :param json_path: путь к файлу JSON
+        :param prometheus_path: путь к файлу в формате Prometheus
+        :param interval: период выгрузки в секундах
+        :param on_error: функция on_error(error), вызываемая при ошибке записи
+        """
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.on_error = on_error
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._export_loop, name='MetricsExporter', daemon=True)
+
+    def start(self):
+        """
+        Запускает поток выгрузки
+        :return:
+        """
+        self._thread.start()
+
+    def close(self):
+        """
+        Останавливает поток выгрузки и записывает итоговые значения метрик
+        :return:
+        """
+        if self._thread.is_alive():
+            self._stopped.set()
+            self._thread.join()
+
+    @staticmethod
+    def _write(path: str, text: str):
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temporary_path, path)
+
+    def export(self):
+        """
+        Записывает текущие значения метрик в оба файла
+        :return:
+        """
+        try:
+            self._write(self.json_path, json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=4))
+            self._write(self.prometheus_path, self.metrics.to_prometheus())
+        except IOError as e:
+            if self.on_error is not None:
+                self.on_error(e)
+
+    def _export_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.export()
+        self.export()
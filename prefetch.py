@@ -0,0 +1,111 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import asyncio
+
+from yandex_music import Track
+
+
+class DownloadInfoCache:
+    """
+    Кэш информации о загрузке треков (кодек, битрейт, ссылка) с упреждающей подгрузкой.
+
+    Производитель вызывает prefetch() для треков, которые ещё стоят в очереди, поэтому к моменту, когда обработчик
+    доходит до трека, запрос уже выполнен. Результат живёт ttl секунд, после чего запрашивается заново.
+    """
+
+    def __init__(self, ttl: float, max_concurrent_requests: int, fetch=None, on_prefetch=None):
+        """
+        :param ttl: время жизни записи в секундах
+        :param max_concurrent_requests: максимальное количество одновременных упреждающих запросов
+        :param fetch: асинхронная функция fetch(track), запрашивающая информацию о загрузке
+        (по умолчанию - track.get_download_info_async)
+        :param on_prefetch: функция on_prefetch(slot), которая вызывается в задаче упреждающего запроса перед его
+        началом. slot - номер от 0 до max_concurrent_requests, который не занят другими выполняющимися запросами
+        (например, для дорожки трассировки).
+        """
+        self.ttl = ttl
+        self.fetch = fetch
+        self.on_prefetch = on_prefetch
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._free_slots = list(range(max_concurrent_requests))
+        self._entries = {}
+
+    async def _fetch(self, track: Track, is_prefetch: bool = False) -> list:
+        async with self._semaphore:
+            # Номер занимают только упреждающие запросы, поэтому свободный номер есть всегда
+            slot = self._free_slots.pop() if is_prefetch else None
+            try:
+                if slot is not None and self.on_prefetch is not None:
+                    self.on_prefetch(slot)
+                if self.fetch is not None:
+                    return await self.fetch(track)
+                return await track.get_download_info_async()
+            finally:
+                if slot is not None:
+                    self._free_slots.append(slot)
+
+    def prefetch(self, track: Track):
+        """
+        Запускает фоновый запрос информации о загрузке, если её ещё нет в кэше
+        :param track: трек
+        :return:
+        """
+        entry = self._entries.get(track.id)
+        if entry is not None and entry[0] > time.monotonic():
+            return
+
+        task = asyncio.create_task(self._fetch(track, is_prefetch=True))
+        # Ошибку упреждающего запроса заберёт get(), здесь её нужно только пометить как полученную
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._entries[track.id] = (time.monotonic() + self.ttl, task)
+
+    async def get(self, track: Track) -> list:
+        """
+        Возвращает информацию о загрузке трека: из кэша, из упреждающего запроса или новым запросом
+        :param track: трек
+        :return: список DownloadInfo
+        """
+        entry = self._entries.get(track.id)
+        download_info = None
+        if entry is not None and entry[0] > time.monotonic() and not entry[1].cancelled():
+            try:
+                download_info = await entry[1]
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Упреждающий запрос завершился ошибкой, поэтому запрашиваем заново
+                pass
+
+        if download_info is None:
+            task = asyncio.ensure_future(self._fetch(track))
+            self._entries[track.id] = (time.monotonic() + self.ttl, task)
+            download_info = await task
+
+        # Трек использует этот же список при скачивании, поэтому повторного запроса не будет
+        track.download_info = download_info
+        return download_info
+
+    def discard(self, track: Track):
+        """
+        Освобождает запись о треке после его обработки
+        :param track: трек
+        :return:
+        """
+        entry = self._entries.pop(track.id, None)
+        if entry is not None and not entry[1].done():
+            entry[1].cancel()
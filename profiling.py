@@ -0,0 +1,170 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import cProfile
+import threading
+import functools
+import contextvars
+import tracemalloc
+from contextlib import contextmanager
+
+# Количество строк в отчёте о выделенной памяти
+MEMORY_REPORT_SIZE = 50
+
+# Участок, внутри которого выполняется текущий код: (идентификатор потока участка, название участка).
+# Наследуется задачами, созданными внутри участка.
+_current_profile = contextvars.ContextVar('current_profile', default=(None, None))
+
+
+class Profiler:
+    """
+    Профилирование участков программы для разбора жалоб на медленную работу.
+
+    Каждый участок выполняется под cProfile, результат сохраняется в файл pstats (открывается через pstats или
+    snakeviz). Для запусков загрузки дополнительно сохраняется разница снимков tracemalloc в начале и в конце.
+    Одновременно профилируется только один участок. Вложенные участки (в том числе в задачах, созданных внутри
+    участка) входят во внешний. Участок, начатый одновременно с работающим в том же потоке (например, второй движок
+    в общем потоке цикла событий), тоже входит в его профиль, и профиль записывается после завершения последнего
+    из них. Участки других потоков в это время не профилируются. Выключенный профилировщик ничего не делает.
+    """
+
+    def __init__(self, enabled: bool, output_folder: str, on_skip=None):
+        """
+        :param enabled: включено ли профилирование
+        :param output_folder: папка для файлов профилирования
+        :param on_skip: функция on_skip(name, active_name, is_nested), которая вызывается, когда участок name
+        не профилируется отдельно, потому что уже профилируется участок active_name (None - если профилировщик включён
+        другим инструментом). is_nested - вложен ли участок в active_name.
+        """
+        self.enabled = enabled
+        self.output_folder = output_folder
+        self.on_skip = on_skip
+        self._lock = threading.Lock()
+        self._session = None
+
+    def start(self):
+        """
+        Начинает отслеживание выделения памяти
+        :return:
+        """
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _get_filename(self, name: str, extension: str) -> str:
+        os.makedirs(self.output_folder, exist_ok=True)
+        return os.path.join(self.output_folder, f'profile-{name}-{time.strftime("%Y%m%d-%H%M%S")}.{extension}')
+
+    @contextmanager
+    def profile(self, name: str, track_memory: bool = False):
+        """
+        Профилирует блок with в текущем потоке
+        :param name: название участка (входит в имя файла)
+        :param track_memory: сохранять ли разницу снимков памяти
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        # Участки профилируются по одному: с Python 3.12 cProfile может быть включён только один на весь процесс.
+        # По контексту видно, вложен ли участок в работающий (в том числе через созданную внутри него задачу)
+        # или выполняется одновременно с ним. Одновременный участок в том же потоке (второй движок в потоке цикла
+        # событий) входит в общий профиль, а участок из другого потока не профилируется.
+        with self._lock:
+            session = self._session
+            if session is None:
+                session = self._start_session(name, track_memory)
+                is_started = session is not None
+            else:
+                is_started = False
+                is_nested = _current_profile.get() == (session['thread_id'], session['name'])
+                if not is_nested and session['thread_id'] == threading.get_ident():
+                    session['users'] += 1
+                    is_started = True
+                if self.on_skip is not None:
+                    self.on_skip(name, session['name'], is_nested)
+            if session is None and self.on_skip is not None:
+                # Профилировщик уже включён другим инструментом (например, отладчиком)
+                self.on_skip(name, None, False)
+
+        if not is_started:
+            yield
+            return
+
+        token = _current_profile.set((session['thread_id'], session['name']))
+        try:
+            yield
+        finally:
+            _current_profile.reset(token)
+            self._leave(session)
+
+    def _start_session(self, name: str, track_memory: bool):
+        profiler = cProfile.Profile()
+        memory_before = tracemalloc.take_snapshot() if track_memory and tracemalloc.is_tracing() else None
+        try:
+            profiler.enable()
+        except ValueError:
+            return None
+        self._session = {'name': name, 'thread_id': threading.get_ident(), 'users': 1, 'profiler': profiler,
+                         'memory_before': memory_before}
+        return self._session
+
+    def _leave(self, session: dict):
+        with self._lock:
+            session['users'] -= 1
+            if session['users']:
+                return
+            session['profiler'].disable()
+            self._session = None
+
+        memory_before = session['memory_before']
+        memory_after = tracemalloc.take_snapshot() if memory_before is not None else None
+        session['profiler'].dump_stats(self._get_filename(session['name'], 'pstats'))
+        if memory_after is not None:
+            self._write_memory_report(session['name'], memory_before, memory_after)
+
+    def _write_memory_report(self, name: str, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot):
+        current, peak = tracemalloc.get_traced_memory()
+        with open(self._get_filename(name, 'memory.txt'), 'w', encoding='utf-8') as file:
+            file.write(f'Текущий объём: {current / 1024:.1f} КБ, пиковый объём: {peak / 1024:.1f} КБ\n\n')
+            for statistic in after.compare_to(before, 'lineno')[:MEMORY_REPORT_SIZE]:
+                file.write(f'{statistic}\n')
+
+    def wrap(self, name: str, func):
+        """
+        Оборачивает функцию (например, цель потока) так, чтобы она выполнялась под профилировщиком
+        :param name: название участка
+        :param func: функция
+        :return: обёрнутая функция
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    async def run(self, name: str, coroutine):
+        """
+        Выполняет корутину под профилировщиком в потоке цикла событий, сохраняя разницу снимков памяти.
+        Профилировщик видит все задачи цикла, которые выполнялись в это время.
+        :param name: название участка
+        :param coroutine: корутина
+        :return: результат корутины
+        """
+        with self.profile(name, track_memory=True):
+            return await coroutine
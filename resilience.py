@@ -0,0 +1,180 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import random
+import asyncio
+
+from yandex_music.exceptions import NetworkError, BadRequestError, NotFoundError
+
+
+class CircuitBrokenError(NetworkError):
+    """
+    Предохранитель окончательно разомкнут: сеть так и не восстановилась
+    """
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Проверяет, имеет ли смысл повторять запрос, завершившийся данной ошибкой
+    :param error: исключение
+    :return: True - если ошибка сетевая и временная, False - если нет.
+    """
+    if isinstance(error, (BadRequestError, NotFoundError, CircuitBrokenError)):
+        return False
+    return isinstance(error, (NetworkError, asyncio.TimeoutError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Предохранитель одного запуска загрузки.
+
+    После failure_threshold подряд сетевых ошибок размыкается: все запросы ждут cooldown секунд, затем один
+    пробный запрос проверяет сеть. Удачная проба замыкает предохранитель, неудачная - снова размыкает его
+    с удвоенной паузой. После max_failed_probes неудачных проб подряд запуск прерывается.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, cooldown: float, max_cooldown: float, max_failed_probes: int,
+                 on_state_change=None):
+        """
+        :param failure_threshold: количество ошибок подряд, после которого предохранитель размыкается
+        :param cooldown: начальная пауза перед пробным запросом
+        :param max_cooldown: максимальная пауза перед пробным запросом
+        :param max_failed_probes: количество неудачных проб подряд, после которого запуск прерывается
+        :param on_state_change: функция on_state_change(state, cooldown), вызываемая при смене состояния
+        """
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_failed_probes = max_failed_probes
+        self.on_state_change = on_state_change
+
+        self.state = self.CLOSED
+        self.is_broken = False
+        self._cooldown = cooldown
+        self._consecutive_failures = 0
+        self._failed_probes = 0
+        self._opened_until = 0.0
+        self._probe_finished = None
+
+    def _set_state(self, state: str):
+        self.state = state
+        if self.on_state_change is not None:
+            self.on_state_change(state, self._cooldown)
+
+    def _open(self):
+        self._opened_until = time.monotonic() + self._cooldown
+        self._set_state(self.OPEN)
+
+    async def before_call(self) -> bool:
+        """
+        Ждёт, пока предохранитель разрешит выполнить запрос
+        :return: True - если этот запрос является пробным, False - если нет.
+        """
+        while True:
+            if self.is_broken:
+                raise CircuitBrokenError('Не удалось дождаться восстановления сети')
+
+            if self.state == self.CLOSED:
+                return False
+
+            if self.state == self.OPEN:
+                delay = self._opened_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                self._probe_finished = asyncio.Event()
+                self._set_state(self.HALF_OPEN)
+                return True
+
+            await self._probe_finished.wait()
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        if self.state != self.CLOSED:
+            self._failed_probes = 0
+            self._cooldown = self.base_cooldown
+            self._set_state(self.CLOSED)
+            if self._probe_finished is not None:
+                self._probe_finished.set()
+
+    def record_failure(self, is_probe: bool = False):
+        if is_probe:
+            self._failed_probes += 1
+            if self._failed_probes >= self.max_failed_probes:
+                self.is_broken = True
+            else:
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                self._open()
+            self._probe_finished.set()
+        elif self.state == self.CLOSED:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def abort_probe(self):
+        """
+        Возвращает право на пробу другим запросам, если пробный запрос был отменён
+        :return:
+        """
+        if self.state == self.HALF_OPEN:
+            self._opened_until = time.monotonic()
+            self.state = self.OPEN
+            self._probe_finished.set()
+
+
+async def call_with_retries(func, *args, attempts: int, base_delay: float, max_delay: float,
+                            breaker: CircuitBreaker = None, on_failure=None, **kwargs):
+    """
+    Выполняет запрос с повторами после временных сетевых ошибок (экспоненциальная пауза со случайным разбросом)
+    :param func: асинхронная функция запроса
+    :param attempts: максимальное количество попыток
+    :param base_delay: пауза перед второй попыткой
+    :param max_delay: максимальная пауза между попытками
+    :param breaker: предохранитель запуска
+    :param on_failure: функция on_failure(error), вызываемая после каждой временной ошибки
+    :return: результат запроса
+    """
+    for attempt in range(attempts):
+        is_probe = await breaker.before_call() if breaker is not None else False
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            if is_probe:
+                breaker.abort_probe()
+            raise
+        except Exception as e:
+            if not is_transient_error(e):
+                # Сервер ответил (пусть и ошибкой), значит сеть доступна
+                if breaker is not None:
+                    breaker.record_success()
+                raise
+
+            if breaker is not None:
+                breaker.record_failure(is_probe)
+            if on_failure is not None:
+                on_failure(e)
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,148 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import time
+import queue
+import threading
+
+
+class RunLog:
+    """
+    Отчёт одного запуска загрузки в папке info плейлиста.
+
+    Скачанные, пропущенные и неудачные треки записываются в текстовые файлы (по файлу на каждый статус) и в общий
+    файл JSON Lines. Файлы открываются один раз на запуск, а запись идёт в отдельном потоке: записи копятся
+    в буфере и сбрасываются на диск раз в flush_interval секунд.
+    """
+
+    DOWNLOADED = 'd'
+    ERROR = 'e'
+    SKIPPED = 's'
+
+    _STATUSES = {DOWNLOADED: 'downloaded', ERROR: 'error', SKIPPED: 'skipped'}
+    _STOP = object()
+
+    def __init__(self, filenames: dict, flush_interval: float, on_error=None):
+        """
+        :param filenames: пути к файлам: 'd', 'e', 's' - текстовые файлы статусов, 'jsonl' - файл JSON Lines
+        :param flush_interval: максимальное время в секундах, которое записи проводят в буфере
+        :param on_error: функция on_error(error), вызываемая при ошибке записи
+        """
+        self.filenames = filenames
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+
+        self._files = {}
+        self._records = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name='RunLogWriter', daemon=True)
+
+    def start(self, append: bool = False):
+        """
+        Создаёт (очищает) файлы отчёта и запускает поток записи
+        :param append: дописывать ли существующие файлы (например, при продолжении прерванного запуска)
+        :return:
+        """
+        try:
+            for key, filename in self.filenames.items():
+                self._files[key] = open(filename, 'a' if append else 'w', encoding='utf-8')
+        except IOError:
+            self._close_files()
+            raise
+        self._writer.start()
+
+    def downloaded(self, track_id: str, track_name: str, number: int):
+        """
+        Записывает скачанный трек
+        :param track_id: идентификатор трека
+        :param track_name: название трека
+        :param number: порядковый номер скачанного трека
+        :return:
+        """
+        self._records.put((self.DOWNLOADED, f'{number}] {track_name}',
+                           {'track_id': track_id, 'track': track_name, 'number': number}))
+
+    def error(self, track_id: str, track_name: str, reason: str):
+        """
+        Записывает трек, который не удалось скачать
+        :param track_id: идентификатор трека
+        :param track_name: название трека
+        :param reason: причина ошибки
+        :return:
+        """
+        self._records.put((self.ERROR, f'{track_name} ~ {reason}',
+                           {'track_id': track_id, 'track': track_name, 'reason': reason}))
+
+    def skipped(self, track_id: str, track_name: str, reason: str):
+        """
+        Записывает пропущенный трек
+        :param track_id: идентификатор трека
+        :param track_name: название трека
+        :param reason: причина пропуска
+        :return:
+        """
+        self._records.put((self.SKIPPED, f'{track_name} ~ {reason}',
+                           {'track_id': track_id, 'track': track_name, 'reason': reason}))
+
+    def close(self):
+        """
+        Записывает оставшиеся записи и закрывает файлы
+        :return:
+        """
+        if self._writer.is_alive():
+            self._records.put(self._STOP)
+            self._writer.join()
+        self._close_files()
+
+    def _close_files(self):
+        for file in self._files.values():
+            try:
+                file.close()
+            except IOError as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+        self._files = {}
+
+    def _write(self, kind: str, line: str, fields: dict):
+        self._files[kind].write(f'{line}\n')
+        record = {'time': time.time(), 'status': self._STATUSES[kind]}
+        record.update(fields)
+        self._files['jsonl'].write(f'{json.dumps(record, ensure_ascii=False)}\n')
+
+    def _flush(self):
+        for file in self._files.values():
+            file.flush()
+
+    def _writer_loop(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._records.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            try:
+                if item is self._STOP:
+                    self._flush()
+                    break
+                if item is not None:
+                    self._write(*item)
+                if time.monotonic() >= next_flush:
+                    self._flush()
+                    next_flush = time.monotonic() + self.flush_interval
+            except IOError as e:
+                if self.on_error is not None:
+                    self.on_error(e)
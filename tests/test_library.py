@@ -0,0 +1,69 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sqlite3
+import unittest
+
+import library
+
+_LEGACY_COLUMNS = "track_id INTEGER, artist_id TEXT, album_id TEXT, track_name TEXT, artist_name TEXT, " \
+                  "album_name TEXT, genre TEXT, track_number INTEGER, disk_number INTEGER, year INTEGER, " \
+                  "release_data TEXT, bit_rate INTEGER, codec TEXT, is_favorite INTEGER, is_explicit INTEGER, " \
+                  "is_popular INTEGER"
+
+
+class PrepareLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def _create_legacy_table(self, playlist_title: str, track_ids: list):
+        table_name = library.get_legacy_table_name(playlist_title).replace('"', '""')
+        self.db.execute(f'CREATE TABLE "{table_name}"({_LEGACY_COLUMNS});')
+        self.db.executemany(f'INSERT INTO "{table_name}" VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);',
+                            [(track_id, '10', '5', f'Track {track_id}', 'Artist', 'Album', 'pop', 1, 1, 2020, None,
+                              320, 'mp3', 0, 0, 0) for track_id in track_ids])
+        self.db.commit()
+
+    def test_titles_with_special_symbols(self):
+        playlists = [(1, 'Lo-fi'), (2, 'Hits (2020)'), (3, 'Rock'), (4, 'Say "hi"')]
+        for playlist_kind, playlist_title in playlists:
+            self._create_legacy_table(playlist_title, [playlist_kind * 10, playlist_kind * 10 + 1])
+
+        result = library.prepare_library(self.db, playlists)
+
+        self.assertEqual(len(result['migrated']), len(playlists))
+        self.assertEqual(result['collisions'], {})
+        self.assertEqual(result['unmatched'], [])
+        counts = dict(self.db.execute("SELECT playlist_kind, COUNT(*) FROM playlist_tracks GROUP BY playlist_kind;"))
+        self.assertEqual(counts, {1: 2, 2: 2, 3: 2, 4: 2})
+        for playlist_kind, playlist_title in playlists:
+            view_name = library.get_legacy_table_name(playlist_title).replace('"', '""')
+            rows = self.db.execute(f'SELECT track_id FROM "{view_name}" ORDER BY track_id;').fetchall()
+            self.assertEqual(rows, [(playlist_kind * 10,), (playlist_kind * 10 + 1,)])
+
+    def test_rename_replaces_view(self):
+        library.prepare_library(self.db, [(1, 'Lo-fi beats')])
+        library.prepare_library(self.db, [(1, 'Lo-fi (old)'), (2, 'Lo-fi beats')])
+
+        sql = self.db.execute("SELECT sql FROM sqlite_master WHERE name == 'table_Lo-fi_beats';").fetchone()[0]
+        self.assertRegex(sql, r'playlist_kind == 2;?$')
+
+
+if __name__ == '__main__':
+    unittest.main()
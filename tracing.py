@@ -0,0 +1,97 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import contextvars
+from contextlib import contextmanager
+
+# Дорожка трассировки текущей асинхронной задачи (у каждого обработчика своя)
+_current_lane = contextvars.ContextVar('trace_lane', default=0)
+# Сведения внешнего интервала, которые наследуют вложенные интервалы (например, идентификатор трека)
+_current_args = contextvars.ContextVar('trace_args', default={})
+
+
+class Tracer:
+    """
+    Трассировка одного запуска в формате Chrome Trace Event (открывается в chrome://tracing и ui.perfetto.dev).
+
+    Каждый обработчик пишет интервалы на свою дорожку, поэтому в просмотрщике их работа видна параллельно.
+    Выключенная трассировка ничего не записывает.
+    """
+
+    MAIN_LANE = 0
+
+    def __init__(self, enabled: bool):
+        """
+        :param enabled: включена ли трассировка
+        """
+        self.enabled = enabled
+        self._started = time.perf_counter_ns()
+        self._events = []
+        self._lanes = {self.MAIN_LANE: 'Движок'}
+
+    def _now(self) -> float:
+        return (time.perf_counter_ns() - self._started) / 1000
+
+    def set_lane(self, lane: int, name: str):
+        """
+        Назначает дорожку текущей асинхронной задаче
+        :param lane: номер дорожки
+        :param name: название дорожки в просмотрщике
+        :return:
+        """
+        if not self.enabled:
+            return
+        self._lanes[lane] = name
+        _current_lane.set(lane)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """
+        Записывает интервал выполнения блока with на дорожку текущей задачи
+        :param name: название интервала
+        :param args: дополнительные сведения (идентификатор трека, кодек и т.д.), которые наследуют вложенные интервалы
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        args = {**_current_args.get(), **args}
+        token = _current_args.set(args)
+        started = self._now()
+        try:
+            yield
+        except Exception as e:
+            args = {**args, 'error': type(e).__name__}
+            raise
+        finally:
+            _current_args.reset(token)
+            self._events.append({'name': name, 'ph': 'X', 'ts': started, 'dur': self._now() - started,
+                                 'pid': os.getpid(), 'tid': _current_lane.get(), 'args': args})
+
+    def write(self, filename: str):
+        """
+        Записывает трассировку в файл
+        :param filename: путь к файлу
+        :return:
+        """
+        lanes = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': lane, 'args': {'name': name}}
+                 for lane, name in self._lanes.items()]
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': lanes + self._events, 'displayTimeUnit': 'ms'}, file, ensure_ascii=False)
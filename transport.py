@@ -0,0 +1,337 @@
+"""
+Copyright 2022 laynholt
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import json
+import asyncio
+import threading
+
+import aiohttp
+import aiofiles
+import requests
+from requests.adapters import HTTPAdapter
+
+from yandex_music.utils import request as sync_request
+from yandex_music.utils import request_async
+from yandex_music.exceptions import (
+    YandexMusicError, UnauthorizedError, BadRequestError, NotFoundError, NetworkError, TimedOutError
+)
+
+from limiter import RateLimiter
+
+# Размер порции, которой читается тело ответа (по ней же списываются байты у ограничителя скорости)
+CHUNK_SIZE = 64 * 1024
+# Суффикс файла, в который идёт загрузка, пока она не завершена
+PART_SUFFIX = '.part'
+# Суффикс файла рядом с .part, в котором хранятся размер и валидатор (ETag или Last-Modified) скачиваемого файла
+PART_INFO_SUFFIX = '.info'
+
+
+def _raise_for_status(request, status: int, content: bytes):
+    """
+    Бросает исключение yandex_music, соответствующее коду ответа (так же, как это делает сама библиотека)
+    :param request: объект запроса, который умеет разбирать тело ответа
+    :param status: код ответа
+    :param content: тело ответа
+    :return:
+    """
+    try:
+        parse = request._parse(content)
+        message = parse.get_error()
+    except YandexMusicError:
+        message = 'Unknown HTTPError'
+
+    if status in (401, 403):
+        raise UnauthorizedError(message)
+    elif status == 400:
+        raise BadRequestError(message)
+    elif status == 404:
+        raise NotFoundError(message)
+    elif status in (409, 413):
+        raise NetworkError(message)
+    elif status == 502:
+        raise NetworkError('Bad Gateway')
+    else:
+        raise NetworkError(f'{message} ({status}): {content}')
+
+
+class HttpTransport:
+    """
+    Общий пул HTTP-соединений для всех обработчиков и плейлистов.
+
+    Держит отдельный поток с циклом событий и одну aiohttp-сессию на нём, поэтому соединения (и TLS-рукопожатия)
+    переиспользуются между треками и плейлистами.
+    """
+
+    def __init__(self, pool_size: int, pool_size_per_host: int, keepalive_timeout: float, dns_cache_ttl: int,
+                 limiter: RateLimiter):
+        self.limiter = limiter
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='HttpTransport', daemon=True)
+        self.session: aiohttp.ClientSession = None
+
+    def start(self):
+        """
+        Запускает поток цикла событий и создаёт в нём сессию
+        :return:
+        """
+        self.thread.start()
+        self.run(self._create_session())
+
+    async def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                         limit_per_host=self.pool_size_per_host,
+                                         keepalive_timeout=self.keepalive_timeout,
+                                         ttl_dns_cache=self.dns_cache_ttl)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    def run(self, coroutine):
+        """
+        Выполняет корутину в цикле событий транспорта и ждёт результата
+        :param coroutine: корутина
+        :return: результат корутины
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        """
+        Закрывает сессию и останавливает цикл событий
+        :return:
+        """
+        if not self.thread.is_alive():
+            return
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def get_part_filename(filename: str, codec: str, bitrate: int) -> str:
+    """
+    Возвращает путь к недокачанному аудиофайлу. Кодек и битрейт входят в имя, чтобы попытки с разным качеством
+    не продолжали куски друг друга.
+    :param filename: путь к итоговому файлу
+    :param codec: кодек
+    :param bitrate: битрейт
+    :return: путь к .part файлу
+    """
+    return f'{os.path.splitext(filename)[0]}.{codec}-{bitrate}{PART_SUFFIX}'
+
+
+class PooledRequest(request_async.Request):
+    """
+    Асинхронный запрос yandex_music, который ходит в сеть через общий пул HttpTransport
+    """
+
+    def __init__(self, transport: HttpTransport, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transport = transport
+
+    async def _request_wrapper(self, *args, **kwargs):
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {}
+
+        kwargs['headers']['User-Agent'] = request_async.USER_AGENT
+
+        # Библиотека ограничивает общее время запроса, из-за чего при ограничении скорости большие файлы
+        # не успевают скачаться. Поэтому таймаут переносится на подключение и ожидание очередной порции данных.
+        timeout = kwargs.get('timeout')
+        if timeout is not None and timeout.total is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_connect=timeout.total, sock_read=timeout.total)
+
+        limiter = self.transport.limiter
+        try:
+            await limiter.acquire_request()
+            async with self.transport.session.request(*args, **kwargs) as resp:
+                chunks = []
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    await limiter.acquire_bytes(len(chunk))
+                    chunks.append(chunk)
+                content = b''.join(chunks)
+        except asyncio.TimeoutError:
+            raise TimedOutError()
+        except aiohttp.ClientError as e:
+            raise NetworkError(e)
+
+        if 200 <= resp.status <= 299:
+            return content
+        _raise_for_status(self, resp.status, content)
+
+    @staticmethod
+    def _parse_content_range(content_range: str) -> tuple:
+        """
+        Разбирает заголовок Content-Range
+        :param content_range: значение заголовка вида "bytes 100-199/200"
+        :return: (начало диапазона, полный размер файла), None вместо неизвестных или неразобранных значений
+        """
+        match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', content_range or '')
+        if not match:
+            return None, None
+        return int(match.group(1)), int(match.group(2)) if match.group(2) != '*' else None
+
+    @staticmethod
+    def _discard_part(part_filename: str):
+        for path in (part_filename, f'{part_filename}{PART_INFO_SUFFIX}'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _read_part_info(part_filename: str):
+        """
+        Читает сведения о файле, загрузка которого была начата в part_filename
+        :param part_filename: путь к недокачанному файлу
+        :return: {'size': полный размер, 'validator': ETag или Last-Modified} или None, если сведений нет
+        """
+        try:
+            with open(f'{part_filename}{PART_INFO_SUFFIX}', 'r', encoding='utf-8') as file:
+                part_info = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(part_info, dict) or not isinstance(part_info.get('size'), int):
+            return None
+        return part_info
+
+    @staticmethod
+    def _write_part_info(part_filename: str, size: int, validator):
+        with open(f'{part_filename}{PART_INFO_SUFFIX}', 'w', encoding='utf-8') as file:
+            json.dump({'size': size, 'validator': validator}, file)
+
+    @staticmethod
+    def _get_validator(headers) -> str:
+        """
+        Возвращает значение для If-Range: сильный ETag, а если его нет - Last-Modified
+        :param headers: заголовки ответа
+        :return: значение валидатора или None
+        """
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return headers.get('Last-Modified')
+
+    async def download(self, url, filename, timeout=5, *args, part_filename: str = None, **kwargs) -> None:
+        """
+        Потоково скачивает файл во временный .part файл и атомарно переименовывает его по завершении.
+        Если .part уже есть (прошлая попытка оборвалась), загрузка продолжается с места обрыва через заголовок Range.
+        Продолжение возможно, только если сервер подтвердил, что файл не изменился (If-Range и полный размер
+        из Content-Range совпадают с сохранёнными при начале загрузки), иначе .part удаляется.
+        :param url: адрес файла
+        :param filename: путь к итоговому файлу
+        :param timeout: время ожидания подключения и очередной порции данных
+        :param part_filename: путь к недокачанному файлу (по умолчанию filename.part)
+        :return:
+        """
+        if part_filename is None:
+            part_filename = f'{filename}{PART_SUFFIX}'
+
+        offset = 0
+        part_info = None
+        if os.path.exists(part_filename):
+            part_info = self._read_part_info(part_filename)
+            if part_info is None:
+                # Без сведений о файле нельзя проверить, что сохранённый кусок от того же файла
+                self._discard_part(part_filename)
+            else:
+                offset = os.path.getsize(part_filename)
+
+        headers = {'User-Agent': request_async.USER_AGENT}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if part_info['validator']:
+                headers['If-Range'] = part_info['validator']
+
+        limiter = self.transport.limiter
+        try:
+            await limiter.acquire_request()
+            async with self.transport.session.get(url, headers=headers, proxy=self.proxy_url,
+                                                  timeout=aiohttp.ClientTimeout(sock_connect=timeout,
+                                                                                sock_read=timeout)) as resp:
+                if resp.status == 416:
+                    # Сохранённый кусок не соответствует файлу на сервере, начинаем заново
+                    self._discard_part(part_filename)
+                    raise NetworkError(f'Range Not Satisfiable: {url}')
+                if not 200 <= resp.status <= 299:
+                    _raise_for_status(self, resp.status, await resp.read())
+
+                if resp.status == 206:
+                    start, size = self._parse_content_range(resp.headers.get('Content-Range'))
+                    if not offset or start != offset or size != part_info['size']:
+                        # Сервер отдаёт кусок другого файла (сменился источник или битрейт), склеивать их нельзя
+                        self._discard_part(part_filename)
+                        raise NetworkError(f'Сохранённая часть файла [{filename}] не совпадает с файлом на сервере')
+                    mode = 'ab'
+                else:
+                    # Сервер отдаёт файл целиком (в том числе если файл изменился и If-Range не совпал)
+                    mode = 'wb'
+                    offset = 0
+                    size = resp.content_length
+                    if size is not None:
+                        self._write_part_info(part_filename, size, self._get_validator(resp.headers))
+                    elif os.path.exists(f'{part_filename}{PART_INFO_SUFFIX}'):
+                        os.remove(f'{part_filename}{PART_INFO_SUFFIX}')
+
+                async with aiofiles.open(part_filename, mode) as file:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        await limiter.acquire_bytes(len(chunk))
+                        await file.write(chunk)
+        except asyncio.TimeoutError:
+            raise TimedOutError()
+        except aiohttp.ClientError as e:
+            raise NetworkError(e)
+
+        if size is not None and os.path.getsize(part_filename) != size:
+            raise NetworkError(f'Загрузка файла [{filename}] оборвалась')
+        os.replace(part_filename, filename)
+        if os.path.exists(f'{part_filename}{PART_INFO_SUFFIX}'):
+            os.remove(f'{part_filename}{PART_INFO_SUFFIX}')
+
+
+class PooledSyncRequest(sync_request.Request):
+    """
+    Синхронный запрос yandex_music с keep-alive пулом requests.Session (для запросов из интерфейса)
+    """
+
+    def __init__(self, pool_size: int, limiter: RateLimiter, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request_wrapper(self, *args, **kwargs):
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {}
+
+        kwargs['headers']['User-Agent'] = sync_request.USER_AGENT
+
+        try:
+            self.limiter.wait_request()
+            resp = self.session.request(*args, **kwargs)
+        except requests.Timeout:
+            raise TimedOutError()
+        except requests.RequestException as e:
+            raise NetworkError(e)
+        self.limiter.wait_bytes(len(resp.content))
+
+        if 200 <= resp.status_code <= 299:
+            return resp.content
+        _raise_for_status(self, resp.status_code, resp.content)
@@ -21,12 +21,12 @@ from tkinter.ttk import Combobox, Checkbutton, Progressbar, LabelFrame, Button,
 import re
 import os
 import json
-import math
+import atexit
 import sqlite3
 import asyncio
 import threading
 import webbrowser
-from queue import Queue, Empty
+import contextlib
 from PIL import Image, ImageTk
 
 import time
@@ -34,14 +34,29 @@ import time
 from mutagen import File
 from mutagen.id3 import TIT2, TPE1, TALB, APIC, TDRC, TRCK, TPOS, TPE2, TCON, USLT
 
-from yandex_music import Client, Track, TracksList
-from yandex_music.exceptions import YandexMusicError, UnauthorizedError, NetworkError
+from yandex_music import Client, ClientAsync, Track, TrackShort
+from yandex_music.exceptions import YandexMusicError, UnauthorizedError, NetworkError, InvalidBitrateError
 
 import config
 from custom_formatter import CustomFormatter, logger_format
 from session import YandexSession
+from transport import HttpTransport, PooledRequest, PooledSyncRequest, get_part_filename
+from limiter import RateLimiter
+from prefetch import DownloadInfoCache
+from concurrency import ConcurrencyController
+from resilience import CircuitBreaker, call_with_retries, is_transient_error
+from journal import JobJournal, get_track_key
+from database import HistoryDatabase
+from folder_index import FolderIndex
+from run_log import RunLog
+from metrics import RunMetrics, MetricsExporter
+from tracing import Tracer
+from profiling import Profiler
+import library
 
 import logging.config
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 logger = logging.getLogger(__name__)
 
@@ -50,16 +65,23 @@ def setup_logger(logger_type: int):
     logger.setLevel(logger_type)
 
     os.makedirs(config.paths['dirs']['stuff'], exist_ok=True)
-    if os.path.exists(config.paths['files']['log']):
-        os.remove(config.paths['files']['log'])
 
-    file_handler = logging.FileHandler(config.paths['files']['log'], encoding='utf-8')
+    # Журнал прошлого запуска не удаляется, а уходит в резервную копию
+    file_handler = RotatingFileHandler(config.paths['files']['log'], maxBytes=config.LOG_MAX_BYTES,
+                                       backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
     file_handler.setFormatter(logging.Formatter(logger_format))
-    logger.addHandler(file_handler)
+    if os.path.exists(config.paths['files']['log']) and os.path.getsize(config.paths['files']['log']) > 0:
+        file_handler.doRollover()
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(CustomFormatter())
-    logger.addHandler(console_handler)
+
+    # Рабочие потоки только кладут записи в очередь, в файл и консоль их пишет отдельный поток
+    log_queue = SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, console_handler)
+    listener.start()
+    atexit.register(listener.stop)
 
 
 def strip_bad_symbols(text: str, soft_mode: bool = False) -> str:
@@ -77,11 +99,30 @@ class YandexMusicDownloader:
         self.download_folder_path = None
         self.is_rewritable = None
 
+        # Профилирование включается в конфиге или переменной окружения YMD_PROFILE=1. Участки профилируются
+        # по одному, поэтому Tk mainloop, который работает всё время, профилируется только при YMD_PROFILE=mainloop,
+        # иначе он закрыл бы профилирование загрузки.
+        def _on_profile_skip(name: str, active_name: str, is_nested: bool):
+            if active_name is None:
+                logger.error('Участок [%s] не профилируется: профилировщик уже включён другим инструментом.', name)
+            elif is_nested:
+                logger.debug('Участок [%s] вложен в участок [%s] и войдёт в его профиль.', name, active_name)
+            else:
+                logger.debug('Участок [%s] не профилируется отдельно: уже профилируется участок [%s].',
+                             name, active_name)
+
+        profiling_mode = os.environ.get('YMD_PROFILE', '0')
+        self.profiler = Profiler(enabled=config.PROFILING_ENABLED or profiling_mode != '0',
+                                 output_folder=config.paths['dirs']['stuff'],
+                                 on_skip=_on_profile_skip)
+        self.is_mainloop_profiled = profiling_mode == 'mainloop'
+
     def start(self):
         """
         Метод, для запуска загрузчика
         :return:
         """
+        self.profiler.start()
         try:
             if self._run_configuration_window():
                 self._run_main_window()
@@ -109,18 +150,20 @@ class YandexMusicDownloader:
                     try:
                         data = json.load(config_file)
                         self.token = data['token']
-                        logger.debug(f'Из файла [{config_filename}] был получен токен: [{self.token}]')
+                        logger.debug('Из файла [%s] был получен токен: [%s]', config_filename, self.token)
                         self.history_database_path = data['history']
-                        logger.debug(f'Из файла [{config_filename}] был получен путь в базе данных: [{self.history_database_path}]')
+                        logger.debug('Из файла [%s] был получен путь в базе данных: [%s]',
+                                     config_filename, self.history_database_path)
                         self.download_folder_path = data['download']
-                        logger.debug(f'Из файла [{config_filename}] был получен путь к папке загрузок: [{self.download_folder_path}]')
+                        logger.debug('Из файла [%s] был получен путь к папке загрузок: [%s]',
+                                     config_filename, self.download_folder_path)
                     except json.decoder.JSONDecodeError:
-                        logger.error(f'Ошибка при разборе файла [{config_filename}]!')
+                        logger.error('Ошибка при разборе файла [%s]!', config_filename)
                     except KeyError:
-                        logger.error(f'Ошибка при попытке извлечь данные. '
-                                     f'Видимо файл [{config_filename}] был ошибочно записан, либо некорректно изменён!')
+                        logger.error('Ошибка при попытке извлечь данные. Видимо файл [%s] был ошибочно записан, '
+                                     'либо некорректно изменён!', config_filename)
             except IOError:
-                logger.error(f'Не удалось открыть файл [{config_filename}] для чтения!')
+                logger.error('Не удалось открыть файл [%s] для чтения!', config_filename)
 
         configuration_window = tkinter.Tk()
         configuration_window.geometry('550x280')
@@ -251,7 +294,7 @@ class YandexMusicDownloader:
 
                 if response.get_error() is not None:
                     messagebox.showerror('Ошибка', f'{response.get_error()}')
-                    logger.error(f'{response.get_error().replace(chr(10), "")}')
+                    logger.error('%s', response.get_error().replace(chr(10), ""))
                     return
 
                 if response.get_token() is None:
@@ -262,7 +305,7 @@ class YandexMusicDownloader:
                 self.token = response.get_token()
                 entry_enter_token.delete(0, tkinter.END)
                 entry_enter_token.insert(0, self.token)
-                logger.debug(f'Авторизация прошла успешно! Получен токен для аккаунта [{self.token}].')
+                logger.debug('Авторизация прошла успешно! Получен токен для аккаунта [%s].', self.token)
 
                 auth_window.destroy()
 
@@ -290,7 +333,7 @@ class YandexMusicDownloader:
             if database != "":
                 self.history_database_path = os.path.abspath(database)
             _set_logger_level()
-            logger.debug(f'Файл базы данных установлен на: [{self.history_database_path}].')
+            logger.debug('Файл базы данных установлен на: [%s].', self.history_database_path)
 
         button_history = Button(labelframe_optional, text='Указать БД', command=_choose_database)
         button_history.grid(column=0, row=3, padx=5, pady=5)
@@ -301,7 +344,7 @@ class YandexMusicDownloader:
             if folder != "":
                 self.download_folder_path = os.path.abspath(folder)
             _set_logger_level()
-            logger.debug(f'Папка загрузки установлена на: [{self.download_folder_path}].')
+            logger.debug('Папка загрузки установлена на: [%s].', self.download_folder_path)
 
         button_download = Button(labelframe_optional, text='Указать папку Download', command=_choose_download)
         button_download.grid(column=1, row=3, padx=5, pady=5)
@@ -319,9 +362,9 @@ class YandexMusicDownloader:
             self.history_database_path = config.paths['files']['history']
             self.download_folder_path = config.paths['dirs']['download']
             _set_logger_level()
-            logger.debug(f'Токен установлен в [{self.token}].')
-            logger.debug(f'Путь к файлу базы данных установлен в [{self.history_database_path}].')
-            logger.debug(f'Путь к папке Загрузки установлен в [{self.download_folder_path}].')
+            logger.debug('Токен установлен в [%s].', self.token)
+            logger.debug('Путь к файлу базы данных установлен в [%s].', self.history_database_path)
+            logger.debug('Путь к папке Загрузки установлен в [%s].', self.download_folder_path)
             check_is_rewritable.set(self.is_rewritable)
 
         button_reset = Button(configuration_window, text='Сбросить всё', command=_reset_all)
@@ -346,11 +389,11 @@ class YandexMusicDownloader:
                         'download': self.download_folder_path
                     }
                     json.dump(data1, config_file1)
-                    logger.debug(f'Значения токена: [{self.token}], пути к базе данных: [{self.history_database_path}] '
-                                 f'и пути к папке скачивания: [{self.download_folder_path}] были записаны в файл: '
-                                 f'[{config_filename}].')
+                    logger.debug('Значения токена: [%s], пути к базе данных: [%s] '
+                                 'и пути к папке скачивания: [%s] были записаны в файл: [%s].',
+                                 self.token, self.history_database_path, self.download_folder_path, config_filename)
             except IOError:
-                logger.error(f'Не удалось открыть файл [{config_filename}] для записи!')
+                logger.error('Не удалось открыть файл [%s] для записи!', config_filename)
             nonlocal is_continue
             is_continue = True
             configuration_window.destroy()
@@ -371,7 +414,18 @@ class YandexMusicDownloader:
         self.playlists_covers_folder_name = config.paths['dirs']['playlists_covers']
 
         self.number_of_workers = config.NUMBER_OF_WORKERS
-        self.chunk_of_tracks = config.CHUNK_OF_TRACKS
+        self.tracks_window_size = config.TRACKS_WINDOW_SIZE
+        self.hydration_batch_size = config.HYDRATION_BATCH_SIZE
+
+        # Общий пул HTTP-соединений и ограничитель скорости для всех обработчиков и плейлистов
+        self.limiter = RateLimiter(requests_per_second=config.RATE_LIMIT_REQUESTS_PER_SECOND,
+                                   bytes_per_second=config.RATE_LIMIT_BYTES_PER_SECOND)
+        self.transport = HttpTransport(pool_size=config.HTTP_POOL_SIZE,
+                                       pool_size_per_host=config.HTTP_POOL_SIZE_PER_HOST,
+                                       keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+                                       dns_cache_ttl=config.HTTP_DNS_CACHE_TTL,
+                                       limiter=self.limiter)
+        self.transport.start()
 
         self.main_window = tkinter.Tk()
         self.main_window.geometry('550x170')
@@ -384,13 +438,15 @@ class YandexMusicDownloader:
         self.main_window.resizable(width=False, height=False)
 
         self.client = None
+        self.async_client = None
         self.playlists = []
-        self.liked_tracks = []
+        self.liked_track_ids = frozenset()
         self.downloading_or_updating_playlists = {}
         self.partial_downloading_or_updating_tracks = {}
 
         # Загружаем все пользовательские данные
-        thread = threading.Thread(target=self._load_all_account_info, daemon=True)
+        thread = threading.Thread(target=self.profiler.wrap('account_info', self._load_all_account_info),
+                                  daemon=True)
         thread.start()
 
         def _about():
@@ -449,6 +505,9 @@ class YandexMusicDownloader:
         self.is_rewritable.set(is_rewritable)
         self.menu_additional.add_checkbutton(label='Перезаписывать существующие треки', onvalue=1, offvalue=0,
                                              variable=self.is_rewritable)
+        self.menu_additional.add_separator()
+        self.menu_additional.add_command(label='Ограничить скорость загрузки и частоту запросов',
+                                         command=lambda: self._rate_limits_window())
 
         self.menu_main.add_cascade(label='Дополнительно', menu=self.menu_additional)
         self.menu_main.add_cascade(label='Справка', menu=self.menu_help)
@@ -494,17 +553,69 @@ class YandexMusicDownloader:
             alive_threads = threading.enumerate()
             for _thread in alive_threads:
                 if _thread is main_thread:
-                    logger.debug(f'Основной поток [{main_thread.ident}] ожидает завершения всех дочерних.')
+                    logger.debug('Основной поток [%s] ожидает завершения всех дочерних.', main_thread.ident)
+                    continue
+                if _thread is self.transport.thread:
                     continue
                 _thread_id = _thread.ident
-                logger.debug(f'Ожидание заверешния потока [{_thread_id}]')
+                logger.debug('Ожидание заверешния потока [%s]', _thread_id)
                 _thread.join()
-                logger.debug(f'Поток [{_thread_id}] был завершён.')
+                logger.debug('Поток [%s] был завершён.', _thread_id)
+            self.transport.close()
             logger.debug('Все потоки завершены. Завершение основного потока...')
             self.main_window.destroy()
 
         self.main_window.protocol("WM_DELETE_WINDOW", _prepare_to_close_main_program)
-        self.main_window.mainloop()
+        with self.profiler.profile('mainloop') if self.is_mainloop_profiled else contextlib.nullcontext():
+            self.main_window.mainloop()
+
+    def _rate_limits_window(self):
+        """
+        Окно для изменения ограничений скорости загрузки и частоты запросов на лету
+        :return:
+        """
+        limits_window = tkinter.Toplevel(self.main_window)
+        limits_window.geometry('420x130')
+        try:
+            limits_window.iconbitmap(config.paths["files"]["icon"])
+        except tkinter.TclError:
+            pass
+
+        limits_window.title('Ограничения загрузки')
+        limits_window.resizable(width=False, height=False)
+
+        label_requests = Label(limits_window, text='Запросов в секунду (0 - без ограничения):')
+        label_requests.grid(column=0, row=0, sticky=tkinter.W, padx=10, pady=5)
+
+        entry_requests = Entry(limits_window, width=12)
+        entry_requests.insert(0, f'{self.limiter.requests.rate:g}')
+        entry_requests.grid(column=1, row=0, padx=10, pady=5)
+
+        label_bytes = Label(limits_window, text='Скорость загрузки, КБ/с (0 - без ограничения):')
+        label_bytes.grid(column=0, row=1, sticky=tkinter.W, padx=10, pady=5)
+
+        entry_bytes = Entry(limits_window, width=12)
+        entry_bytes.insert(0, f'{self.limiter.bytes.rate / 1024:g}')
+        entry_bytes.grid(column=1, row=1, padx=10, pady=5)
+
+        def _apply():
+            try:
+                requests_per_second = float(entry_requests.get())
+                kilobytes_per_second = float(entry_bytes.get())
+                if requests_per_second < 0 or kilobytes_per_second < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror('Ошибка', 'Введите неотрицательные числа!', parent=limits_window)
+                return
+
+            self.limiter.set_limits(requests_per_second=requests_per_second,
+                                    bytes_per_second=kilobytes_per_second * 1024)
+            logger.debug('Ограничения изменены: [%s] запросов в секунду, '
+                         '[%s] КБ/с.', requests_per_second, kilobytes_per_second)
+            limits_window.destroy()
+
+        button_apply = Button(limits_window, text='Применить', width=15, command=_apply)
+        button_apply.grid(column=1, row=2, padx=10, pady=10)
 
     def _partial_download_or_update_playlist(self, update_mode: bool = False):
         current_playlist_index = self.combo_playlists.current()
@@ -519,7 +630,7 @@ class YandexMusicDownloader:
                 self.partial_downloading_or_updating_tracks.update({
                     playlist.kind: []
                 })
-                logger.debug(f'Создан список частичного скачивания/обновления для плейлиста [{playlist.title}].')
+                logger.debug('Создан список частичного скачивания/обновления для плейлиста [%s].', playlist.title)
             else:
                 messagebox.showwarning('Предупреждение', f'Данное окно для частичной загрузки/обновления треков '
                                                          f'для плейтиста:\n[{playlist.title}]\nуже открыто!\n\n'
@@ -545,11 +656,11 @@ class YandexMusicDownloader:
         def _close_window():
             try:
                 del self.partial_downloading_or_updating_tracks[playlist.kind]
-                logger.debug(f'Список частичного скачивания/обновления для плейлиста [{playlist.title}] был удалён.')
+                logger.debug('Список частичного скачивания/обновления для плейлиста [%s] был удалён.', playlist.title)
             except KeyError:
                 logger.error(
-                    f'Не удалось удалить список частичной загрузки/обновления для плейлиста [{playlist.title}]!')
-            logger.debug(f'Ожидаю завершения потока [{thread.ident}]')
+                    'Не удалось удалить список частичной загрузки/обновления для плейлиста [%s]!', playlist.title)
+            logger.debug('Ожидаю завершения потока [%s]', thread.ident)
             thread.join()
             logger.debug('Закрываю окно.')
             partial_window.destroy()
@@ -599,7 +710,7 @@ class YandexMusicDownloader:
             :param pattern: введенная пользователем строка
             :return:
             """
-            logger.debug(f'Начинаю поиск сходства по шаблону [{pattern}].')
+            logger.debug('Начинаю поиск сходства по шаблону [%s].', pattern)
             track_list = []
 
             tracks_info = _get_tracks_info(current_playlist.tracks)
@@ -661,7 +772,7 @@ class YandexMusicDownloader:
                 for selected_track in all_selected_tracks:
                     selected_item = listbox_same_tracks.get(selected_track)
 
-                    logger.debug(f'Начинаю добавление трека [{selected_item}] в список.')
+                    logger.debug('Начинаю добавление трека [%s] в список.', selected_item)
                     tracks_info = _get_tracks_info(current_playlist.tracks)
                     for track_name, _, _, _, track in tracks_info:
                         if selected_item == track_name:
@@ -671,10 +782,12 @@ class YandexMusicDownloader:
 
                                 self.partial_downloading_or_updating_tracks[current_playlist.kind].append(track)
                                 logger.debug(
-                                    f'Трек [{track_name}] добавлен в список для плейлиста [{current_playlist.title}].')
+                                    'Трек [%s] добавлен в список для плейлиста [%s].',
+                                    track_name, current_playlist.title)
                             else:
                                 logger.debug(
-                                    f'Трек [{track_name}] уже добавлен в список для плейлиста [{current_playlist.title}].')
+                                    'Трек [%s] уже добавлен в список для плейлиста [%s].',
+                                    track_name, current_playlist.title)
                             was_added = True
                             break
                 if was_added:
@@ -691,13 +804,14 @@ class YandexMusicDownloader:
                 for selected_track in all_selected_tracks:
                     selected_item = listbox_same_tracks.get(selected_track)
 
-                    logger.debug(f'Начинаю удаление трека [{selected_item}] из списока.')
+                    logger.debug('Начинаю удаление трека [%s] из списока.', selected_item)
                     tracks_info = _get_tracks_info(self.partial_downloading_or_updating_tracks[current_playlist.kind],
                                                    False)
                     for track_name, _, _, _, track in tracks_info:
                         if selected_item == track_name:
                             self.partial_downloading_or_updating_tracks[current_playlist.kind].remove(track)
-                            logger.debug(f'Трек [{track_name}] удалён из списка плейлиста [{current_playlist.title}].')
+                            logger.debug('Трек [%s] удалён из списка плейлиста [%s].',
+                                         track_name, current_playlist.title)
 
                             if len(self.partial_downloading_or_updating_tracks[current_playlist.kind]) == 0:
                                 button_download_or_update_tracks['state'] = 'disable'
@@ -801,15 +915,15 @@ class YandexMusicDownloader:
             stuff_directory = config.paths['dirs']['stuff']
             if not os.path.exists(stuff_directory) or os.path.isfile(stuff_directory):
                 os.makedirs(stuff_directory, exist_ok=True)
-                logger.debug(f'Служебная директория была содана по пути [{stuff_directory}].')
+                logger.debug('Служебная директория была содана по пути [%s].', stuff_directory)
             img.save(default_playlist_cover)
-            logger.debug(f'Дефолтная обложка не была найдена, поэтому была создана занова и сохранена по пути '
-                         f'[{default_playlist_cover}]!')
+            logger.debug('Дефолтная обложка не была найдена, поэтому была создана занова и сохранена по пути '
+                         '[%s]!', default_playlist_cover)
 
         # Если папки с обложками не существует, то создаем
         if not os.path.exists(self.playlists_covers_folder_name) or os.path.isfile(self.playlists_covers_folder_name):
             os.makedirs(self.playlists_covers_folder_name, exist_ok=True)
-            logger.debug(f'Была создана папка [{self.playlists_covers_folder_name}] для хранения обложек плейлистов.')
+            logger.debug('Была создана папка [%s] для хранения обложек плейлистов.', self.playlists_covers_folder_name)
         else:
             logger.debug('Папка для обложек уже сущестует.')
 
@@ -821,8 +935,10 @@ class YandexMusicDownloader:
         try:
             # Проверяем введённый токен на валидность
             try:
-                self.client = Client(token=self.token)
+                self.client = Client(token=self.token, request=PooledSyncRequest(pool_size=config.HTTP_POOL_SIZE,
+                                                                                 limiter=self.limiter))
                 self.client.init()
+                self.async_client = ClientAsync(token=self.token, request=PooledRequest(self.transport))
                 logger.debug('Введённый токен валиден, авторизация прошла успешно!')
             except UnauthorizedError:
                 logger.error('Введен невалидный токен!')
@@ -831,7 +947,8 @@ class YandexMusicDownloader:
                 return
 
             self.playlists = self.client.users_playlists_list()
-            self.liked_tracks = self.client.users_likes_tracks()
+            # Множество идентификаторов любимых треков общее для всех обработчиков плейлистов
+            self.liked_track_ids = frozenset(get_track_key(track) for track in self.client.users_likes_tracks())
 
             # Создаем рабочие директории
             self._create_stuff_directories()
@@ -859,23 +976,32 @@ class YandexMusicDownloader:
         Скачиваем все обложки всех плейлистов
         :return:
         """
+        try:
+            self.transport.run(self._download_all_playlists_covers_async())
+        except NetworkError:
+            messagebox.showerror('Ошибка', 'Не удалось подключиться к Yandex!\nПопробуйте позже.')
+
+    async def _download_all_playlists_covers_async(self):
+        """
+        Параллельно скачиваем недостающие обложки плейлистов через общий пул соединений
+        :return:
+        """
+        async def _download_cover(playlist, filename: str):
+            playlist.cover.client = self.async_client
+            await playlist.cover.download_async(filename=filename, size='100x100')
+            logger.debug('Обложка для плейлиста [%s] была загружена в [%s].', playlist.title, filename)
+
+        downloads = []
         for playlist in self.playlists:
             if playlist.cover:
                 if playlist.cover.items_uri is not None:
                     playlist_title = strip_bad_symbols(playlist.title)
-                    if not os.path.exists(f'{self.playlists_covers_folder_name}/{playlist_title}.jpg'):
-                        try:
-                            playlist.cover.download(
-                                filename=f'{self.playlists_covers_folder_name}/{playlist_title}.jpg',
-                                size='100x100')
-                            logger.debug(f'Обложка для плейлиста [{playlist_title}] была загружена в '
-                                         f'[{self.playlists_covers_folder_name}/{playlist_title}.jpg].')
-                        except NetworkError:
-                            messagebox.showerror('Ошибка', 'Не удалось подключиться к Yandex!\nПопробуйте позже.')
-                            return
+                    filename = f'{self.playlists_covers_folder_name}/{playlist_title}.jpg'
+                    if not os.path.exists(filename):
+                        downloads.append(_download_cover(playlist, filename))
                     else:
-                        logger.debug(f'Обложка для плейлиста [{playlist_title}] уже существует в '
-                                     f'[{self.playlists_covers_folder_name}/{playlist_title}.jpg].')
+                        logger.debug('Обложка для плейлиста [%s] уже существует в [%s].', playlist_title, filename)
+        await asyncio.gather(*downloads)
 
     def _change_current_playlist_cover(self):
         """
@@ -895,12 +1021,12 @@ class YandexMusicDownloader:
             if current_playlist.cover:
                 if current_playlist.cover.items_uri is not None:
                     if not os.path.exists(f'{self.playlists_covers_folder_name}/{playlist_title}.jpg'):
-                        logger.debug(f'Обложка для плейлиста [{playlist_title}] не была найдена, начинаю загрузку.')
+                        logger.debug('Обложка для плейлиста [%s] не была найдена, начинаю загрузку.', playlist_title)
                         current_playlist.cover.download(
                             filename=f'{self.playlists_covers_folder_name}/{playlist_title}.jpg',
                             size='100x100')
-                        logger.debug(f'Обложка для плейлиста [{playlist_title}] была загружена в '
-                                     f'[{self.playlists_covers_folder_name}/{playlist_title}.jpg].')
+                        logger.debug('Обложка для плейлиста [%s] была загружена в '
+                                     '[%s/%s.jpg].', playlist_title, self.playlists_covers_folder_name, playlist_title)
                     filename = f'{self.playlists_covers_folder_name}/{playlist_title}.jpg'
         except NetworkError:
             logger.error('Не удалось подключиться к Yandex!')
@@ -911,7 +1037,7 @@ class YandexMusicDownloader:
 
         text = self.label_track_number_text['text'].split(':')[0]
         self.label_track_number_text.config(text=f'{text}: {current_playlist.track_count}')
-        logger.debug(f'Текущая обложка изменена на [{playlist_title}].')
+        logger.debug('Текущая обложка изменена на [%s].', playlist_title)
 
     def _wrapper_download_or_update_tracks(self, update_mode: bool = False, update_liked: bool = False,
                                            partial_mode: bool = False, partial_playlist_index: int = 0,
@@ -952,10 +1078,10 @@ class YandexMusicDownloader:
                 info = 'добавления треков в базу данных для'
             elif partial_mode:
                 info = 'частичного скачивания'
-            logger.debug(f'Создаю новый поток для {info} плейлиста [{playlist.title}]')
+            logger.debug('Создаю новый поток для %s плейлиста [%s]', info, playlist.title)
             thread.start()
         else:
-            logger.debug(f'Загрузка или обновление плейлиста {playlist.title} уже производится на данный момент!')
+            logger.debug('Загрузка или обновление плейлиста %s уже производится на данный момент!', playlist.title)
             messagebox.showinfo('Инфо', f'Подождите, загрузка или обновление плейлиста {playlist.title}'
                                         f' уже производится на данный момент!')
 
@@ -985,7 +1111,7 @@ class YandexMusicDownloader:
             info = 'добавления треков в базу данных'
         elif partial_mode:
             info = 'частичного скачивания'
-        logger.debug(f'Поток [{threading.get_ident()}] для {info} плейлиста [{playlist.title}] был создан!')
+        logger.debug('Поток [%s] для %s плейлиста [%s] был создан!', threading.get_ident(), info, playlist.title)
 
         try:
             child_window = tkinter.Toplevel(self.main_window)
@@ -1009,35 +1135,42 @@ class YandexMusicDownloader:
             playlist_title = strip_bad_symbols(current_playlist.title)
 
             filename = ''
+            run_log = None
             try:
                 download_folder_path = f'{self.download_folder_path}/{playlist_title}'
                 if os.path.exists(download_folder_path):
-                    logger.debug(f'Директория [{download_folder_path}] уже существует.')
+                    logger.debug('Директория [%s] уже существует.', download_folder_path)
                 else:
-                    logger.debug(f'Директория [{download_folder_path}] была создана.')
+                    logger.debug('Директория [%s] была создана.', download_folder_path)
                 os.makedirs(f'{download_folder_path}', exist_ok=True)
 
                 if os.path.exists(f'{download_folder_path}/covers'):
-                    logger.debug(f'Директория [{download_folder_path}/covers] уже существует.')
+                    logger.debug('Директория [%s/covers] уже существует.', download_folder_path)
                 else:
-                    logger.debug(f'Директория [{download_folder_path}/covers] была создана.')
+                    logger.debug('Директория [%s/covers] была создана.', download_folder_path)
                 os.makedirs(f'{download_folder_path}/covers', exist_ok=True)
 
                 if os.path.exists(f'{download_folder_path}/info'):
-                    logger.debug(f'Директория [{download_folder_path}/info] уже существует.')
+                    logger.debug('Директория [%s/info] уже существует.', download_folder_path)
                 else:
-                    logger.debug(f'Директория [{download_folder_path}/info] была создана.')
+                    logger.debug('Директория [%s/info] была создана.', download_folder_path)
                 os.makedirs(f'{download_folder_path}/info', exist_ok=True)
 
                 if not update_mode and not update_liked:
                     filename = {
                         'e': f'{download_folder_path}/info/download_errors-{playlist_title}.txt',
-                        'd': f'{download_folder_path}/info/downloaded_tracks-{playlist_title}.txt'
+                        'd': f'{download_folder_path}/info/downloaded_tracks-{playlist_title}.txt',
+                        's': f'{download_folder_path}/info/skipped_tracks-{playlist_title}.txt',
+                        'jsonl': f'{download_folder_path}/info/tracks-{playlist_title}.jsonl'
                     }
-                    with open(filename['e'], 'w', encoding='utf-8') as file:
-                        pass
-                    with open(filename['d'], 'w', encoding='utf-8') as file:
-                        pass
+
+                    def _on_run_log_error(error: IOError):
+                        logger.error('Ошибка при записи отчёта загрузки в файлы [%s]: [%s].', filename, error)
+
+                    # Файлы отчёта открываются один раз на запуск в движке, когда известно, продолжается ли
+                    # прерванный запуск, а запись идёт в отдельном потоке
+                    run_log = RunLog(filename, flush_interval=config.RUN_LOG_FLUSH_INTERVAL,
+                                     on_error=_on_run_log_error)
 
                 track_count = current_playlist.track_count if not partial_mode else \
                     len(self.partial_downloading_or_updating_tracks[playlist.kind])
@@ -1051,9 +1184,11 @@ class YandexMusicDownloader:
                     is_rewritable=self.is_rewritable.get(),
                     download_only_new=download_only_new,
                     filenames=filename,
+                    run_log=run_log,
                     playlist_title=playlist_title,
+                    playlist_kind=playlist.kind,
                     number_tracks_in_playlist=track_count,
-                    liked_tracks=self.liked_tracks,
+                    liked_track_ids=self.liked_track_ids,
                     add_track_id_to_name=self.check_id_in_name.get(),
                     main_thread_state=lambda: self.main_thread_state,
                     child_thread_state=lambda: child_thread_state,
@@ -1073,13 +1208,8 @@ class YandexMusicDownloader:
                     info = f'Частичная загрузка треков плейлиста\n[{current_playlist.title}]\nначата!'
                 messagebox.showinfo('Инфо', f'{info}')
 
-                queue = Queue()
-                workers = []
-
-                for x in range(self.number_of_workers):
-                    workers.append(self.DownloaderWorker(queue, self.downloading_or_updating_playlists[playlist.kind]))
-                    workers[x].daemon = True
-                    workers[x].start()
+                # Событие, по которому окно загрузки узнаёт о завершении асинхронного движка
+                engine_finished = threading.Event()
 
                 def _close_program():
                     nonlocal child_thread_state
@@ -1094,83 +1224,82 @@ class YandexMusicDownloader:
                             info1 = 'добавления текущих треков в базу данных'
                     messagebox.showinfo('Инфо', f'Подождите, окно закроется по завершению {info1}')
 
-                    for _worker in workers:
-                        logger.debug(f'Поток [{_worker.ident}] был поставлен на завершение.')
-                        _worker.is_finished = True
-                    for _worker in workers:
-                        _worker_id = _worker.ident
-                        logger.debug(f'Ожидание завершения потока [{_worker_id}].')
-                        _worker.join()
-                        logger.debug(f'Поток [{_worker_id}] был завершён.')
+                    logger.debug('Ожидание завершения движка загрузки для плейлиста [%s].', playlist_title)
+                    engine_finished.wait()
+                    logger.debug('Движок загрузки для плейлиста [%s] был завершён.', playlist_title)
                     child_window.destroy()
 
                 child_window.protocol("WM_DELETE_WINDOW", _close_program)
 
-                logger.debug(f'Начало добавления треков в очередь на выполнения для плейлиста [{playlist_title}].')
-                for i in range(math.ceil(track_count / self.chunk_of_tracks)):
-                    number_of_tracks_was_added = 0
-                    for j in range(i * self.chunk_of_tracks, (1 + i) * self.chunk_of_tracks):
-                        number_of_tracks_was_added = j
-                        if j == track_count:
-                            break
-                        if not partial_mode:
-                            queue.put(current_playlist.tracks[j].track)
-                        else:
-                            queue.put(self.partial_downloading_or_updating_tracks[playlist.kind][j])
-                    logger.debug(f'В очередь для плейлиста [{playlist_title}] было добавлено '
-                                 f'{number_of_tracks_was_added} треков.')
-                    queue.join()
-                    logger.debug(f'Итерация №{i} для плейлиста [{playlist_title}] была выполена '
-                                 f'с {number_of_tracks_was_added} треками.')
-
-                    if not self.main_thread_state:
-                        logger.debug('Основное окно получило сигнал на завершение, начинаю подготовку '
-                                     'к прекращению работы.')
-                        break
+                if not partial_mode:
+                    tracks = current_playlist.tracks[:track_count]
+                else:
+                    tracks = list(self.partial_downloading_or_updating_tracks[playlist.kind])
 
-                    if not child_thread_state:
-                        logger.debug('Окно загрузки получило сигнал на завершение, начинаю подготовку '
-                                     'к прекращению работы.')
-                        break
+                def _on_metrics_error(error: IOError):
+                    logger.error('Не удалось выгрузить метрики плейлиста [%s]: [%s].', playlist_title, error)
 
-                    if YandexMusicDownloader.DownloaderWorker.is_network_error:
-                        logger.error('Возникла ошибка с подключением к Яндекс Музыке, начинаю подготовку '
-                                     'к прекращению работы.')
-                        break
-                else:
+                # Метрики запуска периодически выгружаются в папку info в форматах JSON и Prometheus
+                metrics_exporter = MetricsExporter(
+                    self.downloading_or_updating_playlists[playlist.kind].metrics,
+                    json_path=f'{download_folder_path}/info/metrics-{playlist_title}.json',
+                    prometheus_path=f'{download_folder_path}/info/metrics-{playlist_title}.prom',
+                    interval=config.METRICS_EXPORT_INTERVAL,
+                    on_error=_on_metrics_error)
+                metrics_exporter.start()
 
+                try:
+                    engine = self._process_tracks_async(
+                        tracks=tracks,
+                        helper=self.downloading_or_updating_playlists[playlist.kind],
+                        playlist_title=playlist_title,
+                        playlist_kind=playlist.kind,
+                        child_thread_state=lambda: child_thread_state,
+                        revision=current_playlist.revision if not partial_mode else None
+                    )
+                    # Обработчики - задачи одного цикла событий, поэтому профилируется весь движок в потоке цикла
+                    is_completed = self.transport.run(self.profiler.run(f'engine-{playlist_title}', engine))
+                finally:
+                    metrics_exporter.close()
+                    tracer = self.downloading_or_updating_playlists[playlist.kind].tracer
+                    if tracer.enabled:
+                        trace_filename = f'{download_folder_path}/info/trace-{playlist_title}.json'
+                        try:
+                            tracer.write(trace_filename)
+                            logger.debug('Трассировка запуска записана в [%s].', trace_filename)
+                        except IOError:
+                            logger.error('Не удалось записать трассировку запуска в [%s].', trace_filename)
+                    if run_log is not None:
+                        run_log.close()
+                    engine_finished.set()
+
+                if is_completed:
                     if update_mode:
-                        logger.debug(f'Обновление метаданных для треков для плейлиста '
-                                     f'[{playlist_title}] завершено. Обновлено '
-                                     f'[{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"]}]'
-                                     f' трека(ов).')
+                        logger.debug('Обновление метаданных для треков для плейлиста '
+                                     '[%s] завершено. Обновлено [%s] трека(ов).',
+                                     playlist_title,
+                                     self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"])
                     elif update_liked:
-                        logger.debug(f'Обновление любимых треков в базе данных для плейлиста '
-                                     f'[{playlist_title}] завершено. Обновлено '
-                                     f'[{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"]}]'
-                                     f' трека(ов).')
+                        logger.debug('Обновление любимых треков в базе данных для плейлиста '
+                                     '[%s] завершено. Обновлено [%s] трека(ов).',
+                                     playlist_title,
+                                     self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"])
                     elif only_add_to_database:
-                        logger.debug(f'Добавление в базу данных треков для плейлиста '
-                                     f'[{playlist_title}] завершено. Добавлено '
-                                     f'[{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"]}]'
-                                     f' трека(ов).')
+                        logger.debug('Добавление в базу данных треков для плейлиста '
+                                     '[%s] завершено. Добавлено [%s] трека(ов).',
+                                     playlist_title,
+                                     self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"])
                     else:
-                        logger.debug(f'Загрузка треков для плейлиста '
-                                     f'[{playlist_title}] завершена. Загружено '
-                                     f'[{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["d"]}]'
-                                     f' трека(ов).')
-
-                for worker in workers:
-                    logger.debug(f'Поток [{worker.ident}] был поставлен на завершение.')
-                    worker.is_finished = True
-                for worker in workers:
-                    worker_id = worker.ident
-                    logger.debug(f'Ожидание завершения потока [{worker_id}].')
-                    worker.join()
-                    logger.debug(f'Поток [{worker_id}] был завершён.')
-
-                if not self.main_thread_state or not child_thread_state or \
-                        YandexMusicDownloader.DownloaderWorker.is_network_error:
+                        logger.debug('Загрузка треков для плейлиста '
+                                     '[%s] завершена. Загружено [%s] трека(ов).',
+                                     playlist_title,
+                                     self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["d"])
+
+                if self.downloading_or_updating_playlists[playlist.kind].circuit_breaker.is_broken:
+                    logger.debug('Завершаю работу.')
+                    messagebox.showerror('Ошибка', 'Не удалось связаться с сервисом Яндекс Музыка!'
+                                                   '\nПопробуйте позже.')
+                elif not self.main_thread_state or not child_thread_state:
                     logger.debug('Завершаю работу.')
                 else:
                     if update_mode:
@@ -1193,6 +1322,11 @@ class YandexMusicDownloader:
                                                 f'[{current_playlist.title}]\nзакончено!\n\n'
                                                 f'Обновлено [{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["u"]}] трека(ов).\n'
                                                 f'Не удалось обновить [{self.downloading_or_updating_playlists[playlist.kind].analyzed_and_downloaded_tracks["e"]}] трека(ов).')
+                        elif self.downloading_or_updating_playlists[playlist.kind].liked_tracks_in_database > 0:
+                            messagebox.showinfo('Инфо',
+                                                f'Любимые треки плейлиста\n[{current_playlist.title}]\nв базе данных '
+                                                f'уже актуальны!\n\n'
+                                                f'Любимых треков в базе [{self.downloading_or_updating_playlists[playlist.kind].liked_tracks_in_database}].')
                         else:
                             messagebox.showinfo('Инфо',
                                                 f'Для плейлиста\n[{current_playlist.title}]\nне удалось найти ни одного'
@@ -1228,15 +1362,15 @@ class YandexMusicDownloader:
                 messagebox.showwarning('Предупреждение',
                                        f'Не удалось создать файл\n[{filename}]\nдля записи ошибок при '
                                        f'скачивании!')
-                logger.error(f'Ошибка при попытке создания файла [{filename}] для записи ошибок при скачивании!')
+                logger.error('Ошибка при попытке создания файла [%s] для записи ошибок при скачивании!', filename)
 
             info = "скачиваемых" if (
                     not update_mode and not only_add_to_database and not update_liked) else "обновляемых"
             try:
                 del self.downloading_or_updating_playlists[playlist.kind]
-                logger.debug(f'Плейлист [{playlist_title}] был удалён из списка {info} плейлистов.')
+                logger.debug('Плейлист [%s] был удалён из списка %s плейлистов.', playlist_title, info)
             except ValueError:
-                logger.error(f'Не удалось удалить плейлист [{playlist_title}] из списка {info} плейлистов.')
+                logger.error('Не удалось удалить плейлист [%s] из списка %s плейлистов.', playlist_title, info)
 
         except NetworkError:
             logger.error('Возникла ошибка с подключением к Яндекс Музыке, завершаю работу...')
@@ -1247,40 +1381,412 @@ class YandexMusicDownloader:
             logger.exception('')
             pass
 
+    async def _process_tracks_async(self, tracks: list, helper, playlist_title: str, playlist_kind: int,
+                                    child_thread_state, revision: int = None) -> bool:
+        """
+        Асинхронный движок: обрабатывает все треки плейлиста в одном цикле событий
+        :param tracks: список треков (Track или TrackShort) для обработки
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :param playlist_title: название плейлиста
+        :param playlist_kind: идентификатор плейлиста
+        :param child_thread_state: функция, возвращающая состояние окна загрузки
+        :param revision: ревизия плейлиста (None - если обрабатывается только часть треков)
+        :return: True - если все треки были обработаны, False - если работа была прервана
+        """
+        # Обработчиков запускается по максимуму, а сколько из них работает одновременно, решает регулятор
+        def _on_concurrency_change(old_limit: int, new_limit: int, reason: str):
+            logger.debug('Параллельность для плейлиста [%s] изменена с [%s] '
+                         'на [%s] (%s).', playlist_title, old_limit, new_limit, reason)
+
+        helper.concurrency_controller = ConcurrencyController(initial=config.CONCURRENCY_INITIAL,
+                                                              minimum=config.CONCURRENCY_MIN,
+                                                              maximum=self.number_of_workers,
+                                                              on_change=_on_concurrency_change)
+
+        # Предохранитель общий для всех запросов плейлиста: при пропаже сети запросы ждут её восстановления
+        def _on_breaker_state_change(state: str, cooldown: float):
+            if state == CircuitBreaker.OPEN:
+                logger.error('Слишком много сетевых ошибок при обработке плейлиста [%s], '
+                             'приостанавливаю запросы на [%.1f] с.', playlist_title, cooldown)
+            elif state == CircuitBreaker.HALF_OPEN:
+                logger.debug('Проверяю подключение к Яндекс Музыке для плейлиста [%s].', playlist_title)
+            else:
+                logger.debug('Подключение к Яндекс Музыке для плейлиста [%s] восстановлено.', playlist_title)
+
+        helper.circuit_breaker = CircuitBreaker(failure_threshold=config.BREAKER_FAILURE_THRESHOLD,
+                                                cooldown=config.BREAKER_COOLDOWN,
+                                                max_cooldown=config.BREAKER_MAX_COOLDOWN,
+                                                max_failed_probes=config.BREAKER_MAX_FAILED_PROBES,
+                                                on_state_change=_on_breaker_state_change)
+
+        # Одно постоянное подключение к базе на запуск: запись идёт пачками через отдельный поток
+        def _on_database_error(request: str, parameters: list, error: sqlite3.Error):
+            logger.error('Не удалось выполнить SQL запрос [%s]. Данные: [%s]. Ошибка: [%s].',
+                         request, parameters, error)
+            helper.metrics.record_error(RunMetrics.DATABASE)
+
+        def _on_database_write(duration: float):
+            helper.metrics.observe(RunMetrics.DATABASE, duration)
+
+        helper.database = HistoryDatabase(helper.history_database_path,
+                                          read_pool_size=config.DATABASE_READ_POOL_SIZE,
+                                          batch_size=config.DATABASE_BATCH_SIZE,
+                                          batch_interval=config.DATABASE_BATCH_INTERVAL,
+                                          on_error=_on_database_error,
+                                          on_write=_on_database_write)
+        try:
+            await asyncio.to_thread(helper.database.start)
+            # Все известные треки плейлиста загружаются одним запросом, дальше проверки идут только в памяти
+            rows = await asyncio.to_thread(helper.database.fetchall, library.SELECT_PLAYLIST_TRACKS, [playlist_kind])
+        except sqlite3.Error:
+            logger.error('Не удалось открыть базу данных [%s]!', helper.history_database_path)
+            await asyncio.to_thread(helper.database.close)
+            return False
+        helper.known_tracks = library.KnownTracks(rows)
+        logger.debug('Для плейлиста [%s] в базе данных известно [%s] '
+                     'трека(ов).', playlist_title, len(helper.known_tracks))
+
+        # Любимые треки обновляются одним запросом над множествами, без обработчиков
+        if helper.update_liked:
+            return await self._update_liked_in_bulk(tracks, helper, playlist_title, playlist_kind)
+
+        # Охват запуска считается по выбранным трекам до отбора изменений, который зависит от уже обработанных треков
+        job_scope = JobJournal.get_scope([get_track_key(track) for track in tracks], is_partial=revision is None)
+        tracks = await self._plan_tracks(tracks, helper, playlist_title, playlist_kind, revision)
+        tracks = await self._open_job(tracks, helper, playlist_title, playlist_kind, job_scope)
+
+        # Отчёт прерванного запуска дописывается, чтобы не потерять уже обработанные в нём треки
+        if helper.run_log is not None:
+            try:
+                helper.run_log.start(append=helper.job is not None and helper.job.is_resumed)
+            except IOError as e:
+                logger.error('Не удалось открыть файлы отчёта загрузки [%s]: [%s].', helper.filenames, e)
+
+        # Файлы плейлиста читаются одним проходом по папке вместо проверки каждого кодека и обложки на диске
+        helper.folder_index = FolderIndex(helper.download_folder_path)
+        await asyncio.to_thread(helper.folder_index.build)
+        logger.debug('В папке [%s] найдено [%s] файла(ов).', helper.download_folder_path, len(helper.folder_index))
+
+        try:
+            tracks = await self._hydrate_tracks(tracks, helper, playlist_title)
+        except NetworkError:
+            logger.error('Не удалось получить треки плейлиста [%s]!', playlist_title)
+            await asyncio.to_thread(helper.database.close)
+            return False
+
+        # Упреждающие запросы выполняются параллельно, поэтому каждый пишет интервалы на свою дорожку после дорожек
+        # обработчиков, иначе они накладываются друг на друга на дорожке движка
+        def _on_prefetch(slot: int):
+            helper.tracer.set_lane(self.number_of_workers + slot + 1, f'Упреждение {slot}')
+
+        # Информация о загрузке подгружается заранее для треков в окне очереди, которым она понадобится
+        helper.download_info_cache = DownloadInfoCache(ttl=config.DOWNLOAD_INFO_TTL,
+                                                       max_concurrent_requests=config.DOWNLOAD_INFO_PREFETCH_LIMIT,
+                                                       fetch=helper.fetch_download_info,
+                                                       on_prefetch=_on_prefetch)
+
+        # Ограниченная очередь задаёт окно треков в работе: производитель ждёт, пока обработчики освободят место
+        queue = asyncio.Queue(maxsize=self.tracks_window_size)
+        workers = [self.DownloaderWorker(queue, helper, x) for x in range(self.number_of_workers)]
+        tasks = [asyncio.create_task(worker.run()) for worker in workers]
+        logger.debug('Для плейлиста [%s] запущено [%s] асинхронных обработчиков.', playlist_title, len(tasks))
+
+        is_completed = False
+        try:
+            logger.debug('Начало добавления треков в очередь на выполнения для плейлиста [%s].', playlist_title)
+            for track in tracks:
+                if self._is_processing_interrupted(child_thread_state, helper):
+                    break
+                if helper.download_info_cache is not None and helper.needs_download_info(track):
+                    helper.download_info_cache.prefetch(track)
+                await queue.put(track)
+            else:
+                logger.debug('Все [%s] треков плейлиста [%s] были добавлены в очередь.', len(tracks), playlist_title)
+                await queue.join()
+                is_completed = not self._is_processing_interrupted(child_thread_state, helper)
+
+            # Необработанные треки отбрасываются, а каждый обработчик получает свой стоп-сигнал
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+            for _ in tasks:
+                await queue.put(self.DownloaderWorker.STOP)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Ревизия запоминается, только если все треки плейлиста дошли до базы
+            if is_completed and revision is not None and self._is_delta_mode(helper) and \
+                    helper.analyzed_and_downloaded_tracks['e'] == 0:
+                helper.database.execute(library.UPSERT_SYNCED_REVISION,
+                                        [playlist_kind, self._get_job_mode(helper), helper.download_folder_path,
+                                         revision, time.time()])
+                logger.debug('Ревизия [%s] плейлиста [%s] отмечена как синхронизированная.', revision, playlist_title)
+
+            # Журнал пишется через писателя базы данных, поэтому сохраняется до её закрытия
+            if helper.job is not None:
+                try:
+                    if is_completed:
+                        await helper.job.finish()
+                    else:
+                        await helper.job.flush()
+                        logger.debug('Состояние прерванного запуска для плейлиста [%s] сохранено.', playlist_title)
+                except sqlite3.Error:
+                    logger.error('Не удалось сохранить состояние запуска для плейлиста [%s]!', playlist_title)
+
+            await asyncio.to_thread(helper.database.close)
+            logger.debug('Все изменения базы данных для плейлиста [%s] записаны.', playlist_title)
+
+            for worker in workers:
+                statistics = worker.get_statistics()
+                logger.debug('Обработчик [%s] плейлиста [%s]: обработано [%s] трека(ов), в работе [%.2f] с, '
+                             'в ожидании [%.2f] с.', worker.worker_id, playlist_title,
+                             statistics['processed'], statistics['busy'], statistics['idle'])
+            report = helper.concurrency_controller.get_report()
+            logger.debug('Выбранная параллельность для плейлиста [%s]: итоговая [%s], '
+                         'максимальная [%s], средняя [%.1f].',
+                         playlist_title, report["limit"], report["peak"], report["average"])
+            logger.debug('Все асинхронные обработчики для плейлиста [%s] были завершены.', playlist_title)
+        return is_completed
+
+    @staticmethod
+    def _get_job_mode(helper) -> str:
+        """
+        Возвращает режим работы обработчика для журнала запусков
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :return: режим работы
+        """
+        if helper.update_mode:
+            return 'update'
+        elif helper.update_liked:
+            return 'update_liked'
+        elif helper.only_add_to_database:
+            return 'add_to_database'
+        return 'download'
+
+    async def _update_liked_in_bulk(self, tracks: list, helper, playlist_title: str, playlist_kind: int) -> bool:
+        """
+        Обновляет отметки любимых треков плейлиста в базе данных одной транзакцией: новые любимые треки отмечаются,
+        а с разлюбленных отметка снимается
+        :param tracks: список треков плейлиста
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :param playlist_title: название плейлиста
+        :param playlist_kind: идентификатор плейлиста
+        :return: True - если обновление выполнено, False - если нет
+        """
+        try:
+            liked, marked, cleared = await asyncio.wrap_future(helper.database.call(
+                lambda db: library.update_favorites(db, playlist_kind, helper.liked_track_ids)))
+        except sqlite3.Error:
+            logger.error('Не удалось обновить любимые треки плейлиста [%s] в базе данных!', playlist_title)
+            return False
+        finally:
+            await asyncio.to_thread(helper.database.close)
+
+        helper.metrics.increment('a', len(tracks))
+        # Обновлёнными считаются только треки, у которых отметка действительно изменилась
+        helper.metrics.increment('u', marked + cleared)
+        helper.liked_tracks_in_database = liked
+        helper.change_progress_bar_state()
+        logger.debug('Любимые треки плейлиста [%s] обновлены: любимых в базе [%s], '
+                     'отмечено [%s], снято отметок [%s].', playlist_title, liked, marked, cleared)
+        return True
+
+    @staticmethod
+    def _is_delta_mode(helper) -> bool:
+        """
+        Проверяет, достаточно ли обработать только новые треки плейлиста: при загрузке только новых треков
+        и при добавлении в базу данных
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :return: True - если достаточно, False - если нужно обработать все треки.
+        """
+        if helper.update_mode or helper.update_liked:
+            return False
+        return helper.only_add_to_database or helper.download_only_new
+
+    async def _plan_tracks(self, tracks: list, helper, playlist_title: str, playlist_kind: int, revision) -> list:
+        """
+        Оставляет только изменения плейлиста с прошлой синхронизации. Если ревизия плейлиста не изменилась, то
+        обрабатывать нечего, иначе в очередь попадают только треки, которых ещё нет в базе.
+        :param tracks: список треков (Track или TrackShort)
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :param playlist_title: название плейлиста
+        :param playlist_kind: идентификатор плейлиста
+        :param revision: ревизия плейлиста (None - если обрабатывается только часть треков)
+        :return: список треков, которые нужно обработать
+        """
+        if not self._is_delta_mode(helper):
+            return tracks
+
+        if revision is not None:
+            try:
+                row = await asyncio.to_thread(helper.database.fetchone, library.SELECT_SYNCED_REVISION,
+                                              [playlist_kind, self._get_job_mode(helper), helper.download_folder_path])
+            except sqlite3.Error:
+                logger.error('Не удалось получить ревизию плейлиста [%s] из базы данных!', playlist_title)
+                row = None
+            if row is not None and row[0] == revision:
+                logger.debug('Плейлист [%s] не изменился с последней синхронизации '
+                             '(ревизия [%s]), пропускаю все [%s] трека(ов).', playlist_title, revision, len(tracks))
+                helper.metrics.increment('a', len(tracks))
+                helper.change_progress_bar_state()
+                return []
+
+        current_ids = {get_track_key(track) for track in tracks}
+        added_tracks = [track for track in tracks if not helper.known_tracks.has_id(get_track_key(track))]
+        removed = sum(1 for track_id in helper.known_tracks.track_ids if str(track_id) not in current_ids)
+        helper.metrics.increment('a', len(tracks) - len(added_tracks))
+        helper.change_progress_bar_state()
+        logger.debug('Изменения плейлиста [%s]: новых трека(ов) [%s], '
+                     'удалено из плейлиста [%s], без изменений [%s].',
+                     playlist_title, len(added_tracks), removed, len(tracks) - len(added_tracks))
+        return added_tracks
+
+    async def _open_job(self, tracks: list, helper, playlist_title: str, playlist_kind: int, scope: str) -> list:
+        """
+        Открывает запуск в журнале. Если прошлый запуск с теми же параметрами был прерван, то уже обработанные
+        в нём треки пропускаются. Выборочный запуск продолжает только прерванный запуск с тем же набором треков.
+        :param tracks: список треков (Track или TrackShort)
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :param playlist_title: название плейлиста
+        :param playlist_kind: идентификатор плейлиста
+        :param scope: охват запуска (JobJournal.get_scope)
+        :return: список треков, которые ещё нужно обработать
+        """
+        journal = JobJournal(helper.database)
+        try:
+            helper.job = await journal.open_job(playlist_kind=playlist_kind,
+                                                mode=self._get_job_mode(helper),
+                                                download_folder=helper.download_folder_path,
+                                                track_ids=[get_track_key(track) for track in tracks],
+                                                flush_size=config.JOURNAL_FLUSH_SIZE,
+                                                scope=scope)
+        except sqlite3.Error:
+            logger.error('Не удалось открыть журнал запусков для плейлиста [%s], '
+                         'продолжаю без него.', playlist_title)
+            return tracks
+
+        if not helper.job.is_resumed:
+            return tracks
+
+        remaining_tracks = [track for track in tracks if not helper.job.is_done(track)]
+        skipped = len(tracks) - len(remaining_tracks)
+        helper.metrics.increment('a', skipped)
+        helper.change_progress_bar_state()
+        logger.debug('Продолжаю прерванный запуск для плейлиста [%s]: пропущено [%s] '
+                     'уже обработанных трека(ов), осталось [%s].', playlist_title, skipped, len(remaining_tracks))
+        return remaining_tracks
+
+    async def _hydrate_tracks(self, tracks: list, helper, playlist_title: str) -> list:
+        """
+        Подготавливает полные объекты треков до старта обработчиков. Треки, для которых в плейлисте есть только
+        идентификатор, запрашиваются пачками через client.tracks(ids), все пачки - параллельно.
+        :param tracks: список треков (Track или TrackShort)
+        :param helper: обработчик плейлиста (DownloaderHelper), через который повторяются неудачные запросы
+        :param playlist_title: название плейлиста
+        :return: список полных треков, привязанных к асинхронному клиенту
+        """
+        hydrated_tracks = []
+        missing_tracks = {}
+        for index, track in enumerate(tracks):
+            if isinstance(track, TrackShort):
+                if track.track is None:
+                    missing_tracks[index] = track.track_id
+                    hydrated_tracks.append(None)
+                    continue
+                track = track.track
+
+            # Переносим трек на асинхронный клиент, чтобы все сетевые запросы шли через общий пул соединений
+            track.client = self.async_client
+            hydrated_tracks.append(track)
+
+        if len(missing_tracks):
+            track_ids = list(missing_tracks.values())
+            batches = [track_ids[i:i + self.hydration_batch_size]
+                       for i in range(0, len(track_ids), self.hydration_batch_size)]
+            logger.debug('Для плейлиста [%s] запрашиваю [%s] трека(ов) '
+                         'в [%s] пачках.', playlist_title, len(track_ids), len(batches))
+
+            async def _fetch_batch(batch: list) -> list:
+                with helper._stage(RunMetrics.METADATA):
+                    return await helper.call_with_retries(self.async_client.tracks, batch)
+
+            results = await asyncio.gather(*(_fetch_batch(batch) for batch in batches))
+            tracks_by_id = {str(track.id): track for result in results for track in result}
+            for index, track_id in missing_tracks.items():
+                hydrated_tracks[index] = tracks_by_id.get(str(track_id).split(':')[0])
+
+        found_tracks = [track for track in hydrated_tracks if track is not None]
+        if len(found_tracks) != len(tracks):
+            logger.error('Для плейлиста [%s] не удалось получить '
+                         '[%s] трека(ов).', playlist_title, len(tracks) - len(found_tracks))
+            # Неполученные треки считаются ошибками, поэтому ревизия плейлиста не запомнится и они попадут
+            # в следующий запуск
+            for index, track_id in missing_tracks.items():
+                if hydrated_tracks[index] is None and helper.run_log is not None:
+                    helper.run_log.error(str(track_id), str(track_id), 'Не удалось получить трек')
+            helper.metrics.increment('a', len(tracks) - len(found_tracks))
+            helper.metrics.increment('e', len(tracks) - len(found_tracks))
+            helper.change_progress_bar_state()
+        return found_tracks
+
+    def _is_processing_interrupted(self, child_thread_state, helper) -> bool:
+        """
+        Проверяет, нужно ли прекратить обработку треков плейлиста
+        :param child_thread_state: функция, возвращающая состояние окна загрузки
+        :param helper: обработчик плейлиста (DownloaderHelper)
+        :return: True - если работа должна быть прервана, False - если нет.
+        """
+        if not self.main_thread_state:
+            logger.debug('Основное окно получило сигнал на завершение, начинаю подготовку '
+                         'к прекращению работы.')
+            return True
+
+        if not child_thread_state():
+            logger.debug('Окно загрузки получило сигнал на завершение, начинаю подготовку '
+                         'к прекращению работы.')
+            return True
+
+        if helper.circuit_breaker.is_broken:
+            logger.error('Подключение к Яндекс Музыке так и не восстановилось, начинаю подготовку '
+                         'к прекращению работы.')
+            return True
+        return False
+
     def _database_create_tables(self):
         """
-        Создаем необходмые таблицы в базе данных, если их ещё нет
+        Создаем необходмые таблицы в базе данных, если их ещё нет, и переносим в них старые таблицы плейлистов
         :return:
         """
-        with sqlite3.connect(self.history_database_path) as db:
-            logger.debug(f'База данных по пути [{self.history_database_path}] была открыта.')
-            for playlist in self.playlists:
-                playlist_title = strip_bad_symbols(playlist.title).replace(' ', '_')
-                cur = db.cursor()
-                request = f"CREATE TABLE IF NOT EXISTS table_{playlist_title}(" \
-                          f"track_id INTEGER NOT NULL," \
-                          f"artist_id TEXT NOT NULL," \
-                          f"album_id TEXT," \
-                          f"track_name TEXT NOT NULL," \
-                          f"artist_name TEXT NOT NULL," \
-                          f"album_name TEXT," \
-                          f"genre TEXT," \
-                          f"track_number INTEGER NOT NULL," \
-                          f"disk_number INTEGER NOT NULL," \
-                          f"year INTEGER," \
-                          f"release_data TEXT," \
-                          f"bit_rate INTEGER NOT NULL," \
-                          f"codec TEXT NOT NULL," \
-                          f"is_favorite INTEGER NOT NULL," \
-                          f"is_explicit INTEGER NOT NULL DEFAULT 0," \
-                          f"is_popular INTEGER NOT NULL DEFAULT 0" \
-                          f")"
-                cur.execute(request)
+        try:
+            with contextlib.closing(sqlite3.connect(self.history_database_path)) as db:
+                logger.debug('База данных по пути [%s] была открыта.', self.history_database_path)
+                result = library.prepare_library(db, [(playlist.kind, strip_bad_symbols(playlist.title))
+                                                      for playlist in self.playlists])
+        except sqlite3.Error as e:
+            # Перенос идёт одной транзакцией, поэтому база остаётся в прежнем виде
+            logger.error('Не удалось подготовить базу данных [%s]: [%s].', self.history_database_path, e)
+            messagebox.showerror('Ошибка', f'Не удалось подготовить базу данных истории загрузок!\n\n{e}')
+            return
+
+        for table_name, (count, duplicates) in result['migrated'].items():
+            logger.debug('Таблица [%s] перенесена в общую библиотеку: [%s] трека(ов), '
+                         'отброшено дубликатов [%s].', table_name, count, duplicates)
+        for name, playlist_kinds in result['collisions'].items():
+            logger.error('Имя [%s] подходит сразу нескольким плейлистам [%s]: таблица не перенесена, '
+                         'представление не создано.', name, playlist_kinds)
+        for table_name in result['unmatched']:
+            logger.error('Старая таблица [%s] не сопоставлена ни с одним плейлистом и оставлена '
+                         'без изменений.', table_name)
 
     class DownloaderHelper:
         def __init__(self, progress_bar: Progressbar, label_value: Label, download_folder_path: str,
                      history_database_path: str, is_rewritable: bool, download_only_new: bool, filenames: dict,
-                     playlist_title: str, number_tracks_in_playlist: int, liked_tracks: TracksList,
+                     run_log: RunLog, playlist_title: str, playlist_kind: int, number_tracks_in_playlist: int,
+                     liked_track_ids: frozenset,
                      add_track_id_to_name: bool, main_thread_state, child_thread_state, update_mode, update_liked,
                      only_add_to_database):
             self.progress_bar = progress_bar
@@ -1290,9 +1796,11 @@ class YandexMusicDownloader:
             self.is_rewritable = is_rewritable
             self.download_only_new = download_only_new
             self.filenames = filenames
+            self.run_log = run_log
             self.playlist_title = playlist_title
+            self.playlist_kind = playlist_kind
             self.number_tracks_in_playlist = number_tracks_in_playlist
-            self.liked_tracks = liked_tracks
+            self.liked_track_ids = liked_track_ids
             self.add_track_id_to_name = add_track_id_to_name
             self.main_thread_state = main_thread_state
             self.child_thread_state = child_thread_state
@@ -1301,8 +1809,28 @@ class YandexMusicDownloader:
             self.only_add_to_database = only_add_to_database
 
             self.is_downloading_finished = False
+            self.download_info_cache = None
+            self.concurrency_controller = None
+            self.circuit_breaker = None
+            self.job = None
+            self.database = None
+            self.known_tracks = None
+            # Количество любимых треков плейлиста в базе после обновления любимых треков
+            self.liked_tracks_in_database = 0
+            self.folder_index = None
+            self.failed_tracks = set()
             self.mutex = threading.Lock()
-            self.analyzed_and_downloaded_tracks = {'a': 0, 'd': 0, 'u': 0, 'e': 0}
+            # Счётчики треков: a - обработано, d - скачано, u - обновлено, e - ошибки
+            self.metrics = RunMetrics(counters=('a', 'd', 'u', 'e'), labels={'playlist': playlist_title})
+            self.tracer = Tracer(enabled=config.TRACING_ENABLED)
+
+        @property
+        def analyzed_and_downloaded_tracks(self) -> dict:
+            """
+            Возвращает копию счётчиков треков
+            :return: словарь {'a': ..., 'd': ..., 'u': ..., 'e': ...}
+            """
+            return self.metrics.get_counters()
 
         def change_progress_bar_state(self):
             """
@@ -1310,16 +1838,30 @@ class YandexMusicDownloader:
             :return:
             """
             self.mutex.acquire()
+            analyzed_tracks = self.metrics.get_counters()['a']
             text = self.label_value['text'].split('(')[0].split(':')[0]
-            track_downloaded_digital = f'{self.analyzed_and_downloaded_tracks["a"]}/{self.number_tracks_in_playlist}'
-            track_downloaded_percentage = "{:0.2f} %".format(
-                self.analyzed_and_downloaded_tracks["a"] / self.number_tracks_in_playlist * 100)
+            track_downloaded_digital = f'{analyzed_tracks}/{self.number_tracks_in_playlist}'
+            # Пустой плейлист считается обработанным целиком
+            percentage = analyzed_tracks / self.number_tracks_in_playlist * 100 if self.number_tracks_in_playlist \
+                else 100
+            track_downloaded_percentage = "{:0.2f} %".format(percentage)
 
             self.label_value.config(
                 text=f'{text}: {track_downloaded_digital} [{track_downloaded_percentage}]')
-            self.progress_bar['value'] = self.analyzed_and_downloaded_tracks["a"] / self.number_tracks_in_playlist * 100
+            self.progress_bar['value'] = percentage
             self.mutex.release()
-            logger.debug(f'Значения прогресс бара для плейлиста [{self.playlist_title}] были изменены.')
+            logger.debug('Значения прогресс бара для плейлиста [%s] были изменены.', self.playlist_title)
+
+        @contextlib.contextmanager
+        def _stage(self, stage: str, **args):
+            """
+            Замеряет этап обработки трека для метрик и трассировки
+            :param stage: этап (RunMetrics.TRANSFER и т.д.)
+            :param args: дополнительные сведения для трассировки
+            :return: замер, в котором можно указать размер переданных данных
+            """
+            with self.tracer.span(stage, **args), self.metrics.measure(stage) as measurement:
+                yield measurement
 
         def _is_track_liked(self, track_id) -> bool:
             """
@@ -1327,10 +1869,69 @@ class YandexMusicDownloader:
             :param track_id: идентификатор трека
             :return:
             """
-            for track in self.liked_tracks:
-                if track_id == track.id:
-                    return True
-            return False
+            return str(track_id).split(':')[0] in self.liked_track_ids
+
+        async def call_with_retries(self, func, *args, **kwargs):
+            """
+            Выполняет сетевой запрос с повторами после временных ошибок через предохранитель плейлиста
+            :param func: асинхронная функция запроса
+            :return: результат запроса
+            """
+            return await call_with_retries(func, *args,
+                                           attempts=config.RETRY_ATTEMPTS,
+                                           base_delay=config.RETRY_BASE_DELAY,
+                                           max_delay=config.RETRY_MAX_DELAY,
+                                           breaker=self.circuit_breaker,
+                                           on_failure=lambda e: self.concurrency_controller.record_failure(),
+                                           **kwargs)
+
+        async def fetch_download_info(self, track: Track) -> list:
+            """
+            Запрашивает информацию о загрузке трека с повторами
+            :param track: трек
+            :return: список DownloadInfo
+            """
+            with self._stage(RunMetrics.DOWNLOAD_INFO, track_id=get_track_key(track)):
+                return await self.call_with_retries(track.get_download_info_async)
+
+        @staticmethod
+        async def _download_track_file(track: Track, full_track_name: str, codec: str, bitrate: int):
+            """
+            Скачивает аудиофайл трека. Пока загрузка не завершена, файл лежит рядом в .part файле со своим кодеком
+            и битрейтом в имени, и повторная попытка с тем же качеством продолжает его с места обрыва.
+            :param track: трек
+            :param full_track_name: путь к итоговому файлу
+            :param codec: кодек
+            :param bitrate: битрейт
+            :return:
+            """
+            if track.download_info is None:
+                await track.get_download_info_async()
+            info = next((download_info for download_info in track.download_info
+                         if download_info.codec == codec and download_info.bitrate_in_kbps == bitrate), None)
+            if info is None:
+                raise InvalidBitrateError(f'Трек недоступен с кодеком [{codec}] и битрейтом [{bitrate}]')
+
+            try:
+                if info.direct_link is None:
+                    await info.get_direct_link_async()
+                await track.client.request.download(info.direct_link, full_track_name,
+                                                    part_filename=get_part_filename(full_track_name, codec, bitrate))
+            except (NetworkError, TimeoutError):
+                # Прямая ссылка действует недолго, поэтому повторная попытка запросит новую
+                for download_info in track.download_info or []:
+                    download_info.direct_link = None
+                raise
+
+        async def _get_download_info(self, track: Track) -> list:
+            """
+            Возвращает информацию о загрузке трека, по возможности из кэша упреждающей подгрузки
+            :param track: трек
+            :return: список DownloadInfo
+            """
+            if self.download_info_cache is not None:
+                return await self.download_info_cache.get(track)
+            return await self.fetch_download_info(track)
 
         def _get_track_name(self, track: Track, need_strip: bool = True, strip_soft_mode: bool = False) -> tuple:
             """
@@ -1353,11 +1954,11 @@ class YandexMusicDownloader:
 
             return track_name, track_artists, track_title
 
-        def download_track(self, track: Track):
+        async def download_track(self, track: Track) -> bool:
             """
             Скачивает полученный трек, параллельно добавляя о нём всю доступную информацию в базу данных.
             :param track: текущий трек
-            :return:
+            :return: True - если трек обработан, False - если обработка прервана сигналом на завершение
             """
             try:
                 track_name, _, track_title = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
@@ -1365,52 +1966,65 @@ class YandexMusicDownloader:
                 if not self.main_thread_state() or not self.child_thread_state():
                     logger.debug('Основное окно или окно загрузки получило сигнал на завершение, начинаю подготовку '
                                  'к прекращению работы.')
-                    return
+                    return False
 
                 if self.download_only_new:
-                    if self._is_track_in_database(track=track):
-                        logger.debug(f'Трек [{track_name}] уже существует в базе '
-                                     f'[{self.history_database_path}]. Так как включён мод ONLY_NEW, выхожу.')
-                        return
+                    if self._is_track_in_database(track):
+                        logger.debug('Трек [%s] уже существует в базе '
+                                     '[%s]. Так как включён мод ONLY_NEW, выхожу.',
+                                     track_name, self.history_database_path)
+                        self.run_log.skipped(get_track_key(track), track_name, 'Трек уже есть в базе данных')
+                        return True
                     else:
-                        logger.debug(f'Трека [{track_name}] нет в базе '
-                                     f'[{self.history_database_path}]. Подготавливаюсь к его загрузки.')
+                        logger.debug('Трека [%s] нет в базе '
+                                     '[%s]. Подготавливаюсь к его загрузки.', track_name, self.history_database_path)
 
                 if not track.available:
-                    logger.error(f'Трек [{track_name}] недоступен.')
-                    with open(self.filenames['e'], 'a', encoding='utf-8') as file:
-                        file.write(f"{track_name} ~ Трек недоступен\n")
-                    self.analyzed_and_downloaded_tracks["e"] += 1
-                    return
+                    logger.error('Трек [%s] недоступен.', track_name)
+                    self.run_log.error(get_track_key(track), track_name, 'Трек недоступен')
+                    self.metrics.increment('e')
+                    return True
+
+                # Трек уже скачан и есть в базе, поэтому информация о загрузке не нужна
+                if not self.is_rewritable and self._is_track_on_disk(track_name) and \
+                        self._is_track_in_database(track):
+                    logger.debug('Трек [%s] уже существует на диске [%s] и в базе [%s]. Так как отключена '
+                                 'перезапись, выхожу.', track_name, self.download_folder_path,
+                                 self.history_database_path)
+                    self.run_log.skipped(get_track_key(track), track_name, 'Трек уже есть на диске')
+                    return True
 
                 was_track_downloaded = False
                 track_exists = False
-                for info in sorted(track.get_download_info(), key=lambda x: x['bitrate_in_kbps'], reverse=True):
+                download_info = await self._get_download_info(track)
+                for info in sorted(download_info, key=lambda x: x['bitrate_in_kbps'], reverse=True):
                     codec = info.codec
                     bitrate = info.bitrate_in_kbps
                     full_track_name = os.path.abspath(f'{self.download_folder_path}/{track_name}.{codec}')
 
                     # Если трек существует и мы не перезаписываем, то выходим, но скачала проеверяем, есть ли он в базе
-                    if os.path.exists(f'{full_track_name}') and not self.is_rewritable:
+                    if self.folder_index.exists(full_track_name) and not self.is_rewritable:
                         if not self.main_thread_state() or not self.child_thread_state():
                             logger.debug('Основное окно или окно загрузки получило сигнал на завершение, '
                                          'начинаю подготовку к прекращению работы.')
-                            return
+                            return False
 
-                        logger.debug(f'Трек [{track_name}] уже существует на диске '
-                                     f'[{self.download_folder_path}]. Проверяю в базе.')
+                        logger.debug('Трек [%s] уже существует на диске '
+                                     '[%s]. Проверяю в базе.', track_name, self.download_folder_path)
 
                         if self._is_track_in_database(track):
-                            logger.debug(f'Трек [{track_name}] уже существует в базе '
-                                         f'[{self.history_database_path}]. Так как отключена перезапись, выхожу.')
+                            logger.debug('Трек [%s] уже существует в базе '
+                                         '[%s]. Так как отключена перезапись, выхожу.',
+                                         track_name, self.history_database_path)
                         else:
-                            logger.debug(f'Трек [{track_name}] отсутствует в базе '
-                                         f'[{self.history_database_path}]. Так как отключена перезапись, просто '
-                                         f'добавляю его в базу и выхожу.')
-                            self._add_track_to_database(track=track, codec=codec, bit_rate=bitrate,
-                                                        is_favorite=self._is_track_liked(track.id))
+                            logger.debug('Трек [%s] отсутствует в базе '
+                                         '[%s]. Так как отключена перезапись, просто '
+                                         'добавляю его в базу и выхожу.', track_name, self.history_database_path)
+                            self._add_track_to_database(track=track, codec=codec,
+                                                        bit_rate=bitrate, is_favorite=self._is_track_liked(track.id))
                             logger.debug(
-                                f'Трек [{track_name}] был добавлен в базу данных [{self.history_database_path}].')
+                                'Трек [%s] был добавлен в базу данных [%s].', track_name, self.history_database_path)
+                        self.run_log.skipped(get_track_key(track), track_name, 'Трек уже есть на диске')
                         track_exists = True
                         break
 
@@ -1418,152 +2032,161 @@ class YandexMusicDownloader:
                         if not self.main_thread_state() or not self.child_thread_state():
                             logger.debug('Основное окно или окно загрузки получило сигнал на завершение, '
                                          'начинаю подготовку к прекращению работы.')
-                            return
+                            return False
 
-                        logger.debug(f'Начинаю загрузку трека [{track_name}].')
-                        track.download(filename=full_track_name, codec=codec, bitrate_in_kbps=bitrate)
-                        logger.debug(f'Трек [{track_name}] был скачан.')
+                        logger.debug('Начинаю загрузку трека [%s].', track_name)
+                        with self._stage(RunMetrics.TRANSFER, codec=codec, bitrate=bitrate) as measurement:
+                            await self.call_with_retries(self._download_track_file, track=track,
+                                                         full_track_name=full_track_name, codec=codec,
+                                                         bitrate=bitrate)
+                            measurement.size = os.path.getsize(full_track_name)
+                        self.folder_index.add(full_track_name)
+                        logger.debug('Трек [%s] был скачан.', track_name)
 
-                        self.mutex.acquire()
-                        with open(f'{self.filenames["d"]}', 'a', encoding='utf-8') as file:
-                            file.write(f'{self.analyzed_and_downloaded_tracks["d"]}] {track_name}\n')
-                        self.mutex.release()
+                        self.run_log.downloaded(get_track_key(track), track_name,
+                                                self.analyzed_and_downloaded_tracks['d'])
 
                         cover_filename = os.path.abspath(f'{self.download_folder_path}/covers/{track_name}.jpg')
-                        track.download_cover(cover_filename, size="300x300")
-                        logger.debug(f'Обложка для трека [{track_name}] была скачана в [{cover_filename}].')
+                        with self._stage(RunMetrics.COVER) as measurement:
+                            await self.call_with_retries(track.download_cover_async, cover_filename, size="300x300")
+                            measurement.size = os.path.getsize(cover_filename)
+                        self.folder_index.add(cover_filename)
+                        logger.debug('Обложка для трека [%s] была скачана в [%s].', track_name, cover_filename)
 
                         try:
-                            lyrics = track.get_supplement().lyrics
-                            self._write_track_metadata(full_track_name=full_track_name,
-                                                       track_title=track_title,
-                                                       artists=track.artists,
-                                                       albums=track.albums,
-                                                       genre=track.albums[0].genre,
-                                                       album_artists=track.albums[0].artists,
-                                                       year=track.albums[0]['year'],
-                                                       cover_filename=cover_filename,
-                                                       track_position=track.albums[0].track_position.index,
-                                                       disk_number=track.albums[0].track_position.volume,
-                                                       lyrics=lyrics)
-                            logger.debug(f'Метаданные трека [{track_name}] были обновлены.')
+                            with self._stage(RunMetrics.LYRICS):
+                                lyrics = (await self.call_with_retries(track.get_supplement_async)).lyrics
+                            with self._stage(RunMetrics.TAGGING):
+                                await asyncio.to_thread(self._write_track_metadata, full_track_name=full_track_name,
+                                                           track_title=track_title,
+                                                           artists=track.artists,
+                                                           albums=track.albums,
+                                                           genre=track.albums[0].genre,
+                                                           album_artists=track.albums[0].artists,
+                                                           year=track.albums[0]['year'],
+                                                           cover_filename=cover_filename,
+                                                           track_position=track.albums[0].track_position.index,
+                                                           disk_number=track.albums[0].track_position.volume,
+                                                           lyrics=lyrics)
+                            logger.debug('Метаданные трека [%s] были обновлены.', track_name)
                         except AttributeError:
-                            logger.error(f'Не удалось обновить метаданные для файла [{full_track_name}].')
+                            logger.error('Не удалось обновить метаданные для файла [%s].', full_track_name)
                         except TypeError:
-                            logger.error(f'Не удалось обновить метаданные для файла [{full_track_name}].')
+                            logger.error('Не удалось обновить метаданные для файла [%s].', full_track_name)
 
-                        if not self._is_track_in_database(track=track):
-                            logger.debug(f'Трек [{track_name}] отсутствует в базе данных по пути '
-                                         f'[{self.history_database_path}]. Добавляю в базу.')
-                            self._add_track_to_database(track=track, codec=codec, bit_rate=bitrate,
-                                                        is_favorite=self._is_track_liked(track.id))
+                        if not self._is_track_in_database(track):
+                            logger.debug('Трек [%s] отсутствует в базе данных по пути '
+                                         '[%s]. Добавляю в базу.', track_name, self.history_database_path)
+                            self._add_track_to_database(track=track, codec=codec,
+                                                        bit_rate=bitrate, is_favorite=self._is_track_liked(track.id))
                             logger.debug(
-                                f'Трек [{track_name}] был добавлен в базу данных [{self.history_database_path}].')
+                                'Трек [%s] был добавлен в базу данных [%s].', track_name, self.history_database_path)
                         else:
-                            logger.debug(f'Трек [{track_name}] уже присутствует в базе данных по пути '
-                                         f'[{self.history_database_path}].')
+                            logger.debug('Трек [%s] уже присутствует в базе данных по пути '
+                                         '[%s].', track_name, self.history_database_path)
 
-                        self.mutex.acquire()
-                        self.analyzed_and_downloaded_tracks["d"] += 1
-                        self.mutex.release()
+                        self.metrics.increment('d')
                         was_track_downloaded = True
                         break
-                    except (YandexMusicError, TimeoutError):
+                    except (YandexMusicError, TimeoutError) as e:
+                        # Повторы уже исчерпаны, и при сетевой ошибке другой битрейт не поможет
+                        if is_transient_error(e):
+                            raise
                         logger.debug(
-                            f'Не удалось скачать трек [{track_name}] с кодеком [{codec}] и битрейтом [{bitrate}].')
+                            'Не удалось скачать трек [%s] с кодеком [%s] и битрейтом [%s].', track_name, codec, bitrate)
                         continue
 
                 if not was_track_downloaded:
                     if not track_exists:
-                        logger.error(f'Не удалось скачать трек [{track_name}].')
-                        with open(self.filenames['e'], 'a', encoding='utf-8') as file:
-                            file.write(f"{track_name} ~ Не удалось скачать трек\n")
-                        self.analyzed_and_downloaded_tracks["e"] += 1
+                        logger.error('Не удалось скачать трек [%s].', track_name)
+                        self.run_log.error(get_track_key(track), track_name, 'Не удалось скачать трек')
+                        self.metrics.increment('e')
+
+            except (NetworkError, TimeoutError):
+                logger.error('Не удалось скачать трек [%s] из-за ошибки сети.', track_name)
+                self.failed_tracks.add(get_track_key(track))
+                self.run_log.error(get_track_key(track), track_name, 'Ошибка сети')
+                self.metrics.increment('e')
 
             except IOError:
-                logger.error(f'Ошибка при попытке записи в один из файлов [{self.filenames["e"]}] или '
-                             f'[{self.filenames["d"]}].')
-                self.analyzed_and_downloaded_tracks["e"] += 1
+                logger.error('Ошибка записи на диск при загрузке трека [%s].', track_name)
+                self.run_log.error(get_track_key(track), track_name, 'Ошибка записи на диск')
+                self.metrics.increment('e')
 
             finally:
-                self.analyzed_and_downloaded_tracks["a"] += 1
+                self.metrics.increment('a')
+            return True
 
         def _is_track_in_database(self, track: Track) -> bool:
             """
-            Ищет трек в базе данных
+            Ищет трек в базе данных (по загруженному в начале запуска списку известных треков плейлиста)
             :param track: трек
             :return: True - если нашел, False - если нет.
             """
-            _playlist_name = self.playlist_title.replace(' ', '_')
-            _playlist_name = f'table_{_playlist_name}'
             track_name, track_artists, track_title = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
 
-            logger.debug(f'Ищу трек [{track_name}] в базе [{self.history_database_path}].')
-            try:
-                with sqlite3.connect(self.history_database_path) as con:
-                    cursor = con.cursor()
-                    request = f"SELECT * FROM {_playlist_name} WHERE track_id == ? " \
-                              f"OR (track_name == ? " \
-                              f"AND artist_name == ?);"
-                    result = cursor.execute(request, [track.id, track_title, track_artists])
-                    return True if result.fetchone() else False
-            except sqlite3.Error:
-                logger.error(f'Трек [{track_name}] не удалось проверить в базе данных!')
+            logger.debug('Ищу трек [%s] в базе [%s].', track_name, self.history_database_path)
+            return self.known_tracks.contains(track.id, track_title, track_artists)
+
+        def _is_track_on_disk(self, track_name: str) -> bool:
+            """
+            Проверяет, скачан ли уже трек с любым кодеком
+            :param track_name: название трека без расширения
+            :return: True - если файл есть, False - если нет.
+            """
+            return self.folder_index.exists_with_any_extension(os.path.join(self.download_folder_path, track_name))
+
+        def needs_download_info(self, track: Track) -> bool:
+            """
+            Проверяет, понадобится ли обработчику информация о загрузке трека (проверки те же, что и при обработке)
+            :param track: трек
+            :return: True - если понадобится, False - если трек будет пропущен без неё.
+            """
+            if not track.available:
+                return False
+            if self.update_mode:
+                return True
+            if not self._is_track_in_database(track):
                 return True
+            if self.only_add_to_database or self.download_only_new:
+                return False
+            track_name, _, _ = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
+            return self.is_rewritable or not self._is_track_on_disk(track_name)
 
         def _add_track_to_database(self, track: Track, codec: str, bit_rate: int, is_favorite: int):
             """
-            Добавляет трек в базу данных
+            Ставит добавление трека в очередь записи в базу данных
             :param track: трек
             :param codec: кодек трека
             :param bit_rate: битрейт трека
             :param is_favorite: есть ли трек в списке любимых
             :return:
             """
-            _playlist_name = self.playlist_title.replace(' ', '_')
-            _playlist_name = f'table_{_playlist_name}'
             track_name, track_artists, track_title = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
 
-            logger.debug(f'Добавляю трек [{track_name}] в базу [{self.history_database_path}].')
-
-            con = None
-            metadata = []
-            try:
-                con = sqlite3.connect(self.history_database_path)
-                cursor = con.cursor()
-                request = f"INSERT INTO {_playlist_name}(" \
-                          f"track_id, artist_id, album_id, track_name, artist_name, album_name, genre, track_number, " \
-                          f"disk_number, year, release_data, bit_rate, codec, is_favorite, is_explicit, is_popular) " \
-                          f"VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);"
-
-                track_id = int(track.id)
-                artist_id = ', '.join(str(i.id) for i in track.artists)
-                album_id = ', '.join(str(i.id) for i in track.albums)
-                track_name = track_title
-                artist_name = track_artists
-                album_name = ', '.join(i.title for i in track.albums)
-                genre = track.albums[0].genre
-                track_number = track.albums[0].track_position.index
-                disk_number = track.albums[0].track_position.volume
-                year = track.albums[0].year
-                release_data = track.albums[0].release_date
-                is_explicit = True if track.content_warning is not None else False
-                is_popular = True if int(track.id) in track.albums[0].bests else False
-
-                metadata = [track_id, artist_id, album_id, track_name, artist_name, album_name,
-                            genre, track_number, disk_number, year, release_data, bit_rate, codec,
-                            is_favorite, is_explicit, is_popular]
-
-                cursor.execute(request, metadata)
-                con.commit()
-
-            except sqlite3.Error:
-                logger.error(f'Не удалось выполнить SQL запрос вставки. Данные: [{metadata}].')
-                if con is not None:
-                    con.rollback()
-            finally:
-                if con is not None:
-                    con.close()
+            logger.debug('Добавляю трек [%s] в базу [%s].', track_name, self.history_database_path)
+
+            track_id = int(track.id)
+            album = track.albums[0]
+            album_id = str(album.id)
+            is_explicit = True if track.content_warning is not None else False
+            is_popular = True if track_id in album.bests else False
+
+            # Метаданные трека, альбома и исполнителей записываются один раз на всю библиотеку, а повторная вставка
+            # (тот же трек в другом плейлисте или из двух обработчиков сразу) просто игнорируется.
+            # Ошибку запроса сообщит поток-писатель.
+            self.database.execute(library.INSERT_ALBUM, [album_id, album.title, album.genre, album.year,
+                                                         album.release_date])
+            for position, artist in enumerate(track.artists):
+                self.database.execute(library.INSERT_ARTIST, [str(artist.id), artist.name])
+                self.database.execute(library.INSERT_TRACK_ARTIST, [track_id, str(artist.id), position])
+            self.database.execute(library.INSERT_TRACK, [track_id, album_id, track_title, track_artists,
+                                                         album.track_position.index, album.track_position.volume,
+                                                         is_favorite, is_explicit, is_popular])
+            if is_favorite:
+                self.database.execute(library.UPDATE_FAVORITE, [1, track_id])
+            self.database.execute(library.INSERT_PLAYLIST_TRACK, [self.playlist_kind, track_id, bit_rate, codec])
+            self.known_tracks.add(track_id, track_title, track_artists)
 
         @staticmethod
         def _write_track_metadata(full_track_name, track_title, artists, albums, genre, album_artists, year,
@@ -1610,130 +2233,102 @@ class YandexMusicDownloader:
                 file.tags.add(USLT(encoding=3, text=lyrics.full_lyrics))
             file.save()
 
-        def add_track_to_database(self, track: Track):
+        async def add_track_to_database(self, track: Track) -> bool:
             """
             Добавляет текущий трек в базу данных, если его там нет
             :param track: текущий трек
-            :return:
+            :return: True - если трек обработан, False - если обработка прервана сигналом на завершение
             """
             track_name, _, _ = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
 
             if not track.available:
-                logger.error(f'Трек [{track_name}] недоступен!')
-                self.analyzed_and_downloaded_tracks["a"] += 1
-                self.analyzed_and_downloaded_tracks["e"] += 1
-                return
+                logger.error('Трек [%s] недоступен!', track_name)
+                self.metrics.increment('a')
+                self.metrics.increment('e')
+                return True
 
             if not self._is_track_in_database(track):
-                info = sorted(track.get_download_info(), key=lambda x: x['bitrate_in_kbps'], reverse=True)[0]
+                download_info = await self._get_download_info(track)
+                info = sorted(download_info, key=lambda x: x['bitrate_in_kbps'], reverse=True)[0]
                 codec = info.codec
                 bitrate = info.bitrate_in_kbps
 
-                logger.debug(f'Трек [{track_name}] отсутствует в базе [{self.history_database_path}].')
+                logger.debug('Трек [%s] отсутствует в базе [%s].', track_name, self.history_database_path)
                 self._add_track_to_database(track=track, codec=codec, bit_rate=bitrate,
                                             is_favorite=self._is_track_liked(track.id))
-                self.analyzed_and_downloaded_tracks["u"] += 1
-                logger.debug(f'Трек [{track_name}] был добавлен в базу данных [{self.history_database_path}].')
+                self.metrics.increment('u')
+                logger.debug('Трек [%s] был добавлен в базу данных [%s].', track_name, self.history_database_path)
             else:
-                logger.debug(f'Трек [{track_name}] уже существует в базе [{self.history_database_path}].')
+                logger.debug('Трек [%s] уже существует в базе [%s].', track_name, self.history_database_path)
 
-            self.analyzed_and_downloaded_tracks["a"] += 1
+            self.metrics.increment('a')
+            return True
 
-        def update_track_metadata(self, track: Track):
+        async def update_track_metadata(self, track: Track) -> bool:
             """
             Обновляет метаданные трека
             :param track: текущий трек
-            :return:
+            :return: True - если трек обработан, False - если обработка прервана сигналом на завершение
             """
             track_name, _, track_title = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
 
             if not self.main_thread_state() or not self.child_thread_state():
                 logger.debug('Основное окно или окно загрузки получило сигнал на завершение, начинаю подготовку '
                              'к прекращению работы.')
-                return
+                return False
 
             if not track.available:
-                logger.error(f'Трек [{track_name}] недоступен.')
-                self.analyzed_and_downloaded_tracks["a"] += 1
-                self.analyzed_and_downloaded_tracks["e"] += 1
-                return
+                logger.error('Трек [%s] недоступен.', track_name)
+                self.metrics.increment('a')
+                self.metrics.increment('e')
+                return True
 
-            for info in sorted(track.get_download_info(), key=lambda x: x['bitrate_in_kbps'], reverse=True):
+            download_info = await self._get_download_info(track)
+            for info in sorted(download_info, key=lambda x: x['bitrate_in_kbps'], reverse=True):
                 codec = info.codec
                 full_track_name = os.path.abspath(f'{self.download_folder_path}/{track_name}.{codec}')
+                if not self.folder_index.exists(full_track_name):
+                    # Файл мог быть скачан под старым названием (исполнитель или название трека изменились)
+                    full_track_name = self.folder_index.find_by_track_id(get_track_key(track), codec) or full_track_name
 
                 # Если трек существует и мы не перезаписываем, то выходим, но скачала проеверяем, есть ли он в базе
-                if os.path.exists(f'{full_track_name}'):
-                    logger.debug(f'Трек [{track_name}] присутствует на диске '
-                                 f'[{self.download_folder_path}]. Пытаюсь обновить метаданные.')
+                if self.folder_index.exists(full_track_name):
+                    logger.debug('Трек [%s] присутствует на диске '
+                                 '[%s]. Пытаюсь обновить метаданные.', track_name, self.download_folder_path)
 
                     cover_filename = os.path.abspath(f'{self.download_folder_path}/covers/{track_name}.jpg')
-                    if not os.path.exists(cover_filename):
-                        logger.debug(f'Обложка для трека [{track_name}] не найдена, начинаю загрузку.')
-                        track.download_cover(cover_filename, size="300x300")
-                        logger.debug(f'Обложка для трека [{track_name}] была скачана в [{cover_filename}].')
+                    if not self.folder_index.exists(cover_filename):
+                        logger.debug('Обложка для трека [%s] не найдена, начинаю загрузку.', track_name)
+                        with self._stage(RunMetrics.COVER) as measurement:
+                            await self.call_with_retries(track.download_cover_async, cover_filename, size="300x300")
+                            measurement.size = os.path.getsize(cover_filename)
+                        self.folder_index.add(cover_filename)
+                        logger.debug('Обложка для трека [%s] была скачана в [%s].', track_name, cover_filename)
                     try:
-                        lyrics = track.get_supplement().lyrics
-                        self._write_track_metadata(full_track_name=full_track_name,
-                                                   track_title=track_title,
-                                                   artists=track.artists,
-                                                   albums=track.albums,
-                                                   genre=track.albums[0].genre,
-                                                   album_artists=track.albums[0].artists,
-                                                   year=track.albums[0]['year'],
-                                                   cover_filename=cover_filename,
-                                                   track_position=track.albums[0].track_position.index,
-                                                   disk_number=track.albums[0].track_position.volume,
-                                                   lyrics=lyrics)
-                        logger.debug(f'Метаданные трека [{track_name}] были обновлены.')
+                        with self._stage(RunMetrics.LYRICS):
+                            lyrics = (await self.call_with_retries(track.get_supplement_async)).lyrics
+                        with self._stage(RunMetrics.TAGGING):
+                            await asyncio.to_thread(self._write_track_metadata, full_track_name=full_track_name,
+                                                       track_title=track_title,
+                                                       artists=track.artists,
+                                                       albums=track.albums,
+                                                       genre=track.albums[0].genre,
+                                                       album_artists=track.albums[0].artists,
+                                                       year=track.albums[0]['year'],
+                                                       cover_filename=cover_filename,
+                                                       track_position=track.albums[0].track_position.index,
+                                                       disk_number=track.albums[0].track_position.volume,
+                                                       lyrics=lyrics)
+                        logger.debug('Метаданные трека [%s] были обновлены.', track_name)
                     except AttributeError:
-                        logger.error(f'Не удалось обновить метаданные для файла [{full_track_name}].')
+                        logger.error('Не удалось обновить метаданные для файла [%s].', full_track_name)
                     except TypeError:
-                        logger.error(f'Не удалось обновить метаданные для файла [{full_track_name}].')
+                        logger.error('Не удалось обновить метаданные для файла [%s].', full_track_name)
 
-                    self.analyzed_and_downloaded_tracks['u'] += 1
+                    self.metrics.increment('u')
                     break
-            self.analyzed_and_downloaded_tracks['a'] += 1
-
-        def update_liked_track_in_database(self, track: Track):
-            """
-            Обновляет список любимых треков в базе данных
-            :param track: трек
-            :return:
-            """
-            track_name, _, _ = self._get_track_name(track, need_strip=True, strip_soft_mode=True)
-
-            if not self._is_track_liked(track.id):
-                self.analyzed_and_downloaded_tracks["a"] += 1
-                logger.debug(f"Трек [{track_name}] не является любимым.")
-                return
-
-            con = None
-            request = ''
-            _playlist_name = self.playlist_title.replace(' ', '_')
-            _playlist_name = f'table_{_playlist_name}'
-
-            try:
-                if not self._is_track_in_database(track):
-                    logger.debug(f"Трека [{track_name}] нет в базе данных!")
-                    return
-
-                con = sqlite3.connect(self.history_database_path)
-                cursor = con.cursor()
-                request = f"UPDATE {_playlist_name} SET is_favorite = ? WHERE track_id == ?;"
-                cursor.execute(request, [1, track.id])
-                con.commit()
-
-                logger.debug(f'Трек [{track_name}] был добавлен в любимые.')
-                self.analyzed_and_downloaded_tracks["u"] += 1
-            except sqlite3.Error:
-                logger.error(f'Не удалось выполнить SQL запрос обновления. Запрос: [{request}].')
-                if con is not None:
-                    con.rollback()
-            finally:
-                if con is not None:
-                    con.close()
-                self.analyzed_and_downloaded_tracks["a"] += 1
+            self.metrics.increment('a')
+            return True
 
         def _update_track_name(self, track: Track):
             """
@@ -1754,38 +2349,55 @@ class YandexMusicDownloader:
                 try:
                     os.rename(f'{self.download_folder_path}/{old_track_name}.mp3',
                               f'{self.download_folder_path}/{new_track_name}.mp3')
-                    logger.debug(f'Файл был успешно переименован из [{old_track_name}] в [{new_track_name}].')
-                    self.mutex.acquire()
-                    self.analyzed_and_downloaded_tracks['a'] += 1
-                    self.mutex.release()
+                    logger.debug('Файл был успешно переименован из [%s] в [%s].', old_track_name, new_track_name)
+                    self.metrics.increment('a')
                 except Exception:
-                    logger.error(f'Не удалось переименовать файл [{old_track_name}] в [{new_track_name}].')
+                    logger.error('Не удалось переименовать файл [%s] в [%s].', old_track_name, new_track_name)
 
-    class DownloaderWorker(threading.Thread):
-        is_network_error = False
-        _network_error_was_showed = False
+    class DownloaderWorker:
+        # Стоп-сигнал, по которому обработчик выходит из цикла обработки
+        STOP = object()
 
-        def __init__(self, queue: Queue, helper):
-            threading.Thread.__init__(self)
+        def __init__(self, queue: asyncio.Queue, helper, worker_id: int):
             self.queue = queue
             self.helper = helper
-            self.is_finished = False
+            self.worker_id = worker_id
+
+            self.idle_time = 0.0
+            self.busy_time = 0.0
+            self.processed_tracks = 0
 
-        def run(self):
+        def get_statistics(self) -> dict:
+            """
+            Возвращает счётчики работы обработчика
+            :return: {'idle': время ожидания, 'busy': время работы, 'processed': количество обработанных треков}
+            """
+            return {'idle': self.idle_time, 'busy': self.busy_time, 'processed': self.processed_tracks}
+
+        async def run(self):
+            """
+            Асинхронный цикл обработки треков из очереди. Обработчик спит на очереди до появления трека
+            и завершается, получив стоп-сигнал.
+            :return:
+            """
+            self.helper.tracer.set_lane(self.worker_id + 1, f'Обработчик {self.worker_id}')
             while True:
-                if self.is_finished:
-                    logger.debug('Выхожу из цикла обработки')
-                    break
+                idle_started = time.perf_counter()
+                track = await self.queue.get()
+                busy_started = time.perf_counter()
+                self.idle_time += busy_started - idle_started
 
-                try:
-                    track = self.queue.get(block=False)
-                    logger.debug('Получил данные из очереди.')
-                except Empty:
-                    continue
+                if track is self.STOP:
+                    self.queue.task_done()
+                    logger.debug('Обработчик [%s] получил стоп-сигнал и выходит из цикла обработки.', self.worker_id)
+                    break
 
+                is_processed = False
                 try:
-                    if not self.helper.main_thread_state() or not self.helper.child_thread_state() or self.is_finished:
-                        break
+                    # Если окно закрывается или сеть так и не восстановилась, то оставшиеся треки пропускаются
+                    if not self.helper.main_thread_state() or not self.helper.child_thread_state() or \
+                            self.helper.circuit_breaker.is_broken:
+                        continue
 
                     track_name, _, _ = self.helper._get_track_name(track, need_strip=True, strip_soft_mode=True)
 
@@ -1793,53 +2405,57 @@ class YandexMusicDownloader:
                     # self.helper._update_track_name(track)
                     # logger.debug(f'Обновление трека [{track_name}] завершено.')
 
-                    if self.helper.update_mode:
-                        logger.debug(f'Подготовка к началу обновления трека [{track_name}].')
-                        self.helper.update_track_metadata(track)
-                        logger.debug(f'Обновление трека [{track_name}] завершено.')
-                    elif self.helper.update_liked:
-                        logger.debug(f'Анализирую трек [{track_name}].')
-                        self.helper.update_liked_track_in_database(track)
-                        logger.debug(f'Анализ трека [{track_name}] завершен.')
-                    elif self.helper.only_add_to_database:
-                        logger.debug(f'Подготовка к началу добавления трека [{track_name}] в базу данных '
-                                     f'[{self.helper.history_database_path}].')
-                        self.helper.add_track_to_database(track)
-                        logger.debug(f'Добавление трека [{track_name}] в базу данных '
-                                     f'[{self.helper.history_database_path}] завершено.')
-                    else:
-                        logger.debug(f'Подготовка к началу загрузки трека [{track_name}].')
-                        self.helper.download_track(track)
-                        logger.debug(f'Загрузка трека [{track_name}] завершена.')
+                    # Интервал трека включает ожидание свободного места в пределе параллельности
+                    with self.helper.tracer.span('track', track_id=get_track_key(track), track=track_name):
+                        async with self.helper.concurrency_controller.slot():
+                            if self.helper.update_mode:
+                                logger.debug('Подготовка к началу обновления трека [%s].', track_name)
+                                is_processed = await self.helper.update_track_metadata(track)
+                                logger.debug('Обновление трека [%s] завершено.', track_name)
+                            elif self.helper.only_add_to_database:
+                                logger.debug('Подготовка к началу добавления трека [%s] в базу данных '
+                                             '[%s].', track_name, self.helper.history_database_path)
+                                is_processed = await self.helper.add_track_to_database(track)
+                                logger.debug('Добавление трека [%s] в базу данных '
+                                             '[%s] завершено.', track_name, self.helper.history_database_path)
+                            else:
+                                logger.debug('Подготовка к началу загрузки трека [%s].', track_name)
+                                is_processed = await self.helper.download_track(track)
+                                logger.debug('Загрузка трека [%s] завершена.', track_name)
 
-                    if not self.helper.main_thread_state() or not self.helper.child_thread_state() or self.is_finished:
-                        break
+                    # Трек, обработка которого завершилась до сигнала на завершение, попадает в журнал как
+                    # обработанный, иначе продолженный запуск обработал бы его ещё раз
+                    if not self.helper.main_thread_state() or not self.helper.child_thread_state():
+                        continue
 
                     self.helper.change_progress_bar_state()
-                    logger.debug(f'Програсс бар с учётом трека [{track_name}] изменён.')
+                    logger.debug('Програсс бар с учётом трека [%s] изменён.', track_name)
 
-                except NetworkError:
+                except (NetworkError, TimeoutError):
+                    # Повторы исчерпаны: трек считается необработанным, а остальные продолжают обрабатываться
                     logger.error('Не удалось связаться с сервисом Яндекс Музыка!')
-                    if not YandexMusicDownloader.DownloaderWorker._network_error_was_showed:
-                        YandexMusicDownloader.DownloaderWorker._network_error_was_showed = True
-                        messagebox.showerror('Ошибка', 'Не удалось связаться с сервисом Яндекс Музыка!'
-                                                       '\nПопробуйте позже.')
-                        YandexMusicDownloader.DownloaderWorker.is_network_error = True
-                    break
+                    self.helper.metrics.increment('a')
+                    self.helper.metrics.increment('e')
+                    self.helper.failed_tracks.add(get_track_key(track))
+                    is_processed = True
 
                 except Exception:
                     logger.error('Что-то пошло не так.')
 
                 finally:
+                    if self.helper.download_info_cache is not None:
+                        self.helper.download_info_cache.discard(track)
+                    # Трек с сетевой ошибкой при продолжении запуска будет обработан ещё раз
+                    if is_processed and self.helper.job is not None:
+                        status = JobJournal.FAILED if get_track_key(track) in self.helper.failed_tracks \
+                            else JobJournal.DONE
+                        try:
+                            await self.helper.job.set_status(track, status)
+                        except sqlite3.Error:
+                            logger.error('Не удалось записать состояние трека в журнал запусков!')
                     self.queue.task_done()
-
-            logger.debug(f'Начинаю отчищать очередь. Текущий размер очереди {self.queue.qsize()}.')
-            while not self.queue.empty():
-                self.queue.get()
-                self.queue.task_done()
-
-            logger.debug(f'Отчистил очередь. Текущий размер очереди {self.queue.qsize()}. '
-                         f'Количество невыполненных заданий {self.queue.unfinished_tasks}.')
+                    self.busy_time += time.perf_counter() - busy_started
+                    self.processed_tracks += 1
 
 
 def main():